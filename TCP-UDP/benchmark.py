@@ -0,0 +1,436 @@
+#
+# Copyright 2024 Jaroslav Chmurny
+#
+# This file is part of TCP/IP & DNS Sandbox.
+#
+# TCP/IP & DNS Sandbox is free software developed for educational purposes.
+# It is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from argparse import (
+    ArgumentParser,
+    Namespace,
+    RawTextHelpFormatter,
+)
+from dataclasses import (
+    asdict,
+    dataclass,
+)
+from datetime import (
+    datetime,
+    timezone,
+)
+from json import (
+    dump,
+    load,
+)
+from os.path import (
+    abspath,
+    dirname,
+    join,
+)
+from platform import (
+    platform,
+    python_version,
+)
+from socket import timeout
+from subprocess import (
+    DEVNULL,
+    Popen,
+    TimeoutExpired,
+)
+from struct import (
+    pack,
+    unpack,
+)
+from sys import (
+    executable,
+    exit,
+)
+from time import (
+    monotonic,
+    sleep,
+)
+from timeit import Timer
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+)
+
+from commons import (
+    _HEADER_FORMAT,
+    _HEADER_STRUCT,
+    _V2_HEADER_STRUCT,
+    BufferPool,
+    Endpoint,
+    Frame,
+    LatencyHistogram,
+    MessageType,
+    UDPSocket,
+    decode_frame,
+    encode_msg,
+    open_tcp_connection,
+    open_udp_client,
+)
+
+
+_TEXT_MSG = "Message #1234 from client 6f1c2a58-3c1e-4a8e-9d7a-0b4f2d1e9c77"
+
+_JSON_MSG = {
+    "client_name": "6f1c2a58-3c1e-4a8e-9d7a-0b4f2d1e9c77",
+    "sequence_number": 1234,
+    "timestamp": "2024-05-01T12:34:56.789",
+    "values": [1, 2, 3, 5, 8, 13, 21, 34],
+}
+
+_UDP_MSG_SIZE = 4096
+
+_UDP_BURST_SIZE = 32
+
+_SERVER_START_TIMEOUT_SEC = 10
+
+
+@dataclass(frozen=True)
+class BenchmarkResult:
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool = False
+
+
+class NullSocket:
+
+    # Stands in for the UDP socket of UDPSocket, so the benchmark of _send_msg covers
+    # the framing (incl. the padding) without the cost of the system call.
+
+    def sendto(self, data: bytes, address: tuple[str, int]) -> int:
+        return len(data)
+
+    def close(self) -> None:
+        ...
+
+
+def measure_ns_per_op(name: str, func: Callable[[], Any], repeat: int) -> BenchmarkResult:
+    # autorange finds the number of calls taking at least 0.2 sec; the best of the
+    # repetitions is the least disturbed by the rest of the system
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    best_sec = min(timer.repeat(repeat, number))
+    return BenchmarkResult(f"micro.{name}", round(best_sec / number * 1e9, 1), "ns/op")
+
+
+def run_micro_benchmarks(cmd_line_args: Namespace) -> List[BenchmarkResult]:
+    text_msg_type, text_payload = encode_msg(_TEXT_MSG)
+    json_msg_type, json_payload = encode_msg(_JSON_MSG)
+    text_frame = Frame(text_msg_type, memoryview(text_payload))
+    json_frame = Frame(json_msg_type, memoryview(json_payload))
+    header = _HEADER_STRUCT.pack(len(text_payload), text_msg_type)
+    v2_header = _V2_HEADER_STRUCT.pack(len(text_payload), text_msg_type)
+    destination = Endpoint("127.0.0.1", 9)
+    padded_socket = UDPSocket(NullSocket(), _UDP_MSG_SIZE)
+    unpadded_socket = UDPSocket(NullSocket(), _HEADER_STRUCT.size + len(json_payload))
+    variable_size_socket = UDPSocket(NullSocket(), _UDP_MSG_SIZE, padded=False)
+    buffer_pool = BufferPool()
+
+    cases = {
+        "header_pack": lambda: _HEADER_STRUCT.pack(len(text_payload), text_msg_type),
+        "header_unpack": lambda: _HEADER_STRUCT.unpack(header),
+        "header_pack_format_string": lambda: pack(_HEADER_FORMAT, len(text_payload), text_msg_type),
+        "header_unpack_format_string": lambda: unpack(_HEADER_FORMAT, header),
+        "v2_header_pack": lambda: _V2_HEADER_STRUCT.pack(len(text_payload), text_msg_type),
+        "v2_header_unpack": lambda: _V2_HEADER_STRUCT.unpack(v2_header),
+        "text_encode": lambda: encode_msg(_TEXT_MSG),
+        "text_decode": lambda: decode_frame(text_frame),
+        "json_encode": lambda: encode_msg(_JSON_MSG),
+        "json_decode": lambda: decode_frame(json_frame),
+        "udp_send_msg_padded": lambda: padded_socket._send_msg(destination, MessageType.JSON, json_payload),
+        "udp_send_msg_unpadded": lambda: unpadded_socket._send_msg(destination, MessageType.JSON, json_payload),
+        "udp_send_msg_variable_size": lambda: variable_size_socket._send_msg(destination, MessageType.JSON, json_payload),
+        "buffer_pool_acquire_release": lambda: buffer_pool.acquire(_UDP_MSG_SIZE).release(),
+    }
+    results = []
+    for name, func in cases.items():
+        result = measure_ns_per_op(name, func, cmd_line_args.repeat)
+        print(f"{result.name}: {result.value} {result.unit}")
+        results.append(result)
+    return results
+
+
+def start_server(script: str, port: int, *args: str) -> Popen:
+    # the per-message log lines are suppressed, so the server does not measure the terminal
+    command = [executable, join(dirname(abspath(__file__)), script), "127.0.0.1", str(port), "--log-sampling", "0", *args]
+    return Popen(command, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL)
+
+
+def stop_server(server: Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=5)
+    except TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def wait_for_tcp_server(port: int) -> None:
+    deadline = monotonic() + _SERVER_START_TIMEOUT_SEC
+    while True:
+        try:
+            open_tcp_connection("127.0.0.1", port, timeout_sec=1).close()
+            return
+        except ConnectionRefusedError:
+            if monotonic() > deadline:
+                raise
+            sleep(0.1)
+
+
+def wait_for_udp_server(client: UDPSocket, port: int) -> None:
+    destination = Endpoint("127.0.0.1", port)
+    deadline = monotonic() + _SERVER_START_TIMEOUT_SEC
+    client.set_timeout(0.1)
+    while True:
+        try:
+            client.send_text_msg(destination, "ping")
+            client.recv_text_msg()
+            return
+        except (timeout, ConnectionRefusedError):
+            if monotonic() > deadline:
+                raise
+
+
+def create_echo_results(name: str, msg_count: int, elapsed_sec: float, histogram: LatencyHistogram) -> List[BenchmarkResult]:
+    return [
+        BenchmarkResult(f"macro.{name}_throughput", round(msg_count / elapsed_sec, 1), "msg/sec", higher_is_better=True),
+        BenchmarkResult(f"macro.{name}_latency_p50", histogram.get_percentile(50), "usec"),
+        BenchmarkResult(f"macro.{name}_latency_p99", histogram.get_percentile(99), "usec"),
+    ]
+
+
+def run_tcp_echo_benchmark(cmd_line_args: Namespace) -> List[BenchmarkResult]:
+    # single connection, closed loop (the next message is sent when the response to
+    # the previous one has arrived), so the throughput is bound by the round trip time
+    server = start_server("tcp_server.py", cmd_line_args.tcp_port)
+    socket = None
+    try:
+        wait_for_tcp_server(cmd_line_args.tcp_port)
+        socket = open_tcp_connection("127.0.0.1", cmd_line_args.tcp_port, timeout_sec=5)
+        histogram = LatencyHistogram()
+        start_time = monotonic()
+        end_time = start_time + cmd_line_args.duration_sec
+        while monotonic() < end_time:
+            send_time = monotonic()
+            socket.send_text_msg(_TEXT_MSG)
+            socket.recv_text_msg(5)
+            histogram.record_sec(monotonic() - send_time)
+        return create_echo_results("tcp_echo", histogram.get_count(), monotonic() - start_time, histogram)
+    finally:
+        if socket:
+            socket.close()
+        stop_server(server)
+
+
+def run_udp_echo_benchmark(cmd_line_args: Namespace) -> List[BenchmarkResult]:
+    # like the TCP echo benchmark; a datagram without response within the timeout is
+    # counted as lost
+    server = start_server("udp_server.py", cmd_line_args.udp_port)
+    client = open_udp_client(_UDP_MSG_SIZE)
+    try:
+        wait_for_udp_server(client, cmd_line_args.udp_port)
+        destination = Endpoint("127.0.0.1", cmd_line_args.udp_port)
+        client.set_timeout(1)
+        histogram = LatencyHistogram()
+        lost_count = 0
+        start_time = monotonic()
+        end_time = start_time + cmd_line_args.duration_sec
+        while monotonic() < end_time:
+            send_time = monotonic()
+            client.send_text_msg(destination, _TEXT_MSG)
+            try:
+                client.recv_text_msg()
+                histogram.record_sec(monotonic() - send_time)
+            except timeout:
+                lost_count += 1
+        results = create_echo_results("udp_echo", histogram.get_count(), monotonic() - start_time, histogram)
+        return results + [BenchmarkResult("macro.udp_echo_lost", lost_count, "msgs")]
+    finally:
+        client.close()
+        stop_server(server)
+
+
+def run_udp_burst_benchmark(cmd_line_args: Namespace) -> List[BenchmarkResult]:
+    # each burst of datagrams is sent by a single call, and the responses are received
+    # in batches, so the throughput is bound by the packet rate of the server rather
+    # than by the round trip time; a response missing within the timeout is counted as lost;
+    # the datagrams are not padded, so a whole burst fits into the default socket buffers
+    server = start_server("udp_server.py", cmd_line_args.udp_port, "--variable-size")
+    client = open_udp_client(_UDP_MSG_SIZE, padded=False)
+    try:
+        wait_for_udp_server(client, cmd_line_args.udp_port)
+        burst = [(Endpoint("127.0.0.1", cmd_line_args.udp_port), _TEXT_MSG)] * _UDP_BURST_SIZE
+        client.set_timeout(1)
+        msg_count, lost_count = 0, 0
+        start_time = monotonic()
+        end_time = start_time + cmd_line_args.duration_sec
+        while monotonic() < end_time:
+            client.send_text_msgs(burst)
+            pending_count = _UDP_BURST_SIZE
+            try:
+                while pending_count:
+                    pending_count -= len(client.recv_frames(pending_count))
+            except timeout:
+                lost_count += pending_count
+            msg_count += _UDP_BURST_SIZE - pending_count
+        return [
+            BenchmarkResult("macro.udp_burst_throughput", round(msg_count / (monotonic() - start_time), 1), "msg/sec", higher_is_better=True),
+            BenchmarkResult("macro.udp_burst_lost", lost_count, "msgs"),
+        ]
+    finally:
+        client.close()
+        stop_server(server)
+
+
+def run_macro_benchmarks(cmd_line_args: Namespace) -> List[BenchmarkResult]:
+    results = []
+    for benchmark in (run_tcp_echo_benchmark, run_udp_echo_benchmark, run_udp_burst_benchmark):
+        for result in benchmark(cmd_line_args):
+            print(f"{result.name}: {result.value} {result.unit}")
+            results.append(result)
+    return results
+
+
+def compare_with_baseline(results: List[BenchmarkResult], baseline: Dict[str, Any], threshold_percent: float) -> List[str]:
+    # returns the names of the benchmarks whose results are worse than the baseline by
+    # more than the threshold; benchmarks missing in the baseline are ignored
+    regressions = []
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    print(f"Comparison with the baseline from {baseline['timestamp']} (threshold = {threshold_percent}%):")
+    for result in results:
+        baseline_result = baseline_results.get(result.name)
+        if not baseline_result or not baseline_result["value"]:
+            continue
+        change_percent = 100 * (result.value - baseline_result["value"]) / baseline_result["value"]
+        worse_percent = -change_percent if result.higher_is_better else change_percent
+        regression = worse_percent > threshold_percent
+        if regression:
+            regressions.append(result.name)
+        print(f"{result.name}: {baseline_result['value']} -> {result.value} {result.unit} ({change_percent:+.1f}%){' REGRESSION' if regression else ''}")
+    return regressions
+
+
+def create_cmd_line_args_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="Benchmarks of the commons framing layer", formatter_class=RawTextHelpFormatter)
+
+    parser.add_argument(
+        "-s", "--suite",
+        dest="suite",
+        default="all",
+        choices=["micro", "macro", "all"],
+        help="optional suite to be run; micro = framing and encoding functions in-process, macro =\n"
+             "echo over the loopback against tcp_server.py and udp_server.py (default = all)",
+        type=str,
+    )
+    parser.add_argument(
+        "-o", "--output",
+        dest="output",
+        help="optional path to a file the results are written to as JSON",
+        type=str,
+    )
+    parser.add_argument(
+        "-b", "--baseline",
+        dest="baseline",
+        help="optional path to a JSON file with the results of a previous run; the run fails if any\n"
+             "result is worse than the baseline by more than the threshold",
+        type=str,
+    )
+    parser.add_argument(
+        "-t", "--threshold-percent",
+        dest="threshold_percent",
+        default=10,
+        help="optional max. tolerated deterioration against the baseline in percent (default = 10)",
+        type=float,
+    )
+    parser.add_argument(
+        "-r", "--repeat",
+        dest="repeat",
+        default=5,
+        help="optional number of repetitions of each micro benchmark; the best one is taken (default = 5)",
+        type=int,
+    )
+    parser.add_argument(
+        "-d", "--duration-sec",
+        dest="duration_sec",
+        default=3,
+        help="optional duration of each macro benchmark in seconds (default = 3 sec)",
+        type=float,
+    )
+    parser.add_argument(
+        "--tcp-port",
+        dest="tcp_port",
+        default=23901,
+        help="optional TCP port the TCP server started by the macro benchmark binds to (default = 23901)",
+        type=int,
+    )
+    parser.add_argument(
+        "--udp-port",
+        dest="udp_port",
+        default=23902,
+        help="optional UDP port the UDP server started by the macro benchmark binds to (default = 23902)",
+        type=int,
+    )
+
+    return parser
+
+
+def parse_cmd_line_args() -> Namespace:
+    parser = create_cmd_line_args_parser()
+    params = parser.parse_args()
+    if params.repeat < 1:
+        parser.error("Number of repetitions must be a positive number.")
+    if params.duration_sec <= 0:
+        parser.error("Duration must be a positive number.")
+    if params.threshold_percent < 0:
+        parser.error("Threshold must not be negative.")
+    if not all(1024 <= port <= 65535 for port in (params.tcp_port, params.udp_port)):
+        parser.error("Port must be between 1024 and 65535.")
+    return params
+
+
+def main() -> None:
+    cmd_line_args = parse_cmd_line_args()
+    results = []
+    if cmd_line_args.suite in ("micro", "all"):
+        results += run_micro_benchmarks(cmd_line_args)
+    if cmd_line_args.suite in ("macro", "all"):
+        results += run_macro_benchmarks(cmd_line_args)
+    output = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python_version": python_version(),
+        "platform": platform(),
+        "results": [asdict(result) for result in results],
+    }
+    if cmd_line_args.output:
+        with open(cmd_line_args.output, "w") as output_file:
+            dump(output, output_file, indent=4)
+        print(f"Results written to {cmd_line_args.output}")
+    if cmd_line_args.baseline:
+        with open(cmd_line_args.baseline) as baseline_file:
+            baseline = load(baseline_file)
+        regressions = compare_with_baseline(results, baseline, cmd_line_args.threshold_percent)
+        if regressions:
+            print(f"{len(regressions)} regression(s) exceeding the threshold: {', '.join(regressions)}")
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,9 @@ from uuid import uuid4
 
 from commons import (
     Endpoint,
+    add_socket_tuning_cmd_line_args,
+    add_udp_datagram_cmd_line_args,
+    format_socket_tuning,
     open_udp_client,
     random_sleep,
 )
@@ -51,6 +54,8 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="optional publisher name (if not specified, generated UUID will be used)",
         type=str
     )
+    add_socket_tuning_cmd_line_args(parser)
+    add_udp_datagram_cmd_line_args(parser)
 
     return parser
 
@@ -58,6 +63,8 @@ def create_cmd_line_args_parser() -> ArgumentParser:
 def parse_cmd_line_args() -> Namespace:
     parser = create_cmd_line_args_parser()
     params = parser.parse_args()
+    if params.mtu is not None and not params.variable_size:
+        parser.error("MTU is only applicable with --variable-size.")
     return params
 
 
@@ -68,7 +75,9 @@ def main() -> None:
     try:
         destination = Endpoint(cmd_line_args.address, cmd_line_args.port)
         publisher_name = cmd_line_args.publisher_name or str(uuid4())
-        publisher = open_udp_client()
+        publisher = open_udp_client(padded=not cmd_line_args.variable_size, mtu=cmd_line_args.mtu)
+        if cmd_line_args.socket_tuning:
+            print(f"Socket tuning: {format_socket_tuning(publisher.apply_socket_tuning(cmd_line_args.socket_tuning))}")
         i = 1
         while True:
             output_msg = f"Message #{i} from broadcast publisher {publisher_name}"
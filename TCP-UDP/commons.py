@@ -17,31 +17,124 @@
 # limitations under the License.
 #
 
-from contextlib import suppress
-from dataclasses import dataclass
+from argparse import (
+    ArgumentParser,
+    ArgumentTypeError,
+    Namespace,
+)
+from array import array
+from bisect import bisect_right
+from asyncio import (
+    Condition as AsyncCondition,
+    IncompleteReadError,
+    Server,
+    StreamReader,
+    StreamWriter,
+    TimeoutError as AsyncTimeoutError,
+    get_running_loop,
+    open_connection,
+    start_server,
+    wait_for,
+)
+from codecs import getincrementaldecoder
+from collections import deque
+from contextlib import (
+    asynccontextmanager,
+    contextmanager,
+    suppress,
+)
+from csv import DictWriter
+from ctypes import (
+    CDLL,
+    POINTER,
+    Structure,
+    addressof,
+    byref,
+    c_char,
+    c_int,
+    c_size_t,
+    c_uint,
+    c_void_p,
+    get_errno,
+    sizeof,
+)
+from dataclasses import (
+    dataclass,
+    fields,
+    replace,
+)
+from errno import (
+    EAGAIN,
+    EINTR,
+    ENOSYS,
+    EWOULDBLOCK,
+)
 from enum import (
     IntEnum,
     unique,
 )
-from itertools import cycle
+from itertools import (
+    accumulate,
+    count,
+    cycle,
+)
 from json import (
+    JSONDecodeError,
+    JSONDecoder,
     dumps,
     loads,
 )
+from json.scanner import make_scanner
+from math import ceil
+from mmap import (
+    ACCESS_READ,
+    mmap,
+)
+from os import (
+    fstat,
+    getpid,
+    remove,
+    strerror,
+)
+from os.path import (
+    basename,
+    join,
+)
 from platform import system
+from queue import (
+    Empty,
+    SimpleQueue,
+)
 from random import random
+from re import compile as compile_regex
+from select import select
+from selectors import (
+    DefaultSelector,
+    EVENT_READ,
+)
+from sys import (
+    byteorder,
+    stdout,
+)
 from socket import (
     create_connection,
+    getaddrinfo,
+    gethostbyname,
+    htons,
     inet_aton,
+    inet_ntoa,
+    ntohs,
     socket,
     timeout,
     AF_INET,
     INADDR_ANY,
     IPPROTO_IP,
+    IPPROTO_TCP,
     IPPROTO_UDP,
     IP_ADD_MEMBERSHIP,
     IP_MULTICAST_TTL,
     SOCK_DGRAM,
+    SHUT_WR,
     SOCK_STREAM,
     SOL_SOCKET,
     SO_RCVBUF,
@@ -49,23 +142,90 @@ from socket import (
     SO_SNDBUF,
 )
 from struct import (
+    Struct,
     calcsize,
     pack,
     unpack,
 )
-from time import sleep
+from threading import (
+    Condition,
+    Event,
+    Lock,
+    Thread,
+    local,
+)
+from time import (
+    monotonic,
+    sleep,
+    time,
+)
 from typing import (
     Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
     Dict,
+    Iterator,
+    List,
     Optional,
+    Union,
 )
 
-from colorama import Fore
+from colorama import (
+    Fore,
+    Style,
+)
 
 
 _ENCODING      = "utf-8"
 _HEADER_FORMAT = ">HH"
 _HEADER_SIZE   = calcsize(_HEADER_FORMAT)
+_HEADER_STRUCT = Struct(_HEADER_FORMAT)
+
+# IPv4 header (without options) plus UDP header; a datagram bigger than the MTU minus
+# this overhead is fragmented by the IP layer
+_IPV4_UDP_OVERHEAD = 28
+_MIN_IPV4_MTU = 68
+
+# protocol version 2 only differs from version 1 by the length field of the header,
+# which has 32 bits instead of 16
+_V2_HEADER_FORMAT = ">IH"
+_V2_HEADER_STRUCT = Struct(_V2_HEADER_FORMAT)
+
+_DEFAULT_RECV_BUFFER_SIZE = 64 * 1024
+
+# max. payload length of a received frame which is assembled in memory; the length
+# comes from the (untrusted) header, so without this limit, a single header could make
+# the receiver allocate up to 4 GB (protocol version 2); files and streamed JSON frames
+# are not assembled, so they are not subject to the limit
+_DEFAULT_MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# max. number of payload bytes handed to the incremental JSON decoder at once
+_DEFAULT_JSON_STREAM_CHUNK_SIZE = 16 * 1024
+
+# max. length (in characters) of an incomplete value kept by the incremental JSON
+# decoder until its end arrives; an incomplete value is rescanned with each chunk, so
+# without this limit, a single huge value would be held in memory and decoded in
+# quadratic time
+_DEFAULT_JSON_STREAM_MAX_VALUE_SIZE = 1024 * 1024
+
+# max. number of log lines waiting for the background thread of BackgroundLog
+_DEFAULT_LOG_MAX_QUEUED_LINES = 64 * 1024
+
+# size classes of the buffer pool are powers of two between these bounds; larger
+# buffers are allocated directly; the free buffers kept by a class are limited by their
+# total size, so large classes keep just a few of them
+_BUFFER_POOL_MIN_CLASS_SIZE = 256
+_BUFFER_POOL_MAX_CLASS_SIZE = 4 * 1024 * 1024
+_BUFFER_POOL_MAX_FREE_BYTES_PER_CLASS = 4 * 1024 * 1024
+
+# on Windows, a blocking accept or select cannot be interrupted by Ctrl+C, so the
+# listening sockets have to be polled there
+_ACCEPT_POLL_INTERVAL_SEC = 1 if system() == "Windows" else None
+
+# upper bound for the number of buffers passed to a single sendmsg call (IOV_MAX is
+# 1024 on Linux and macOS)
+_MAX_IOV_COUNT = 1024
 
 
 _COLORS = cycle([
@@ -88,6 +248,234 @@ _COLORS = cycle([
 class MessageType(IntEnum):
     TEXT = 1
     JSON = 2
+    BINARY = 3
+    FILE = 4
+    HELLO = 127
+
+
+@unique
+class ProtocolVersion(IntEnum):
+    V1 = 1
+    V2 = 2
+
+
+@unique
+class Transport(IntEnum):
+    TCP = 1
+    UDP = 2
+
+
+_HEADER_STRUCTS = {
+    ProtocolVersion.V1: _HEADER_STRUCT,
+    ProtocolVersion.V2: _V2_HEADER_STRUCT,
+}
+
+_MAX_PAYLOAD_SIZES = {
+    ProtocolVersion.V1: 2**16 - 1,
+    ProtocolVersion.V2: 2**32 - 1,
+}
+
+# the 16-bit message type field of the TCP header consists of the message type (low
+# byte) and flags (high byte); the lowest two bits of the flags identify the algorithm
+# used to compress the payload (zero = uncompressed payload), the next bit indicates
+# the payload is preceded by a 32-bit correlation ID (not subject to compression)
+_MSG_TYPE_MASK        = 0x00FF
+_FLAGS_MASK           = 0xFF00
+_COMPRESSION_MASK     = 0x0300
+_COMPRESSION_SHIFT    = 8
+_CORRELATION_ID_FLAG  = 0x0400
+
+_CORRELATION_ID_STRUCT = Struct(">I")
+_MAX_CORRELATION_ID    = 2**32 - 1
+
+# optional protocol features announced by the handshake
+_CORRELATION_ID_FEATURE = "correlation-id"
+_FEATURES = [_CORRELATION_ID_FEATURE]
+
+_DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+# the payload of a FILE frame starts with the length of the UTF-8 encoded file name,
+# followed by the name itself and the content of the file (never compressed)
+_FILE_NAME_LENGTH_STRUCT = Struct(">H")
+
+# files up to this size are read and sent along with the header by a single write, which
+# is cheaper than a separate sendfile syscall
+_FILE_INLINE_THRESHOLD = 64 * 1024
+
+# layout of the traffic log: a header (magic, transport) followed by the records, each
+# of them consisting of a fixed-size part (timestamp, IPv4 address and port of the peer,
+# message type, payload length) and the payload; the index file contains (timestamp,
+# offset) pairs for every n-th record
+_TRAFFIC_LOG_MAGIC = b"TRAFFIC1"
+_TRAFFIC_LOG_HEADER_STRUCT = Struct(">8sB")
+_TRAFFIC_RECORD_STRUCT = Struct(">d4sHBI")
+_TRAFFIC_INDEX_STRUCT = Struct(">dQ")
+_TRAFFIC_INDEX_SUFFIX = ".idx"
+_DEFAULT_TRAFFIC_INDEX_INTERVAL = 256
+
+# the log and the index are flushed at least this often while records are written, so
+# a killed recorder loses at most the records of the last interval
+_TRAFFIC_FLUSH_INTERVAL_SEC = 1.0
+
+# default flush policy of the write coalescer
+_DEFAULT_COALESCE_MAX_BYTES = 16 * 1024
+_DEFAULT_COALESCE_MAX_DELAY_SEC = 0.001
+
+# layout of the Linux struct tcp_info (see linux/tcp.h) up to the rcv_wnd field; older
+# kernels return a shorter structure, so only the fields covered by the returned data
+# are reported
+_TCP_INFO_FIELDS = [
+    ("state", "B"), ("ca_state", "B"), ("retransmits", "B"), ("probes", "B"),
+    ("backoff", "B"), ("options", "B"), ("wscale", "B"), ("app_limited", "B"),
+    ("rto", "I"), ("ato", "I"), ("snd_mss", "I"), ("rcv_mss", "I"),
+    ("unacked", "I"), ("sacked", "I"), ("lost", "I"), ("retrans", "I"),
+    ("fackets", "I"), ("last_data_sent", "I"), ("last_ack_sent", "I"), ("last_data_recv", "I"),
+    ("last_ack_recv", "I"), ("pmtu", "I"), ("rcv_ssthresh", "I"), ("rtt", "I"),
+    ("rttvar", "I"), ("snd_ssthresh", "I"), ("snd_cwnd", "I"), ("advmss", "I"),
+    ("reordering", "I"), ("rcv_rtt", "I"), ("rcv_space", "I"), ("total_retrans", "I"),
+    ("pacing_rate", "Q"), ("max_pacing_rate", "Q"), ("bytes_acked", "Q"), ("bytes_received", "Q"),
+    ("segs_out", "I"), ("segs_in", "I"), ("notsent_bytes", "I"), ("min_rtt", "I"),
+    ("data_segs_in", "I"), ("data_segs_out", "I"), ("delivery_rate", "Q"), ("busy_time", "Q"),
+    ("rwnd_limited", "Q"), ("sndbuf_limited", "Q"), ("delivered", "I"), ("delivered_ce", "I"),
+    ("bytes_sent", "Q"), ("bytes_retrans", "Q"), ("dsack_dups", "I"), ("reord_seen", "I"),
+    ("rcv_ooopack", "I"), ("snd_wnd", "I"), ("rcv_wnd", "I"), ("rehash", "I"),
+]
+_TCP_INFO_STRUCT = Struct("=" + "".join(field_format for _, field_format in _TCP_INFO_FIELDS))
+_TCP_INFO_FIELD_ENDS = list(accumulate(calcsize("=" + field_format) for _, field_format in _TCP_INFO_FIELDS))
+
+# Linux-specific ioctls returning the number of bytes in the receive queue (not read
+# by the application yet) and in the send queue (not acknowledged by the peer yet)
+_SIOCINQ  = 0x541B
+_SIOCOUTQ = 0x5411
+
+# batched datagram I/O (Linux recvmmsg/sendmmsg); MSG_WAITFORONE makes recvmmsg block
+# until the first datagram only, and return whatever else is queued at that moment;
+# the socket addresses are struct sockaddr_in (family in native byte order)
+_DEFAULT_UDP_BATCH_SIZE = 32
+_MSG_WAITFORONE = 0x10000
+_SOCKADDR_IN_STRUCT = Struct("=HH4s8x")
+
+# socket options covered by the tuning profile (profile field -> level + name of the
+# constant in the socket module); TCP Fast Open is enabled by a different option on
+# the client side, and options missing in the socket module of older Python versions
+# fall back to their Linux values
+_SOCKET_TUNING_OPTIONS = {
+    "nodelay": (IPPROTO_TCP, "TCP_NODELAY"),
+    "sndbuf": (SOL_SOCKET, "SO_SNDBUF"),
+    "rcvbuf": (SOL_SOCKET, "SO_RCVBUF"),
+    "quickack": (IPPROTO_TCP, "TCP_QUICKACK"),
+    "cork": (IPPROTO_TCP, "TCP_CORK"),
+    "notsent_lowat": (IPPROTO_TCP, "TCP_NOTSENT_LOWAT"),
+    "fastopen": (IPPROTO_TCP, "TCP_FASTOPEN"),
+    "busy_poll": (SOL_SOCKET, "SO_BUSY_POLL"),
+    "keepalive": (SOL_SOCKET, "SO_KEEPALIVE"),
+    "keepidle": (IPPROTO_TCP, "TCP_KEEPIDLE"),
+    "keepintvl": (IPPROTO_TCP, "TCP_KEEPINTVL"),
+    "keepcnt": (IPPROTO_TCP, "TCP_KEEPCNT"),
+}
+_CLIENT_FASTOPEN_OPTION = (IPPROTO_TCP, "TCP_FASTOPEN_CONNECT")
+_LINUX_SOCKET_OPTION_FALLBACKS = {
+    "TCP_FASTOPEN_CONNECT": 30,
+    "SO_BUSY_POLL": 46,
+}
+
+# the buffer sizes and the Fast Open queue are set on the listening socket before
+# listen (the accepted connections inherit the buffer sizes), the other options on
+# each accepted connection; UDP sockets only support the socket-level options
+_LISTENER_TUNING_FIELDS   = ["sndbuf", "rcvbuf", "fastopen"]
+_CONNECTION_TUNING_FIELDS = [
+    "nodelay", "sndbuf", "rcvbuf", "quickack", "cork", "notsent_lowat", "busy_poll",
+    "keepalive", "keepidle", "keepintvl", "keepcnt",
+]
+_CLIENT_TUNING_FIELDS     = _CONNECTION_TUNING_FIELDS + ["fastopen"]
+_UDP_TUNING_FIELDS        = ["sndbuf", "rcvbuf", "busy_poll"]
+
+
+@dataclass(frozen=True)
+class SocketTuning:
+    # None = the option is left untouched; switches (e.g. nodelay) use 0/1
+    nodelay: Optional[int] = None
+    sndbuf: Optional[int] = None
+    rcvbuf: Optional[int] = None
+    quickack: Optional[int] = None
+    cork: Optional[int] = None
+    notsent_lowat: Optional[int] = None
+    fastopen: Optional[int] = None
+    busy_poll: Optional[int] = None
+    # keepalive probes (keepidle and keepintvl in seconds) only take effect if
+    # keepalive = 1
+    keepalive: Optional[int] = None
+    keepidle: Optional[int] = None
+    keepintvl: Optional[int] = None
+    keepcnt: Optional[int] = None
+
+
+def parse_socket_tuning(spec: str) -> SocketTuning:
+    # either comma-separated name=value pairs (e.g. "nodelay=1,sndbuf=262144"), or
+    # @path of a JSON file containing an object with the same names
+    if spec.startswith("@"):
+        with open(spec[1:]) as tuning_file:
+            values = loads(tuning_file.read())
+    else:
+        values = {}
+        for item in filter(None, spec.split(",")):
+            name, separator, value = item.partition("=")
+            if not separator:
+                raise ValueError(f"Invalid socket tuning item '{item}' (name=value expected).")
+            values[name.strip()] = value.strip()
+    field_names = [field.name for field in fields(SocketTuning)]
+    unknown_names = [name for name in values if name not in field_names]
+    if unknown_names:
+        raise ValueError(f"Unknown socket tuning option(s): {', '.join(unknown_names)} (supported: {', '.join(field_names)}).")
+    return SocketTuning(**{name: _parse_socket_tuning_value(value) for name, value in values.items()})
+
+
+def _parse_socket_tuning_value(value: Union[str, int, bool]) -> int:
+    if isinstance(value, str) and value.lower() in ("true", "on", "yes"):
+        return 1
+    if isinstance(value, str) and value.lower() in ("false", "off", "no"):
+        return 0
+    return int(value)
+
+
+def _get_socket_option(field_name: str, client: bool = False) -> Optional[tuple[int, int]]:
+    level, option_name = _SOCKET_TUNING_OPTIONS[field_name]
+    if client and field_name == "fastopen":
+        level, option_name = _CLIENT_FASTOPEN_OPTION
+    import socket as socket_module
+    option = getattr(socket_module, option_name, None)
+    if option is None and system() == "Linux":
+        option = _LINUX_SOCKET_OPTION_FALLBACKS.get(option_name)
+    return (level, option) if option is not None else None
+
+
+def _apply_socket_tuning(socket: socket, tuning: Optional[SocketTuning], field_names: List[str], client: bool = False) -> None:
+    # options not supported by the platform (or rejected by the kernel, e.g. because
+    # of missing privileges) are skipped; get_socket_tuning reveals the effective values
+    if tuning is None:
+        return
+    for field_name in field_names:
+        value = getattr(tuning, field_name)
+        option = _get_socket_option(field_name, client)
+        if value is None or option is None:
+            continue
+        with suppress(OSError):
+            socket.setsockopt(*option, value)
+
+
+def _get_socket_tuning(socket: socket, field_names: List[str], client: bool = False) -> Dict[str, Optional[int]]:
+    values = {}
+    for field_name in field_names:
+        option = _get_socket_option(field_name, client)
+        values[field_name] = None
+        if option is not None:
+            with suppress(OSError):
+                values[field_name] = socket.getsockopt(*option)
+    return values
+
+
+def format_socket_tuning(values: Dict[str, Optional[int]]) -> str:
+    return ", ".join(f"{name} = {'n/a' if value is None else value}" for name, value in values.items())
 
 
 @dataclass(frozen=True)
@@ -96,211 +484,3139 @@ class Endpoint:
     port: int
 
 
-class TCPSocket:
+@dataclass(frozen=True)
+class Codec:
+    codec_id: int
+    name: str
+    encode: Callable[[Any], bytes]
+    decode: Callable[[memoryview], Any]
 
-    def __init__(self, socket: socket) -> None:
-        self._socket = socket
 
-    def get_snd_buff_size(self) -> int:
-        return self._socket.getsockopt(SOL_SOCKET, SO_SNDBUF)
+_CODECS_BY_ID: Dict[int, Codec] = {}
+_CODECS_BY_NAME: Dict[str, Codec] = {}
 
-    def get_rcv_buff_size(self) -> int:
-        return self._socket.getsockopt(SOL_SOCKET, SO_RCVBUF)
+_COMPACT_CODEC_NAME = "compact"
 
-    def send_text_msg(self, msg: str, timeout_sec: Optional[float] = None) -> int:
-        payload = bytes(msg, _ENCODING)
-        return self._send_msg(MessageType.TEXT, payload, timeout_sec)
+# tags used by the compact codec; lists of integers or floats are encoded as arrays,
+# using the narrowest integer type capable of holding all elements
+_NONE_TAG        = 0
+_FALSE_TAG       = 1
+_TRUE_TAG        = 2
+_INT_TAG         = 3
+_FLOAT_TAG       = 4
+_STR_TAG         = 5
+_BYTES_TAG       = 6
+_LIST_TAG        = 7
+_DICT_TAG        = 8
+_INT_ARRAY_TAG   = 9
+_FLOAT_ARRAY_TAG = 10
 
-    def send_json_msg(self, msg: Dict[str, Any], timeout_sec: Optional[float] = None) -> int:
-        payload = bytes(dumps(msg), _ENCODING)
-        return self._send_msg(MessageType.JSON, payload, timeout_sec)
+_TAG_STRUCT    = Struct("<B")
+_INT_STRUCT    = Struct("<q")
+_FLOAT_STRUCT  = Struct("<d")
+_LENGTH_STRUCT = Struct("<I")
+_ARRAY_STRUCT  = Struct("<cI")
 
-    def _clear_timeout(self) -> None:
-        with suppress(Exception):
-            self._socket.settimeout(None)
+_INT_ARRAY_TYPECODES = [
+    ("b", -2**7, 2**7 - 1),
+    ("h", -2**15, 2**15 - 1),
+    ("i", -2**31, 2**31 - 1),
+    ("q", -2**63, 2**63 - 1),
+]
 
-    def _send_msg(self, msg_type: MessageType, payload: bytes, timeout_sec: Optional[float] = None) -> int:
-        try:
-            header = pack(_HEADER_FORMAT, len(payload), msg_type)
-            self._socket.settimeout(timeout_sec)
-            self._socket.sendall(header + payload)
-            return len(header) + len(payload)
-        except (TimeoutError, timeout) as e:
-            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to write data to the socket.") from e
-        finally:
-            self._clear_timeout()
+# arrays are transferred in little-endian byte order regardless of the platform
+_BYTESWAP_ARRAYS = byteorder == "big"
 
-    def recv_text_msg(self, timeout_sec: Optional[float] = None) -> Optional[str]:
+
+def _encode_array(buffer: bytearray, tag: int, typecode: str, values: array) -> None:
+    if _BYTESWAP_ARRAYS:
+        values.byteswap()
+    buffer += _TAG_STRUCT.pack(tag)
+    buffer += _ARRAY_STRUCT.pack(typecode.encode(), len(values))
+    buffer += values.tobytes()
+
+
+def _encode_list(buffer: bytearray, value: list) -> None:
+    if value and all(type(item) is int for item in value):
+        min_value, max_value = min(value), max(value)
+        for typecode, lower_bound, upper_bound in _INT_ARRAY_TYPECODES:
+            if lower_bound <= min_value and max_value <= upper_bound:
+                _encode_array(buffer, _INT_ARRAY_TAG, typecode, array(typecode, value))
+                return
+    elif value and all(type(item) is float for item in value):
+        _encode_array(buffer, _FLOAT_ARRAY_TAG, "d", array("d", value))
+        return
+    buffer += _TAG_STRUCT.pack(_LIST_TAG)
+    buffer += _LENGTH_STRUCT.pack(len(value))
+    for item in value:
+        _encode_compact_value(buffer, item)
+
+
+def _encode_compact_value(buffer: bytearray, value: Any) -> None:
+    value_type = type(value)
+    if value is None:
+        buffer += _TAG_STRUCT.pack(_NONE_TAG)
+    elif value_type is bool:
+        buffer += _TAG_STRUCT.pack(_TRUE_TAG if value else _FALSE_TAG)
+    elif value_type is int:
+        if not (-2**63 <= value < 2**63):
+            raise ValueError(f"Integer {value} exceeds the 64-bit range supported by the compact codec.")
+        buffer += _TAG_STRUCT.pack(_INT_TAG)
+        buffer += _INT_STRUCT.pack(value)
+    elif value_type is float:
+        buffer += _TAG_STRUCT.pack(_FLOAT_TAG)
+        buffer += _FLOAT_STRUCT.pack(value)
+    elif value_type is str:
+        encoded_value = value.encode(_ENCODING)
+        buffer += _TAG_STRUCT.pack(_STR_TAG)
+        buffer += _LENGTH_STRUCT.pack(len(encoded_value))
+        buffer += encoded_value
+    elif value_type in (bytes, bytearray, memoryview):
+        buffer += _TAG_STRUCT.pack(_BYTES_TAG)
+        buffer += _LENGTH_STRUCT.pack(len(value))
+        buffer += value
+    elif value_type in (list, tuple):
+        _encode_list(buffer, list(value) if value_type is tuple else value)
+    elif value_type is dict:
+        buffer += _TAG_STRUCT.pack(_DICT_TAG)
+        buffer += _LENGTH_STRUCT.pack(len(value))
+        for key, item in value.items():
+            _encode_compact_value(buffer, key)
+            _encode_compact_value(buffer, item)
+    else:
+        raise TypeError(f"Value of type {value_type.__name__} cannot be encoded by the compact codec.")
+
+
+def _decode_compact_value(payload: memoryview, offset: int) -> tuple[Any, int]:
+    tag = payload[offset]
+    offset += 1
+    if tag == _NONE_TAG:
+        return None, offset
+    if tag == _FALSE_TAG:
+        return False, offset
+    if tag == _TRUE_TAG:
+        return True, offset
+    if tag == _INT_TAG:
+        return _INT_STRUCT.unpack_from(payload, offset)[0], offset + _INT_STRUCT.size
+    if tag == _FLOAT_TAG:
+        return _FLOAT_STRUCT.unpack_from(payload, offset)[0], offset + _FLOAT_STRUCT.size
+    if tag in (_STR_TAG, _BYTES_TAG):
+        length, = _LENGTH_STRUCT.unpack_from(payload, offset)
+        start = offset + _LENGTH_STRUCT.size
+        value = payload[start:start + length]
+        return str(value, _ENCODING) if tag == _STR_TAG else bytes(value), start + length
+    if tag == _LIST_TAG:
+        count, = _LENGTH_STRUCT.unpack_from(payload, offset)
+        offset += _LENGTH_STRUCT.size
+        items = []
+        for _ in range(count):
+            item, offset = _decode_compact_value(payload, offset)
+            items.append(item)
+        return items, offset
+    if tag == _DICT_TAG:
+        count, = _LENGTH_STRUCT.unpack_from(payload, offset)
+        offset += _LENGTH_STRUCT.size
+        entries = {}
+        for _ in range(count):
+            key, offset = _decode_compact_value(payload, offset)
+            entries[key], offset = _decode_compact_value(payload, offset)
+        return entries, offset
+    if tag in (_INT_ARRAY_TAG, _FLOAT_ARRAY_TAG):
+        typecode, count = _ARRAY_STRUCT.unpack_from(payload, offset)
+        values = array(typecode.decode())
+        start = offset + _ARRAY_STRUCT.size
+        end = start + count * values.itemsize
+        values.frombytes(payload[start:end])
+        if _BYTESWAP_ARRAYS:
+            values.byteswap()
+        return values.tolist(), end
+    raise ValueError(f"Unknown tag {tag} encountered by the compact codec.")
+
+
+def _encode_compact(value: Any) -> bytes:
+    buffer = bytearray()
+    _encode_compact_value(buffer, value)
+    return buffer
+
+
+def _decode_compact(payload: memoryview) -> Any:
+    value, _ = _decode_compact_value(payload, 0)
+    return value
+
+
+def register_codec(codec: Codec) -> None:
+    if not (0 < codec.codec_id < 256):
+        raise ValueError(f"Codec ID must be between 1 and 255 (codec = {codec.name}).")
+    _CODECS_BY_ID[codec.codec_id] = codec
+    _CODECS_BY_NAME[codec.name] = codec
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    codec = _CODECS_BY_NAME.get(name or _COMPACT_CODEC_NAME)
+    if codec is None:
+        raise ValueError(f"Unknown or unavailable codec: {name}.")
+    return codec
+
+
+def get_codec_names() -> List[str]:
+    return list(_CODECS_BY_NAME)
+
+
+def _register_builtin_codecs() -> None:
+    register_codec(Codec(1, _COMPACT_CODEC_NAME, _encode_compact, _decode_compact))
+    try:
+        from msgpack import packb, unpackb
+        register_codec(Codec(2, "msgpack", lambda value: packb(value, use_bin_type=True), lambda payload: unpackb(payload, raw=False)))
+    except ImportError:
+        ...
+    try:
+        import orjson
+        register_codec(Codec(3, "orjson", orjson.dumps, orjson.loads))
+    except ImportError:
+        ...
+
+
+_register_builtin_codecs()
+
+
+# the payload of a binary message starts with the ID of the codec used to encode it
+def _encode_binary_payload(msg: Any, codec_name: Optional[str]) -> bytes:
+    codec = get_codec(codec_name)
+    return _TAG_STRUCT.pack(codec.codec_id) + codec.encode(msg)
+
+
+def encode_msg(msg: Union[str, Dict[str, Any]], codec_name: Optional[str] = None) -> tuple[MessageType, bytes]:
+    # strings are encoded as text messages, other messages as JSON messages (or binary
+    # messages if a codec is specified)
+    if isinstance(msg, str):
+        return MessageType.TEXT, bytes(msg, _ENCODING)
+    if codec_name:
+        return MessageType.BINARY, _encode_binary_payload(msg, codec_name)
+    return MessageType.JSON, bytes(dumps(msg), _ENCODING)
+
+
+def _decode_binary_payload(payload: memoryview) -> Any:
+    codec = _CODECS_BY_ID.get(payload[0])
+    if codec is None:
+        raise ValueError(f"Binary message encoded by unknown or unavailable codec (codec ID = {payload[0]}).")
+    return codec.decode(payload[1:])
+
+
+@dataclass(frozen=True)
+class Compression:
+    compression_id: int
+    name: str
+    compress: Callable[[bytes], bytes]
+    # the second argument is the max. size of the decompressed payload; a payload
+    # exceeding it is rejected by ValueError (a decompression bomb)
+    decompress: Callable[[memoryview, int], bytes]
+
+
+_COMPRESSIONS_BY_ID: Dict[int, Compression] = {}
+_COMPRESSIONS_BY_NAME: Dict[str, Compression] = {}
+
+
+def _register_compression(compression: Compression) -> None:
+    _COMPRESSIONS_BY_ID[compression.compression_id] = compression
+    _COMPRESSIONS_BY_NAME[compression.name] = compression
+
+
+def get_compression(name: str) -> Compression:
+    compression = _COMPRESSIONS_BY_NAME.get(name)
+    if compression is None:
+        raise ValueError(f"Unknown or unavailable compression: {name}.")
+    return compression
+
+
+def get_compression_names() -> List[str]:
+    return list(_COMPRESSIONS_BY_NAME)
+
+
+def _raise_decompressed_size_exceeded(max_size: int) -> None:
+    raise ValueError(f"Decompressed payload exceeds the limit of {max_size} bytes.")
+
+
+def _register_builtin_compressions() -> None:
+    # all decompressions stop as soon as the output exceeds the limit, so a small frame
+    # cannot make the receiver allocate an arbitrary amount of memory
+    import zlib
+
+    def zlib_decompress(payload: memoryview, max_size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        output = decompressor.decompress(payload, max_size)
+        if decompressor.unconsumed_tail:
+            _raise_decompressed_size_exceeded(max_size)
+        if not decompressor.eof:
+            raise ValueError("Incomplete zlib-compressed payload.")
+        return output
+
+    _register_compression(Compression(1, "zlib", zlib.compress, zlib_decompress))
+    try:
+        import lz4.frame
+
+        def lz4_decompress(payload: memoryview, max_size: int) -> bytes:
+            decompressor = lz4.frame.LZ4FrameDecompressor()
+            output = decompressor.decompress(payload, max_length=max_size + 1)
+            if len(output) > max_size:
+                _raise_decompressed_size_exceeded(max_size)
+            if not decompressor.eof:
+                raise ValueError("Incomplete lz4-compressed payload.")
+            return output
+
+        _register_compression(Compression(2, "lz4", lz4.frame.compress, lz4_decompress))
+    except ImportError:
+        ...
+    try:
+        import zstandard
+
+        # the compression and decompression contexts are not thread-safe, so each thread
+        # has its own ones
+        contexts = local()
+
+        def get_contexts() -> Any:
+            if not hasattr(contexts, "compressor"):
+                contexts.compressor, contexts.decompressor = zstandard.ZstdCompressor(), zstandard.ZstdDecompressor()
+            return contexts
+
+        def zstd_compress(payload: bytes) -> bytes:
+            return get_contexts().compressor.compress(payload)
+
+        def zstd_decompress(payload: memoryview, max_size: int) -> bytes:
+            # max_output_size only caps the output if the frame header does not specify
+            # the content size, and the header comes from the peer
+            try:
+                content_size = zstandard.frame_content_size(payload)
+                if content_size <= max_size:
+                    return get_contexts().decompressor.decompress(payload, max_output_size=max_size)
+            except zstandard.ZstdError as e:
+                raise ValueError(f"Invalid zstd-compressed payload, or its size exceeds the limit of {max_size} bytes.") from e
+            _raise_decompressed_size_exceeded(max_size)
+
+        _register_compression(Compression(3, "zstd", zstd_compress, zstd_decompress))
+    except ImportError:
+        ...
+
+
+_register_builtin_compressions()
+
+
+@dataclass(frozen=True)
+class Frame:
+    msg_type: int
+    payload: memoryview
+    correlation_id: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class ReceivedFile:
+    name: str
+    path: str
+    size: int
+
+
+def decode_frame(frame: Frame) -> Any:
+    if frame.msg_type == MessageType.TEXT:
+        return str(frame.payload, _ENCODING)
+    if frame.msg_type == MessageType.JSON:
+        return loads(str(frame.payload, _ENCODING))
+    if frame.msg_type == MessageType.BINARY:
+        return _decode_binary_payload(frame.payload)
+    raise ValueError(f"Unexpected message type: {frame.msg_type}.")
+
+
+def _create_frame(msg_type: int, payload: memoryview, max_size: int = _DEFAULT_MAX_FRAME_SIZE) -> Frame:
+    if not msg_type & _FLAGS_MASK:
+        return Frame(msg_type, payload)
+    correlation_id = None
+    if msg_type & _CORRELATION_ID_FLAG:
+        correlation_id, = _CORRELATION_ID_STRUCT.unpack_from(payload)
+        payload = payload[_CORRELATION_ID_STRUCT.size:]
+    if msg_type & _COMPRESSION_MASK:
+        compression_id = (msg_type & _COMPRESSION_MASK) >> _COMPRESSION_SHIFT
+        compression = _COMPRESSIONS_BY_ID.get(compression_id)
+        if compression is None:
+            raise ValueError(f"Frame compressed by unknown or unavailable compression (compression ID = {compression_id}).")
+        payload = memoryview(compression.decompress(payload, max_size))
+    return Frame(msg_type & _MSG_TYPE_MASK, payload, correlation_id)
+
+
+@dataclass(frozen=True)
+class TCPStats:
+    rtt_ms: float
+    rttvar_ms: float
+    snd_cwnd: int
+    retransmits: int
+    bytes_acked: int
+    bytes_received: int
+    pacing_rate: int
+
+
+def _create_tcp_stats(tcp_info: Optional[Dict[str, int]]) -> Optional[TCPStats]:
+    # the RTT fields of TCP_INFO are in microseconds, the pacing rate in bytes/sec
+    if tcp_info is None:
+        return None
+    return TCPStats(
+        rtt_ms=tcp_info["rtt"] / 1000,
+        rttvar_ms=tcp_info["rttvar"] / 1000,
+        snd_cwnd=tcp_info["snd_cwnd"],
+        retransmits=tcp_info["total_retrans"],
+        bytes_acked=tcp_info.get("bytes_acked", 0),
+        bytes_received=tcp_info.get("bytes_received", 0),
+        pacing_rate=tcp_info.get("pacing_rate", 0),
+    )
+
+
+# states of the incremental JSON decoder
+_JSON_STREAM_ROOT          = 0
+_JSON_STREAM_FIRST_KEY     = 1
+_JSON_STREAM_KEY           = 2
+_JSON_STREAM_COLON         = 3
+_JSON_STREAM_VALUE         = 4
+_JSON_STREAM_NEXT_KEY      = 5
+_JSON_STREAM_FIRST_ELEMENT = 6
+_JSON_STREAM_ELEMENT       = 7
+_JSON_STREAM_NEXT_ELEMENT  = 8
+_JSON_STREAM_DONE          = 9
+
+_JSON_WHITESPACE = " \t\n\r"
+_JSON_WHITESPACE_PATTERN = compile_regex(f"[{_JSON_WHITESPACE}]*")
+_JSON_DELIMITERS = _JSON_WHITESPACE + ",:]}"
+
+
+@dataclass(frozen=True)
+class JSONStreamEvent:
+    # key = name of the top-level field (None for the elements of a top-level array),
+    # index = position of the value within its array (None if it is not an element)
+    key: Optional[str]
+    value: Any
+    index: Optional[int] = None
+
+
+class JSONStreamDecoder:
+
+    # Incremental decoder of a JSON object (or array) whose text arrives in chunks. The
+    # elements of the top-level arrays (e.g. the array of random numbers sent by the
+    # eager producer) are emitted one by one as soon as they are complete, any other
+    # value of a top-level field is emitted as a whole. Only the undecoded rest of the
+    # text is kept, i.e. at most one chunk plus one incomplete value; an incomplete
+    # value longer than max_value_size characters is rejected. Empty arrays do not
+    # emit any event.
+
+    def __init__(self, max_value_size: int = _DEFAULT_JSON_STREAM_MAX_VALUE_SIZE) -> None:
+        self._max_value_size = max_value_size
+        self._text_decoder = getincrementaldecoder(_ENCODING)()
+        self._scan_once = make_scanner(JSONDecoder())
+        self._text = ""
+        self._pos = 0
+        self._state = _JSON_STREAM_ROOT
+        self._key = None
+        self._index = 0
+
+    def feed(self, chunk: Union[bytes, memoryview]) -> List[JSONStreamEvent]:
+        self._text = self._text[self._pos:] + self._text_decoder.decode(chunk)
+        self._pos = 0
+        events = self._parse(final=False)
+        if len(self._text) - self._pos > self._max_value_size:
+            raise ValueError(f"Incomplete JSON value exceeds the limit ({self._max_value_size} characters).")
+        return events
+
+    def close(self) -> List[JSONStreamEvent]:
+        self._text = self._text[self._pos:] + self._text_decoder.decode(b"", final=True)
+        self._pos = 0
+        events = self._parse(final=True)
+        if self._state != _JSON_STREAM_DONE:
+            raise ValueError("Incomplete JSON document.")
+        if self._text[self._pos:].strip(_JSON_WHITESPACE):
+            raise ValueError("Extra data after the JSON document.")
+        return events
+
+    def _parse(self, final: bool) -> List[JSONStreamEvent]:
+        events = []
+        while self._state != _JSON_STREAM_DONE:
+            self._pos = _JSON_WHITESPACE_PATTERN.match(self._text, self._pos).end()
+            if self._pos == len(self._text):
+                break
+            char = self._text[self._pos]
+            state = self._state
+            if state == _JSON_STREAM_ROOT:
+                if char not in "{[":
+                    raise ValueError("Streaming decode requires a JSON object or array.")
+                self._pos += 1
+                self._state = _JSON_STREAM_FIRST_KEY if char == "{" else _JSON_STREAM_FIRST_ELEMENT
+            elif state in (_JSON_STREAM_FIRST_KEY, _JSON_STREAM_KEY):
+                if char == "}" and state == _JSON_STREAM_FIRST_KEY:
+                    self._pos += 1
+                    self._state = _JSON_STREAM_DONE
+                    continue
+                complete, key = self._decode_value(final)
+                if not complete:
+                    break
+                if not isinstance(key, str):
+                    raise ValueError(f"Invalid JSON object key: {key!r}.")
+                self._key = key
+                self._state = _JSON_STREAM_COLON
+            elif state == _JSON_STREAM_COLON:
+                self._expect(char, ":")
+                self._state = _JSON_STREAM_VALUE
+            elif state == _JSON_STREAM_VALUE:
+                if char == "[":
+                    self._pos += 1
+                    self._index = 0
+                    self._state = _JSON_STREAM_FIRST_ELEMENT
+                    continue
+                complete, value = self._decode_value(final)
+                if not complete:
+                    break
+                events.append(JSONStreamEvent(self._key, value))
+                self._state = _JSON_STREAM_NEXT_KEY
+            elif state == _JSON_STREAM_NEXT_KEY:
+                self._expect(char, ",}")
+                self._state = _JSON_STREAM_KEY if char == "," else _JSON_STREAM_DONE
+            elif state in (_JSON_STREAM_FIRST_ELEMENT, _JSON_STREAM_ELEMENT):
+                if char == "]" and state == _JSON_STREAM_FIRST_ELEMENT:
+                    self._pos += 1
+                    self._end_array()
+                    continue
+                if not self._parse_elements(events, final):
+                    break
+            elif state == _JSON_STREAM_NEXT_ELEMENT:
+                self._expect(char, ",]")
+                if char == ",":
+                    self._state = _JSON_STREAM_ELEMENT
+                else:
+                    self._end_array()
+        return events
+
+    def _decode_value(self, final: bool) -> tuple[bool, Any]:
+        # a value not followed by a delimiter may continue in the next chunk (e.g. the
+        # number 12 may turn out to be 12.5), and an invalid value may just be incomplete,
+        # so both can only be decided once the next chunk (or the end of the text) has
+        # arrived
         try:
-            self._socket.settimeout(timeout_sec)
-            length, msg_type = self._recv_header()
-            if msg_type != MessageType.TEXT:
-                raise ValueError(f"Unexpected message type: {msg_type}.")
-            payload = self._socket.recv(length)
-            return payload.decode(_ENCODING)
-        except (TimeoutError, timeout) as e:
-            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to read data from the socket.") from e
-        finally:
-            self._clear_timeout()
+            value, end = self._scan_once(self._text, self._pos)
+        except (StopIteration, JSONDecodeError) as e:
+            if final:
+                raise ValueError("Invalid JSON value.") from e
+            return False, None
+        if not final and (end == len(self._text) or self._text[end] not in _JSON_DELIMITERS):
+            return False, None
+        self._pos = end
+        return True, value
 
-    def recv_json_msg(self, timeout_sec: Optional[float] = None) -> Dict[str, Any]:
+    def _parse_elements(self, events: List[JSONStreamEvent], final: bool) -> bool:
+        # fast path for a run of array elements (the bulk of a large document), which
+        # bypasses the state machine while the elements are separated by commas; it is
+        # equivalent to _decode_value plus the NEXT_ELEMENT state, but it avoids their
+        # per-element overhead; False means the next chunk is needed
+        text, text_length = self._text, len(self._text)
+        scan_once, append, key = self._scan_once, events.append, self._key
+        pos, index = self._pos, self._index
         try:
-            self._socket.settimeout(timeout_sec)
-            length, msg_type = self._recv_header()
-            if msg_type != MessageType.JSON:
-                raise ValueError(f"Unexpected message type: {msg_type}.")
-            payload = self._socket.recv(length)
-            return loads(payload.decode(_ENCODING))
-        except (TimeoutError, timeout) as e:
-            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to read data from the socket.") from e
+            while True:
+                try:
+                    value, end = scan_once(text, pos)
+                except (StopIteration, JSONDecodeError) as e:
+                    if final:
+                        raise ValueError("Invalid JSON value.") from e
+                    return False
+                if not final and (end == text_length or text[end] not in _JSON_DELIMITERS):
+                    return False
+                append(JSONStreamEvent(key, value, index))
+                index += 1
+                if end == text_length or text[end] != ",":
+                    pos = end
+                    self._state = _JSON_STREAM_NEXT_ELEMENT
+                    return True
+                pos = end + 1
+                if pos < text_length and text[pos] in _JSON_WHITESPACE:
+                    pos = _JSON_WHITESPACE_PATTERN.match(text, pos).end()
+                self._state = _JSON_STREAM_ELEMENT
+                if pos == text_length:
+                    return True
         finally:
-            self._clear_timeout()
+            self._pos, self._index = pos, index
 
-    def _recv_header(self) -> tuple[int, int]:
-        header_as_bytes = self._socket.recv(_HEADER_SIZE)
-        if not header_as_bytes:
-            raise EOFError("EOF encountered when attempting to read from the socket.")
-        return unpack(_HEADER_FORMAT, header_as_bytes)
+    def _expect(self, char: str, expected_chars: str) -> None:
+        if char not in expected_chars:
+            raise ValueError(f"Unexpected character '{char}' in JSON document (expected one of '{expected_chars}').")
+        self._pos += 1
 
-    def close(self) -> None:
-        self._socket.close()
+    def _end_array(self) -> None:
+        self._state = _JSON_STREAM_DONE if self._key is None else _JSON_STREAM_NEXT_KEY
 
 
-@dataclass(frozen=True)
-class RemoteAddress:
-    host: str
-    port: int
+class PooledBuffer:
 
+    # Buffer acquired from a BufferPool; the whole buffer is available as view (it can
+    # be longer than requested). After release, neither the buffer nor any view of it
+    # may be used any more. A buffer garbage collected without being released is
+    # counted as leaked by its pool.
 
-class TCPListener:
+    __slots__ = ("buffer", "view", "_pool", "_size_class", "_released")
 
-    def __init__(self, socket: socket) -> None:
-        self._socket = socket
-        
-    def accept(self) -> tuple[TCPSocket, RemoteAddress]:
-        self._socket.settimeout(1)
-        while True:
-            try:
-                connection, (remote_address, remote_port) = self._socket.accept()
-                return (
-                    TCPSocket(connection),
-                    RemoteAddress(host=remote_address, port=remote_port),
-                )
-            except timeout:
-                ...
+    def __init__(self, buffer: bytearray, pool: "BufferPool", size_class: Optional[int]) -> None:
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self._pool = pool
+        self._size_class = size_class
+        self._released = False
 
-    def get_reuse_address(self) -> bool:
-        reuse_address = self._socket.getsockopt(SOL_SOCKET, SO_REUSEADDR)
-        return bool(reuse_address)
+    def release(self) -> None:
+        # releasing the same buffer several times is harmless
+        if not self._released:
+            self._released = True
+            self._pool._release(self)
 
-    def get_reuse_port(self) -> bool:
-        if not is_reuse_port_supported():
-            return False
-        from socket import SO_REUSEPORT
-        reuse_port = self._socket.getsockopt(SOL_SOCKET, SO_REUSEPORT)
-        return bool(reuse_port)
+    def __del__(self) -> None:
+        if not self._released:
+            self._pool._count_leak(self._size_class)
 
-    def close(self) -> None:
-        self._socket.close()
 
+class BufferPool:
 
-class UDPSocket:
+    # Size-classed pool of reusable buffers shared by the sockets of a process, so the
+    # receive buffers of short-lived connections and the datagrams of UDP sockets do not
+    # allocate fresh memory for each connection or message. A request is served by the
+    # smallest size class (power of two) big enough; requests exceeding the largest class
+    # are allocated directly. For each class, the pool counts the buffers acquired,
+    # released, allocated and reused, plus the outstanding buffers and their high-water
+    # mark; outstanding buffers which never return, and leaked buffers (garbage collected
+    # without being released), indicate a missing release.
+
+    _COUNTER_NAMES = ["acquired", "released", "allocated", "reused", "outstanding", "high_water_mark", "leaked"]
+
+    def __init__(self,
+                 min_class_size: int = _BUFFER_POOL_MIN_CLASS_SIZE,
+                 max_class_size: int = _BUFFER_POOL_MAX_CLASS_SIZE,
+                 max_free_bytes_per_class: int = _BUFFER_POOL_MAX_FREE_BYTES_PER_CLASS) -> None:
+        self._min_class_size = min_class_size
+        self._max_class_size = max_class_size
+        self._max_free_bytes_per_class = max_free_bytes_per_class
+        self._free: Dict[int, List[bytearray]] = {}
+        self._counters: Dict[Optional[int], Dict[str, int]] = {}
+        self._lock = Lock()
+
+    def acquire(self, size: int) -> PooledBuffer:
+        size_class = self._get_size_class(size)
+        with self._lock:
+            counters = self._get_counters(size_class)
+            counters["acquired"] += 1
+            counters["outstanding"] += 1
+            counters["high_water_mark"] = max(counters["high_water_mark"], counters["outstanding"])
+            free_buffers = self._free.get(size_class)
+            if free_buffers:
+                counters["reused"] += 1
+                return PooledBuffer(free_buffers.pop(), self, size_class)
+            counters["allocated"] += 1
+        return PooledBuffer(bytearray(size if size_class is None else size_class), self, size_class)
+
+    def get_stats(self) -> Dict[str, int]:
+        # totals over all size classes (high-water marks are summed up)
+        with self._lock:
+            return {name: sum(counters[name] for counters in self._counters.values()) for name in self._COUNTER_NAMES}
+
+    def get_class_stats(self) -> Dict[Optional[int], Dict[str, int]]:
+        # None stands for the buffers larger than the largest size class
+        with self._lock:
+            return {size_class: dict(counters) for size_class, counters in self._counters.items()}
 
-    def __init__(self, socket: socket, msg_size: int) -> None:
+    def _release(self, pooled_buffer: PooledBuffer) -> None:
+        size_class = pooled_buffer._size_class
+        buffer = pooled_buffer.buffer
+        pooled_buffer.view.release()
+        with self._lock:
+            counters = self._counters[size_class]
+            counters["released"] += 1
+            counters["outstanding"] -= 1
+            if size_class is None:
+                return
+            free_buffers = self._free.setdefault(size_class, [])
+            if (len(free_buffers) + 1) * size_class <= self._max_free_bytes_per_class:
+                free_buffers.append(buffer)
+
+    def _count_leak(self, size_class: Optional[int]) -> None:
+        with self._lock:
+            counters = self._counters[size_class]
+            counters["leaked"] += 1
+            counters["outstanding"] -= 1
+
+    def _get_size_class(self, size: int) -> Optional[int]:
+        if size > self._max_class_size:
+            return None
+        return max(self._min_class_size, 1 << (size - 1).bit_length())
+
+    def _get_counters(self, size_class: Optional[int]) -> Dict[str, int]:
+        if size_class not in self._counters:
+            self._counters[size_class] = {name: 0 for name in self._COUNTER_NAMES}
+        return self._counters[size_class]
+
+
+_BUFFER_POOL = BufferPool()
+
+
+def get_buffer_pool() -> BufferPool:
+    return _BUFFER_POOL
+
+
+def format_buffer_pool_stats(stats: Dict[str, int]) -> str:
+    return ", ".join(f"{name} = {value}" for name, value in stats.items())
+
+
+class FrameReader:
+
+    # Frames are received in large chunks directly into a reusable buffer, and their
+    # payloads are handed out as memoryview slices of that buffer without any copy.
+    # Such a slice is only valid until the next read from the same reader. The buffer
+    # is taken from the buffer pool, and it must be returned by close.
+
+    def __init__(self,
+                 socket: socket,
+                 buffer_size: int = _DEFAULT_RECV_BUFFER_SIZE,
+                 max_frame_size: int = _DEFAULT_MAX_FRAME_SIZE) -> None:
         self._socket = socket
-        self._msg_size = msg_size
+        self._max_frame_size = max_frame_size
+        self._pooled_buffer = _BUFFER_POOL.acquire(buffer_size)
+        self._buffer = self._pooled_buffer.buffer
+        self._view = self._pooled_buffer.view
+        # buffer replaced by a bigger one, kept until the frames handed out from it are
+        # no longer valid (i.e. until the next read from the socket)
+        self._retired_buffer: Optional[PooledBuffer] = None
+        self._start = 0
+        self._end = 0
+        self._header_struct = _HEADER_STRUCT
 
-    def send_text_msg(self, dst: Endpoint, msg: str) -> None:
-        payload = bytes(dumps(msg), _ENCODING)
-        self._send_msg(dst, MessageType.TEXT, payload)
+    def set_protocol_version(self, protocol_version: ProtocolVersion) -> None:
+        self._header_struct = _HEADER_STRUCTS[protocol_version]
 
-    def send_json_msg(self, dst: Endpoint, msg: Dict[str, Any]) -> None:
-        payload = bytes(dumps(msg), _ENCODING)
-        self._send_msg(dst, MessageType.JSON, payload)
+    def get_buffered_byte_count(self) -> int:
+        return self._end - self._start
 
-    def _send_msg(self, dst: Endpoint, msg_type: MessageType, payload: bytes) -> None:
-        header = pack(_HEADER_FORMAT, len(payload), msg_type)
-        buffer = header + payload
-        padding_length = self._msg_size - len(buffer)
-        buffer += padding_length * b'\0'
-        self._socket.sendto(buffer, (dst.address, dst.port))
+    def read_buffered_frame(self) -> Optional[Frame]:
+        # never moves the buffered data, as the frames handed out by the same batch
+        # (see read_frames) are slices of the buffer; the space for an incomplete frame
+        # is only reserved by the next read from the socket
+        header_size = self._header_struct.size
+        if self._end - self._start < header_size:
+            return None
+        length, msg_type = self._header_struct.unpack_from(self._buffer, self._start)
+        self.check_frame_size(length)
+        payload_start = self._start + header_size
+        payload_end = payload_start + length
+        if payload_end > self._end:
+            return None
+        self._start = payload_end
+        return _create_frame(msg_type, self._view[payload_start:payload_end], self._max_frame_size)
 
-    def recv_text_msg(self) -> tuple[Endpoint, str]:
-        datagram, (address, port) = self._socket.recvfrom(self._msg_size)
-        msg_length, msg_type = unpack(_HEADER_FORMAT, datagram[0 : _HEADER_SIZE])
-        if msg_type != MessageType.TEXT:
-            raise ValueError(f"Unexpected message type: {msg_type}.")
-        payload = datagram[_HEADER_SIZE:_HEADER_SIZE + msg_length]
-        return (
-            Endpoint(address=address, port=port),
-            payload.decode(_ENCODING)
-        )
+    def check_frame_size(self, length: int) -> None:
+        # for frames to be assembled in memory; the connection is out of sync after the
+        # error, so it has to be closed
+        if length > self._max_frame_size:
+            raise ValueError(f"Frame size {length} bytes exceeds the limit of {self._max_frame_size} bytes.")
 
-    def recv_json_msg(self) -> tuple[Endpoint, Dict[str, Any]]:
-        datagram, (address, port) = self._socket.recvfrom(self._msg_size)
-        msg_length, msg_type = unpack(_HEADER_FORMAT, datagram[0:_HEADER_SIZE])
-        if msg_type != MessageType.JSON:
-            raise ValueError(f"Unexpected message type: {msg_type}.")
-        payload = datagram[_HEADER_SIZE:_HEADER_SIZE + msg_length]
-        return (
-            Endpoint(address=address, port=port),
-            loads(payload.decode(_ENCODING))
-        )
+    def peek_header(self) -> tuple[int, int]:
+        # (payload length, message type) of the next frame, without consuming anything
+        header_size = self._header_struct.size
+        while self._end - self._start < header_size:
+            self._fill()
+        return self._header_struct.unpack_from(self._buffer, self._start)
 
-    def close(self) -> None:
-        self._socket.close()
+    def read_header(self) -> tuple[int, int]:
+        # only consumes the header, so the payload can be read by read_payload_chunks
+        header = self.peek_header()
+        self._start += self._header_struct.size
+        return header
 
+    def read_payload_chunks(self, length: int, chunk_size: int) -> Iterator[memoryview]:
+        # the payload is never assembled in the buffer, so the buffer does not grow
+        # with the frame; each chunk is only valid until the next one is requested
+        remaining = length
+        while remaining:
+            if self._start == self._end:
+                try:
+                    self._fill()
+                except EOFError as e:
+                    raise EOFError("EOF encountered in the middle of a frame.") from e
+            chunk_end = self._start + min(remaining, self._end - self._start, chunk_size)
+            chunk = self._view[self._start:chunk_end]
+            remaining -= chunk_end - self._start
+            self._start = chunk_end
+            yield chunk
 
-def is_reuse_port_supported() -> bool:
-    if system() == "Windows":
-        return False
-    import socket
-    return hasattr(socket, "SO_REUSEPORT")
+    def read_into(self, destination: memoryview) -> None:
+        # the bytes already buffered are copied, the rest is received directly into the
+        # destination (e.g. a memory-mapped file), bypassing the buffer of the reader
+        buffered_byte_count = min(self._end - self._start, len(destination))
+        destination[:buffered_byte_count] = self._view[self._start:self._start + buffered_byte_count]
+        self._start += buffered_byte_count
+        offset = buffered_byte_count
+        while offset < len(destination):
+            received = self._socket.recv_into(destination[offset:])
+            if not received:
+                raise EOFError("EOF encountered in the middle of a frame.")
+            offset += received
 
+    def read_frame(self) -> Frame:
+        frame = self.read_buffered_frame()
+        while frame is None:
+            self._reserve_incomplete_frame()
+            self._fill()
+            frame = self.read_buffered_frame()
+        return frame
 
-def open_tcp_listener(address: str, port: int, reuse_address: bool = False, reuse_port: bool = False) -> TCPListener:
-    server_socket = socket(AF_INET, SOCK_STREAM)
-    if reuse_address:
-        server_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1 if reuse_address else 0)
-    if reuse_port and is_reuse_port_supported():
-        from socket import SO_REUSEPORT
-        server_socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1 if reuse_port else 0)
-    server_socket.bind((address, port))
-    server_socket.listen(5)
-    return TCPListener(server_socket)
+    def read_frames(self, max_count: Optional[int] = None) -> List[Frame]:
+        frames = [self.read_frame()]
+        while max_count is None or len(frames) < max_count:
+            frame = self.read_buffered_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
 
+    def close(self) -> None:
+        self._pooled_buffer.release()
+        self._release_retired_buffer()
 
-def open_tcp_connection(address: str, port: int, timeout_sec: Optional[float] = None) -> TCPSocket:
-    connection = create_connection((address, port), timeout=timeout_sec)
-    return TCPSocket(connection)
+    def _reserve_incomplete_frame(self) -> None:
+        # the header of the incomplete frame (if already buffered) tells how much space
+        # the whole frame needs
+        header_size = self._header_struct.size
+        if self._end - self._start >= header_size:
+            length, _ = self._header_struct.unpack_from(self._buffer, self._start)
+            self._reserve(header_size + length)
 
+    def _reserve(self, frame_size: int) -> None:
+        if frame_size > len(self._buffer):
+            pooled_buffer = _BUFFER_POOL.acquire(max(frame_size, 2 * len(self._buffer)))
+            buffered_byte_count = self._end - self._start
+            pooled_buffer.view[0:buffered_byte_count] = self._view[self._start:self._end]
+            self._release_retired_buffer()
+            self._retired_buffer = self._pooled_buffer
+            self._pooled_buffer = pooled_buffer
+            self._buffer = pooled_buffer.buffer
+            self._view = pooled_buffer.view
+            self._start, self._end = 0, buffered_byte_count
+        elif self._start + frame_size > len(self._buffer):
+            self._compact()
 
-def open_udp_listener(address: str, port: int, msg_size: int = 4096) -> UDPSocket:
-    listener = socket(AF_INET, SOCK_DGRAM)
-    listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-    listener.bind((address, port))
-    return UDPSocket(listener, msg_size)
+    def _compact(self) -> None:
+        buffered_byte_count = self._end - self._start
+        self._view[0:buffered_byte_count] = self._view[self._start:self._end]
+        self._start, self._end = 0, buffered_byte_count
 
+    def _release_retired_buffer(self) -> None:
+        if self._retired_buffer:
+            self._retired_buffer.release()
+            self._retired_buffer = None
 
-def open_udp_client(msg_size: int = 4096) -> UDPSocket:
-    return UDPSocket(socket(AF_INET, SOCK_DGRAM), msg_size)
+    def _fill(self) -> None:
+        self._release_retired_buffer()
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif 2 * self._end > len(self._buffer):
+            self._compact()
+        received = self._socket.recv_into(self._view[self._end:])
+        if not received:
+            if self._start != self._end:
+                raise EOFError("EOF encountered in the middle of a frame.")
+            raise EOFError("EOF encountered when attempting to read from the socket.")
+        self._end += received
 
 
-def open_multicast_publisher(msg_size: int) -> UDPSocket:
-    publisher = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP)
-    publisher.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, 2)
-    return UDPSocket(publisher, msg_size)
+class _FramedConnection:
 
+    # State shared by the blocking and the asyncio-based TCP sockets: the protocol
+    # version and the compression, plus the handshake negotiating both of them.
+    #
+    # If the max. protocol version is specified, this is the server side of the
+    # connection which answers the handshake (if any) sent by the client when the
+    # first frame is read; until then, and if there is no handshake, the protocol
+    # version 1 is used, so clients unaware of the handshake keep working.
+    #
+    # Outgoing frames are only compressed if the handshake has confirmed the peer
+    # supports the desired compression, and if the payload is at least as long as
+    # the compression threshold.
 
-def open_multicast_subscriber(address: str, port: int, msg_size: int = 4096) -> UDPSocket:
-    subscriber = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP)
-    subscriber.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-    subscriber.bind(("", port))
+    def __init__(self,
+                 max_protocol_version: Optional[ProtocolVersion],
+                 compression: Optional[str],
+                 compression_threshold: int) -> None:
+        self._max_protocol_version = max_protocol_version
+        self._handshake_pending = max_protocol_version is not None
+        self._desired_compression = get_compression(compression) if compression else None
+        self._compression = None
+        self._compression_threshold = compression_threshold
+        self._peer_features = []
+        self._set_protocol_version(ProtocolVersion.V1)
+
+    def get_protocol_version(self) -> ProtocolVersion:
+        return self._protocol_version
+
+    def get_compression(self) -> Optional[str]:
+        return self._compression.name if self._compression else None
+
+    def supports_correlation_ids(self) -> bool:
+        # peers announce the support by the handshake, so without any handshake, no
+        # correlation IDs may be sent
+        return _CORRELATION_ID_FEATURE in self._peer_features
+
+    def _create_handshake_offer(self, max_protocol_version: ProtocolVersion) -> List[bytes]:
+        offer = {
+            "versions": [version for version in ProtocolVersion if version <= max_protocol_version],
+            "compressions": get_compression_names(),
+            "features": _FEATURES,
+        }
+        return self._encode_frame(MessageType.HELLO, bytes(dumps(offer), _ENCODING))
+
+    def _process_handshake_answer(self, frame: Frame) -> None:
+        if frame.msg_type != MessageType.HELLO:
+            raise ConnectionError(f"Unexpected message type {frame.msg_type} received instead of handshake response.")
+        answer = loads(str(frame.payload, _ENCODING))
+        self._set_protocol_version(ProtocolVersion(answer["version"]))
+        self._set_peer_compressions(answer.get("compressions", []))
+        self._peer_features = answer.get("features", [])
+
+    def _process_handshake_offer(self, frame: Frame) -> List[bytes]:
+        # the answer is encoded before the negotiated protocol version is applied, as
+        # the client expects it to use the protocol version 1
+        offer = loads(str(frame.payload, _ENCODING))
+        supported_versions = [version for version in offer["versions"] if version <= self._max_protocol_version]
+        protocol_version = ProtocolVersion(max(supported_versions, default=ProtocolVersion.V1))
+        answer = {
+            "version": protocol_version,
+            "compressions": get_compression_names(),
+            "features": _FEATURES,
+        }
+        buffers = self._encode_frame(MessageType.HELLO, bytes(dumps(answer), _ENCODING))
+        self._set_protocol_version(protocol_version)
+        self._set_peer_compressions(offer.get("compressions", []))
+        self._peer_features = offer.get("features", [])
+        return buffers
+
+    def _set_peer_compressions(self, peer_compressions: List[str]) -> None:
+        if self._desired_compression and self._desired_compression.name in peer_compressions:
+            self._compression = self._desired_compression
+
+    def _set_protocol_version(self, protocol_version: ProtocolVersion) -> None:
+        self._protocol_version = protocol_version
+        self._header_struct = _HEADER_STRUCTS[protocol_version]
+        self._max_payload_size = _MAX_PAYLOAD_SIZES[protocol_version]
+
+    def compress_encoded_msg(self, msg_type: MessageType, payload: bytes) -> tuple[int, bytes]:
+        # applies the negotiated compression in advance, so a payload sent many times
+        # (e.g. a corpus) is compressed just once; the result (with the compression flag
+        # in the message type, if compressed) can be passed to send_encoded_msg
+        if msg_type & _COMPRESSION_MASK or not self._compression or len(payload) < self._compression_threshold:
+            return msg_type, payload
+        compressed_payload = self._compression.compress(payload)
+        if len(compressed_payload) >= len(payload):
+            return msg_type, payload
+        return msg_type | self._compression.compression_id << _COMPRESSION_SHIFT, compressed_payload
+
+    def _encode_frame(self, msg_type: MessageType, payload: bytes, correlation_id: Optional[int] = None) -> List[bytes]:
+        msg_type, payload = self.compress_encoded_msg(msg_type, payload)
+        if correlation_id is None:
+            if len(payload) > self._max_payload_size:
+                raise ValueError(f"Payload size {len(payload)} bytes exceeds the limit of {self._max_payload_size} bytes of the protocol version {int(self._protocol_version)}.")
+            return [self._header_struct.pack(len(payload), msg_type), payload]
+        length = _CORRELATION_ID_STRUCT.size + len(payload)
+        if length > self._max_payload_size:
+            raise ValueError(f"Payload size {length} bytes exceeds the limit of {self._max_payload_size} bytes of the protocol version {int(self._protocol_version)}.")
+        msg_type |= _CORRELATION_ID_FLAG
+        return [self._header_struct.pack(length, msg_type), _CORRELATION_ID_STRUCT.pack(correlation_id), payload]
+
+
+class TCPSocket(_FramedConnection):
+
+    def __init__(self,
+                 socket: socket,
+                 recv_buffer_size: int = _DEFAULT_RECV_BUFFER_SIZE,
+                 max_protocol_version: Optional[ProtocolVersion] = None,
+                 compression: Optional[str] = None,
+                 compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD,
+                 max_frame_size: int = _DEFAULT_MAX_FRAME_SIZE) -> None:
+        self._socket = socket
+        self._reader = FrameReader(socket, recv_buffer_size, max_frame_size)
+        self._max_frame_size = max_frame_size
+        self._timeout_sec = socket.gettimeout()
+        super().__init__(max_protocol_version, compression, compression_threshold)
+
+    def negotiate(self, max_protocol_version: ProtocolVersion, timeout_sec: Optional[float] = None) -> ProtocolVersion:
+        self._send_buffers(self._create_handshake_offer(max_protocol_version), timeout_sec)
+        self._process_handshake_answer(self._recv_frame(timeout_sec))
+        return self._protocol_version
+
+    def _accept_handshake(self, timeout_sec: Optional[float]) -> None:
+        # only the header of the first frame is peeked, so a large first frame which is
+        # not a handshake can still be read in chunks
+        _, msg_type = self._reader.peek_header()
+        self._handshake_pending = False
+        if msg_type != MessageType.HELLO:
+            return
+        frame = self._reader.read_frame()
+        self._send_buffers(self._process_handshake_offer(frame), timeout_sec)
+
+    def _set_protocol_version(self, protocol_version: ProtocolVersion) -> None:
+        super()._set_protocol_version(protocol_version)
+        self._reader.set_protocol_version(protocol_version)
+
+    def get_snd_buff_size(self) -> int:
+        return self._socket.getsockopt(SOL_SOCKET, SO_SNDBUF)
+
+    def get_rcv_buff_size(self) -> int:
+        return self._socket.getsockopt(SOL_SOCKET, SO_RCVBUF)
+
+    def send_text_msg(self, msg: str, timeout_sec: Optional[float] = None, correlation_id: Optional[int] = None) -> int:
+        payload = bytes(msg, _ENCODING)
+        return self._send_msg(MessageType.TEXT, payload, timeout_sec, correlation_id)
+
+    def send_json_msg(self, msg: Dict[str, Any], timeout_sec: Optional[float] = None, correlation_id: Optional[int] = None) -> int:
+        payload = bytes(dumps(msg), _ENCODING)
+        return self._send_msg(MessageType.JSON, payload, timeout_sec, correlation_id)
+
+    def send_binary_msg(self,
+                        msg: Any,
+                        codec_name: Optional[str] = None,
+                        timeout_sec: Optional[float] = None,
+                        correlation_id: Optional[int] = None) -> int:
+        payload = _encode_binary_payload(msg, codec_name)
+        return self._send_msg(MessageType.BINARY, payload, timeout_sec, correlation_id)
+
+    def send_many(self,
+                  msgs: List[Union[str, Dict[str, Any]]],
+                  timeout_sec: Optional[float] = None,
+                  codec_name: Optional[str] = None) -> int:
+        # the messages are encoded by encode_msg; the whole batch is written by a single
+        # vectored write (unless it exceeds IOV_MAX)
+        buffers = []
+        for msg in msgs:
+            buffers.extend(self._encode_frame(*encode_msg(msg, codec_name)))
+        return self._send_buffers(buffers, timeout_sec)
+
+    def send_file(self, file_path: str, name: Optional[str] = None, timeout_sec: Optional[float] = None) -> int:
+        # the content of the file is sent by the kernel (sendfile) straight from the page
+        # cache, so it is never copied to the user space; the name announced to the peer
+        # defaults to the name of the file without the directory
+        name_bytes = bytes(name or basename(file_path), _ENCODING)
+        with open(file_path, "rb") as file:
+            size = fstat(file.fileno()).st_size
+            length = _FILE_NAME_LENGTH_STRUCT.size + len(name_bytes) + size
+            if length > self._max_payload_size:
+                raise ValueError(f"Payload size {length} bytes exceeds the limit of {self._max_payload_size} bytes of the protocol version {int(self._protocol_version)}.")
+            buffers = [
+                self._header_struct.pack(length, MessageType.FILE),
+                _FILE_NAME_LENGTH_STRUCT.pack(len(name_bytes)),
+                name_bytes,
+            ]
+            if size <= _FILE_INLINE_THRESHOLD:
+                content = file.read(size)
+                if len(content) != size:
+                    raise ValueError(f"File {file_path} has been truncated while being read ({len(content)} of {size} bytes read).")
+                return self._send_buffers(buffers + [content], timeout_sec)
+            header_byte_count = self._send_buffers(buffers, timeout_sec)
+            try:
+                sent_byte_count = self._socket.sendfile(file, 0, size)
+            except (TimeoutError, timeout) as e:
+                raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to write data to the socket.") from e
+        if sent_byte_count != size:
+            # the peer expects the announced number of bytes, so the connection is unusable
+            raise ConnectionError(f"File {file_path} has been truncated while being sent ({sent_byte_count} of {size} bytes sent).")
+        return header_byte_count + size
+
+    def send_encoded_msg(self, msg_type: MessageType, payload: bytes, timeout_sec: Optional[float] = None) -> int:
+        # sends a payload encoded in advance (e.g. by encode_msg), possibly also
+        # compressed in advance by compress_encoded_msg
+        return self._send_msg(msg_type, payload, timeout_sec)
+
+    def set_timeout(self, timeout_sec: Optional[float]) -> None:
+        # applies the timeout in advance, e.g. before the socket is shared by a sending
+        # and a receiving thread which then both pass the same timeout
+        self._set_timeout(timeout_sec)
+
+    def _set_timeout(self, timeout_sec: Optional[float]) -> None:
+        # settimeout costs a syscall (it toggles the blocking mode of the socket), so
+        # it is only invoked if the timeout differs from the one used last time
+        if timeout_sec != self._timeout_sec:
+            self._socket.settimeout(timeout_sec)
+            self._timeout_sec = timeout_sec
+
+    def _send_msg(self,
+                  msg_type: MessageType,
+                  payload: bytes,
+                  timeout_sec: Optional[float] = None,
+                  correlation_id: Optional[int] = None) -> int:
+        return self._send_buffers(self._encode_frame(msg_type, payload, correlation_id), timeout_sec)
+
+    def _send_buffers(self, buffers: List[bytes], timeout_sec: Optional[float]) -> int:
+        try:
+            self._set_timeout(timeout_sec)
+            if is_sendmsg_supported():
+                return self._sendmsg_all(buffers)
+            buffer = b"".join(buffers)
+            self._socket.sendall(buffer)
+            return len(buffer)
+        except (TimeoutError, timeout) as e:
+            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to write data to the socket.") from e
+
+    def _sendmsg_all(self, buffers: List[bytes]) -> int:
+        total_byte_count = sum(map(len, buffers))
+        index = 0
+        while index < len(buffers):
+            sent_byte_count = self._socket.sendmsg(buffers[index:index + _MAX_IOV_COUNT])
+            while index < len(buffers) and sent_byte_count >= len(buffers[index]):
+                sent_byte_count -= len(buffers[index])
+                index += 1
+            if sent_byte_count:
+                buffers[index] = memoryview(buffers[index])[sent_byte_count:]
+        return total_byte_count
+
+    def recv_text_msg(self, timeout_sec: Optional[float] = None) -> Optional[str]:
+        payload = self._recv_payload(MessageType.TEXT, timeout_sec)
+        return str(payload, _ENCODING)
+
+    def recv_json_msg(self, timeout_sec: Optional[float] = None) -> Dict[str, Any]:
+        payload = self._recv_payload(MessageType.JSON, timeout_sec)
+        return loads(str(payload, _ENCODING))
+
+    def recv_binary_msg(self, timeout_sec: Optional[float] = None) -> Any:
+        payload = self._recv_payload(MessageType.BINARY, timeout_sec)
+        return _decode_binary_payload(payload)
+
+    def recv_msg(self, timeout_sec: Optional[float] = None) -> Any:
+        return decode_frame(self.recv_frame(timeout_sec))
+
+    def recv_frame(self, timeout_sec: Optional[float] = None) -> Frame:
+        # the payload of the frame is only valid until the next recv_* call
+        frame = self._reader.read_buffered_frame()
+        if frame is None:
+            frame = self._recv_frame(timeout_sec)
+        return frame
+
+    def recv_frames(self, max_count: Optional[int] = None, timeout_sec: Optional[float] = None) -> List[Frame]:
+        # all frames already present in the receive buffer are returned, plus whatever
+        # a single read from the socket completes, so several frames can be obtained
+        # with one syscall; the payloads are only valid until the next recv_* call
+        try:
+            self._set_timeout(timeout_sec)
+            if self._handshake_pending:
+                self._accept_handshake(timeout_sec)
+            return self._reader.read_frames(max_count)
+        except (TimeoutError, timeout) as e:
+            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to read data from the socket.") from e
+
+    def peek_msg_type(self, timeout_sec: Optional[float] = None) -> int:
+        # type of the next message (without the flags), e.g. to decide whether it has to
+        # be received by recv_file; nothing is consumed
+        try:
+            self._set_timeout(timeout_sec)
+            if self._handshake_pending:
+                self._accept_handshake(timeout_sec)
+            _, msg_type = self._reader.peek_header()
+            return msg_type & _MSG_TYPE_MASK
+        except (TimeoutError, timeout) as e:
+            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to read data from the socket.") from e
+
+    def recv_file(self, directory: str, timeout_sec: Optional[float] = None) -> ReceivedFile:
+        # the destination file is preallocated to its final size and memory-mapped, and
+        # the content is received straight into the mapping; the file name announced by
+        # the peer is stripped of any directory part, and an existing file is overwritten
+        try:
+            self._set_timeout(timeout_sec)
+            if self._handshake_pending:
+                self._accept_handshake(timeout_sec)
+            _, msg_type = self._reader.peek_header()
+            if msg_type != MessageType.FILE:
+                raise ValueError(f"Unexpected message type {msg_type & _MSG_TYPE_MASK} received instead of file.")
+            length, _ = self._reader.read_header()
+            if length < _FILE_NAME_LENGTH_STRUCT.size:
+                raise ValueError(f"File frame too short ({length} bytes).")
+            name_length_bytes = bytearray(_FILE_NAME_LENGTH_STRUCT.size)
+            self._reader.read_into(memoryview(name_length_bytes))
+            name_length, = _FILE_NAME_LENGTH_STRUCT.unpack(name_length_bytes)
+            if name_length > length - _FILE_NAME_LENGTH_STRUCT.size:
+                raise ValueError(f"File name length {name_length} exceeds the frame length {length}.")
+            name_bytes = bytearray(name_length)
+            self._reader.read_into(memoryview(name_bytes))
+            name = basename(str(name_bytes, _ENCODING))
+            if name in ("", ".", ".."):
+                name = "unnamed"
+            file_path = join(directory, name)
+            size = length - _FILE_NAME_LENGTH_STRUCT.size - name_length
+            try:
+                self._recv_file_content(file_path, size)
+            except BaseException:
+                with suppress(FileNotFoundError):
+                    remove(file_path)
+                raise
+            return ReceivedFile(name, file_path, size)
+        except (TimeoutError, timeout) as e:
+            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to read data from the socket.") from e
+
+    def _recv_file_content(self, file_path: str, size: int) -> None:
+        with open(file_path, "w+b") as file:
+            if not size:
+                return
+            file.truncate(size)
+            with mmap(file.fileno(), size) as destination, memoryview(destination) as view:
+                self._reader.read_into(view)
+
+    def recv_json_stream(self,
+                         timeout_sec: Optional[float] = None,
+                         chunk_size: int = _DEFAULT_JSON_STREAM_CHUNK_SIZE) -> Iterator[JSONStreamEvent]:
+        # Incremental alternative to recv_json_msg for large frames: the payload is read
+        # in chunks of at most chunk_size bytes, and the events are yielded as soon as
+        # the chunks have been decoded, so the memory use does not grow with the frame
+        # (the elements of top-level arrays are decoded one by one, and any other value
+        # must not exceed the limit of JSONStreamDecoder). The generator must be
+        # exhausted (or closed) before the next recv_* call; if it is closed early, the
+        # rest of the payload is skipped. Frames with flags (i.e. compressed or with
+        # correlation ID) are decoded from the assembled payload.
+        try:
+            self._set_timeout(timeout_sec)
+            if self._handshake_pending:
+                self._accept_handshake(timeout_sec)
+            length, msg_type = self._reader.read_header()
+            chunks = self._reader.read_payload_chunks(length, chunk_size)
+            try:
+                if msg_type & _FLAGS_MASK:
+                    self._reader.check_frame_size(length)
+                    frame = _create_frame(msg_type, memoryview(b"".join(bytes(chunk) for chunk in chunks)), self._max_frame_size)
+                    msg_type, chunks = frame.msg_type, iter([frame.payload])
+                if msg_type != MessageType.JSON:
+                    raise ValueError(f"Unexpected message type: {msg_type}.")
+                decoder = JSONStreamDecoder()
+                for chunk in chunks:
+                    yield from decoder.feed(chunk)
+                yield from decoder.close()
+            except (GeneratorExit, ValueError):
+                for _ in chunks:
+                    ...
+                raise
+        except (TimeoutError, timeout) as e:
+            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to read data from the socket.") from e
+
+    def _recv_payload(self, expected_msg_type: MessageType, timeout_sec: Optional[float]) -> memoryview:
+        frame = self._reader.read_buffered_frame()
+        if frame is None:
+            frame = self._recv_frame(timeout_sec)
+        if frame.msg_type != expected_msg_type:
+            raise ValueError(f"Unexpected message type: {frame.msg_type}.")
+        return frame.payload
+
+    def _recv_frame(self, timeout_sec: Optional[float]) -> Frame:
+        try:
+            self._set_timeout(timeout_sec)
+            if self._handshake_pending:
+                self._accept_handshake(timeout_sec)
+            return self._reader.read_frame()
+        except (TimeoutError, timeout) as e:
+            raise TimeoutError(f"Timeout ({timeout_sec} sec) expired when attempting to read data from the socket.") from e
+
+    def get_recv_queue_size(self) -> Optional[int]:
+        return _get_queue_size(self._socket, _SIOCINQ)
+
+    def get_send_queue_size(self) -> Optional[int]:
+        return _get_queue_size(self._socket, _SIOCOUTQ)
+
+    def get_tcp_info(self) -> Optional[Dict[str, int]]:
+        return _get_tcp_info(self._socket)
+
+    def stats(self) -> Optional[TCPStats]:
+        # None if TCP_INFO is not supported by the platform
+        return _create_tcp_stats(_get_tcp_info(self._socket))
+
+    def get_socket_tuning(self) -> Dict[str, Optional[int]]:
+        # effective values of the tuning options (None = not supported)
+        return _get_socket_tuning(self._socket, _CONNECTION_TUNING_FIELDS)
+
+    def get_remote_address(self) -> "RemoteAddress":
+        remote_address, remote_port = self._socket.getpeername()[:2]
+        return RemoteAddress(host=remote_address, port=remote_port)
+
+    def is_alive(self) -> bool:
+        # cheap check of an idle connection (no request outstanding): it must not have
+        # anything to read, so readability means either EOF (the peer has closed the
+        # connection) or unsolicited data, none of which can be reused safely
+        if self._reader.get_buffered_byte_count():
+            return False
+        try:
+            return not _is_readable(self._socket)
+        except (OSError, ValueError):
+            return False
+
+    def shutdown_output(self) -> None:
+        # half-close; the peer reads EOF after all messages sent so far, but it can
+        # still send responses to them
+        self._socket.shutdown(SHUT_WR)
+
+    def close(self) -> None:
+        self._socket.close()
+        self._reader.close()
+
+
+@dataclass(frozen=True)
+class PipelinedResponse:
+    correlation_id: int
+    msg: Any
+    latency_sec: float
+
+
+class PipelinedConnection:
+
+    # Keeps up to window_size requests outstanding on a single connection, so the
+    # throughput is bound by the bandwidth rather than by the round trip time. Each
+    # request carries a correlation ID echoed back by the server, so the responses
+    # are matched even if the server answers out of order. If the server does not
+    # support correlation IDs, the responses are matched in the order of requests.
+    # Unlike TCPSocket, instances are not meant to be shared by several threads.
+
+    def __init__(self, socket: TCPSocket, window_size: int, timeout_sec: Optional[float] = None) -> None:
+        self._socket = socket
+        self._window_size = window_size
+        self._timeout_sec = timeout_sec
+        self._use_correlation_ids = socket.supports_correlation_ids()
+        self._last_correlation_id = 0
+        # send times of outstanding requests; dict preserves the order of requests
+        self._outstanding: Dict[int, float] = {}
+        self._completed: Dict[int, PipelinedResponse] = {}
+
+    def uses_correlation_ids(self) -> bool:
+        return self._use_correlation_ids
+
+    def get_outstanding_count(self) -> int:
+        return len(self._outstanding)
+
+    def submit(self, msg: Union[str, Dict[str, Any]]) -> int:
+        # strings are sent as text messages, dictionaries as JSON messages; if the
+        # window is full, responses are read until there is space in the window
+        while len(self._outstanding) >= self._window_size:
+            self._complete_next()
+        self._last_correlation_id = self._last_correlation_id % _MAX_CORRELATION_ID + 1
+        correlation_id = self._last_correlation_id
+        self._outstanding[correlation_id] = monotonic()
+        wire_correlation_id = correlation_id if self._use_correlation_ids else None
+        if isinstance(msg, str):
+            self._socket.send_text_msg(msg, self._timeout_sec, wire_correlation_id)
+        else:
+            self._socket.send_json_msg(msg, self._timeout_sec, wire_correlation_id)
+        return correlation_id
+
+    def get_response(self, correlation_id: int) -> PipelinedResponse:
+        while correlation_id not in self._completed:
+            if correlation_id not in self._outstanding:
+                raise ValueError(f"No outstanding request with correlation ID {correlation_id}.")
+            self._complete_next()
+        return self._completed.pop(correlation_id)
+
+    def pop_completed(self) -> List[PipelinedResponse]:
+        completed = list(self._completed.values())
+        self._completed.clear()
+        return completed
+
+    def drain(self) -> List[PipelinedResponse]:
+        while self._outstanding:
+            self._complete_next()
+        return self.pop_completed()
+
+    def request_all(self, msgs: List[Union[str, Dict[str, Any]]]) -> List[Any]:
+        # the responses are returned in the order of the requests
+        correlation_ids = [self.submit(msg) for msg in msgs]
+        return [self.get_response(correlation_id).msg for correlation_id in correlation_ids]
+
+    def _complete_next(self) -> None:
+        frame = self._socket.recv_frame(self._timeout_sec)
+        if self._use_correlation_ids:
+            correlation_id = frame.correlation_id
+            if correlation_id not in self._outstanding:
+                raise ConnectionError(f"Response with unexpected correlation ID {correlation_id} received.")
+        else:
+            correlation_id = next(iter(self._outstanding))
+        send_time = self._outstanding.pop(correlation_id)
+        self._completed[correlation_id] = PipelinedResponse(correlation_id, decode_frame(frame), monotonic() - send_time)
+
+
+class WriteCoalescer:
+
+    # Buffers framed messages written to a TCP connection and writes them with a single
+    # vectored write, so a burst of small messages costs one syscall instead of one per
+    # message. The buffered messages are flushed when:
+    # - the number of buffered bytes reaches max_bytes (0 = each message is written at once)
+    # - the oldest buffered message has been waiting for max_delay_sec; the delay is
+    #   checked whenever a message is added or flush_if_due is invoked, there is no timer
+    #   thread which would write to the socket behind the back of its owner
+    # - the owner forces the flush, typically before it blocks (e.g. reading the next
+    #   request), so the buffered messages never wait for the peer
+    # Like PipelinedConnection, instances are not meant to be shared by several threads.
+
+    def __init__(self,
+                 socket: TCPSocket,
+                 max_bytes: int = _DEFAULT_COALESCE_MAX_BYTES,
+                 max_delay_sec: float = _DEFAULT_COALESCE_MAX_DELAY_SEC,
+                 timeout_sec: Optional[float] = None) -> None:
+        self._socket = socket
+        self._max_bytes = max_bytes
+        self._max_delay_sec = max_delay_sec
+        self._timeout_sec = timeout_sec
+        self._buffers: List[bytes] = []
+        self._buffered_byte_count = 0
+        self._oldest_msg_time: Optional[float] = None
+        self._counters = {
+            "msgs": 0,
+            "writes": 0,
+            "size_flushes": 0,
+            "delay_flushes": 0,
+            "forced_flushes": 0,
+        }
+
+    def send_text_msg(self, msg: str, correlation_id: Optional[int] = None) -> int:
+        return self._add(MessageType.TEXT, bytes(msg, _ENCODING), correlation_id)
+
+    def send_json_msg(self, msg: Dict[str, Any], correlation_id: Optional[int] = None) -> int:
+        return self._add(MessageType.JSON, bytes(dumps(msg), _ENCODING), correlation_id)
+
+    def send_binary_msg(self, msg: Any, codec_name: Optional[str] = None, correlation_id: Optional[int] = None) -> int:
+        return self._add(MessageType.BINARY, _encode_binary_payload(msg, codec_name), correlation_id)
+
+    def get_buffered_byte_count(self) -> int:
+        return self._buffered_byte_count
+
+    def flush_if_due(self) -> int:
+        if self._oldest_msg_time is None or monotonic() - self._oldest_msg_time < self._max_delay_sec:
+            return 0
+        self._counters["delay_flushes"] += 1
+        return self._write()
+
+    def flush(self) -> int:
+        # returns the number of bytes written (zero if nothing was buffered)
+        if not self._buffers:
+            return 0
+        self._counters["forced_flushes"] += 1
+        return self._write()
+
+    def get_counters(self) -> Dict[str, int]:
+        return dict(self._counters)
+
+    def _add(self, msg_type: MessageType, payload: bytes, correlation_id: Optional[int]) -> int:
+        # returns the number of bytes written by the flush triggered by this message
+        # (if any), zero if the message has only been buffered
+        buffers = self._socket._encode_frame(msg_type, payload, correlation_id)
+        self._buffers.extend(buffers)
+        self._buffered_byte_count += sum(map(len, buffers))
+        self._counters["msgs"] += 1
+        if self._oldest_msg_time is None:
+            self._oldest_msg_time = monotonic()
+        if self._buffered_byte_count >= self._max_bytes:
+            self._counters["size_flushes"] += 1
+            return self._write()
+        return self.flush_if_due()
+
+    def _write(self) -> int:
+        buffers = self._buffers
+        self._buffers = []
+        self._buffered_byte_count = 0
+        self._oldest_msg_time = None
+        self._counters["writes"] += 1
+        return self._socket._send_buffers(buffers, self._timeout_sec)
+
+
+class AsyncTCPSocket(_FramedConnection):
+
+    # asyncio counterpart of TCPSocket using the same frame format (incl. handshake
+    # and compression); the buffering is provided by the StreamReader
+
+    def __init__(self,
+                 reader: StreamReader,
+                 writer: StreamWriter,
+                 max_protocol_version: Optional[ProtocolVersion] = None,
+                 compression: Optional[str] = None,
+                 compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD,
+                 max_frame_size: int = _DEFAULT_MAX_FRAME_SIZE) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._max_frame_size = max_frame_size
+        super().__init__(max_protocol_version, compression, compression_threshold)
+
+    async def negotiate(self, max_protocol_version: ProtocolVersion) -> ProtocolVersion:
+        await self._send_buffers(self._create_handshake_offer(max_protocol_version))
+        self._process_handshake_answer(await self._read_frame())
+        return self._protocol_version
+
+    async def send_text_msg(self, msg: str, correlation_id: Optional[int] = None) -> int:
+        payload = bytes(msg, _ENCODING)
+        return await self._send_msg(MessageType.TEXT, payload, correlation_id)
+
+    async def send_json_msg(self, msg: Dict[str, Any], correlation_id: Optional[int] = None) -> int:
+        payload = bytes(dumps(msg), _ENCODING)
+        return await self._send_msg(MessageType.JSON, payload, correlation_id)
+
+    async def send_binary_msg(self, msg: Any, codec_name: Optional[str] = None, correlation_id: Optional[int] = None) -> int:
+        payload = _encode_binary_payload(msg, codec_name)
+        return await self._send_msg(MessageType.BINARY, payload, correlation_id)
+
+    async def _send_msg(self, msg_type: MessageType, payload: bytes, correlation_id: Optional[int] = None) -> int:
+        return await self._send_buffers(self._encode_frame(msg_type, payload, correlation_id))
+
+    async def _send_buffers(self, buffers: List[bytes]) -> int:
+        self._writer.writelines(buffers)
+        await self._writer.drain()
+        return sum(map(len, buffers))
+
+    async def recv_text_msg(self) -> str:
+        payload = await self._recv_payload(MessageType.TEXT)
+        return str(payload, _ENCODING)
+
+    async def recv_json_msg(self) -> Dict[str, Any]:
+        payload = await self._recv_payload(MessageType.JSON)
+        return loads(str(payload, _ENCODING))
+
+    async def recv_binary_msg(self) -> Any:
+        payload = await self._recv_payload(MessageType.BINARY)
+        return _decode_binary_payload(payload)
+
+    async def recv_msg(self) -> Any:
+        return decode_frame(await self.recv_frame())
+
+    async def _recv_payload(self, expected_msg_type: MessageType) -> memoryview:
+        frame = await self.recv_frame()
+        if frame.msg_type != expected_msg_type:
+            raise ValueError(f"Unexpected message type: {frame.msg_type}.")
+        return frame.payload
+
+    async def recv_frame(self) -> Frame:
+        frame = await self._read_frame()
+        if self._handshake_pending:
+            self._handshake_pending = False
+            if frame.msg_type == MessageType.HELLO:
+                await self._send_buffers(self._process_handshake_offer(frame))
+                frame = await self._read_frame()
+        return frame
+
+    async def recv_json_stream(self, chunk_size: int = _DEFAULT_JSON_STREAM_CHUNK_SIZE) -> AsyncIterator[JSONStreamEvent]:
+        # asyncio counterpart of TCPSocket.recv_json_stream
+        length, msg_type = await self._read_header()
+        if self._handshake_pending:
+            self._handshake_pending = False
+            if msg_type == MessageType.HELLO:
+                frame = _create_frame(msg_type, await self._read_payload(length), self._max_frame_size)
+                await self._send_buffers(self._process_handshake_offer(frame))
+                length, msg_type = await self._read_header()
+        assembled_payload = b""
+        if msg_type & _FLAGS_MASK:
+            frame = _create_frame(msg_type, await self._read_payload(length), self._max_frame_size)
+            msg_type, assembled_payload, length = frame.msg_type, frame.payload, 0
+        chunks = self._read_payload_chunks(length, chunk_size)
+        try:
+            if msg_type != MessageType.JSON:
+                raise ValueError(f"Unexpected message type: {msg_type}.")
+            decoder = JSONStreamDecoder()
+            for event in decoder.feed(assembled_payload):
+                yield event
+            async for chunk in chunks:
+                for event in decoder.feed(chunk):
+                    yield event
+            for event in decoder.close():
+                yield event
+        except (GeneratorExit, ValueError):
+            async for _ in chunks:
+                ...
+            raise
+
+    async def _read_payload_chunks(self, length: int, chunk_size: int) -> AsyncIterator[memoryview]:
+        remaining = length
+        while remaining:
+            chunk = await self._read_payload(min(remaining, chunk_size))
+            remaining -= len(chunk)
+            yield chunk
+
+    async def _read_frame(self) -> Frame:
+        length, msg_type = await self._read_header()
+        return _create_frame(msg_type, await self._read_payload(length), self._max_frame_size)
+
+    async def _read_header(self) -> tuple[int, int]:
+        try:
+            header = await self._reader.readexactly(self._header_struct.size)
+        except IncompleteReadError as e:
+            if e.partial:
+                raise EOFError("EOF encountered in the middle of a frame.") from e
+            raise EOFError("EOF encountered when attempting to read from the socket.") from e
+        return self._header_struct.unpack(header)
+
+    async def _read_payload(self, length: int) -> memoryview:
+        # the whole payload is assembled by the stream reader, so the length (coming from
+        # the header) is checked first; the chunks of streamed frames are always short
+        if length > self._max_frame_size:
+            raise ValueError(f"Frame size {length} bytes exceeds the limit of {self._max_frame_size} bytes.")
+        try:
+            return memoryview(await self._reader.readexactly(length))
+        except IncompleteReadError as e:
+            raise EOFError("EOF encountered in the middle of a frame.") from e
+
+    def stats(self) -> Optional[TCPStats]:
+        # the transport socket only supports a subset of socket methods, but it is
+        # enough for getsockopt
+        return _create_tcp_stats(_get_tcp_info(self._writer.get_extra_info("socket")))
+
+    def get_socket_tuning(self) -> Dict[str, Optional[int]]:
+        return _get_socket_tuning(self._writer.get_extra_info("socket"), _CONNECTION_TUNING_FIELDS)
+
+    def get_remote_address(self) -> "RemoteAddress":
+        remote_address, remote_port = self._writer.get_extra_info("peername")[:2]
+        return RemoteAddress(host=remote_address, port=remote_port)
+
+    def is_alive(self) -> bool:
+        # the stream reader reads in the background, so the EOF or an error are
+        # already visible in the reader
+        return not (self._writer.is_closing() or self._reader.at_eof() or self._reader.exception())
+
+    async def close(self) -> None:
+        self._writer.close()
+        with suppress(Exception):
+            await self._writer.wait_closed()
+
+
+@dataclass(frozen=True)
+class RemoteAddress:
+    host: str
+    port: int
+
+
+class TCPListener:
+
+    def __init__(self,
+                 socket: socket,
+                 max_protocol_version: ProtocolVersion = ProtocolVersion.V2,
+                 compression: Optional[str] = None,
+                 compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD,
+                 tuning: Optional[SocketTuning] = None,
+                 max_frame_size: int = _DEFAULT_MAX_FRAME_SIZE) -> None:
+        self._socket = socket
+        self._max_protocol_version = max_protocol_version
+        self._compression = compression
+        self._compression_threshold = compression_threshold
+        self._tuning = tuning
+        self._max_frame_size = max_frame_size
+
+    def accept(self) -> tuple[TCPSocket, RemoteAddress]:
+        self._socket.settimeout(_ACCEPT_POLL_INTERVAL_SEC)
+        while True:
+            try:
+                connection, (remote_address, remote_port) = self._socket.accept()
+                return (
+                    self._wrap_connection(connection),
+                    RemoteAddress(host=remote_address, port=remote_port),
+                )
+            except timeout:
+                ...
+
+    def accept_pending(self, max_count: Optional[int] = None) -> List[tuple[TCPSocket, RemoteAddress]]:
+        # accepts the connections waiting in the backlog without blocking
+        if self._socket.gettimeout() != 0.0:
+            self._socket.setblocking(False)
+        connections = []
+        while max_count is None or len(connections) < max_count:
+            try:
+                connection, (remote_address, remote_port) = self._socket.accept()
+            except (BlockingIOError, InterruptedError):
+                break
+            connection.setblocking(True)
+            connections.append((
+                self._wrap_connection(connection),
+                RemoteAddress(host=remote_address, port=remote_port),
+            ))
+        return connections
+
+    def fileno(self) -> int:
+        return self._socket.fileno()
+
+    def _wrap_connection(self, connection: socket) -> TCPSocket:
+        _apply_socket_tuning(connection, self._tuning, _CONNECTION_TUNING_FIELDS)
+        return TCPSocket(
+            connection,
+            max_protocol_version=self._max_protocol_version,
+            compression=self._compression,
+            compression_threshold=self._compression_threshold,
+            max_frame_size=self._max_frame_size,
+        )
+
+    async def start_async_server(self, client_handler: Callable[[AsyncTCPSocket, RemoteAddress], Awaitable[None]]) -> Server:
+        async def handle_connection(reader: StreamReader, writer: StreamWriter) -> None:
+            remote_address, remote_port = writer.get_extra_info("peername")[:2]
+            _apply_socket_tuning(writer.get_extra_info("socket"), self._tuning, _CONNECTION_TUNING_FIELDS)
+            connection = AsyncTCPSocket(
+                reader,
+                writer,
+                max_protocol_version=self._max_protocol_version,
+                compression=self._compression,
+                compression_threshold=self._compression_threshold,
+                max_frame_size=self._max_frame_size,
+            )
+            await client_handler(connection, RemoteAddress(host=remote_address, port=remote_port))
+
+        return await start_server(handle_connection, sock=self._socket)
+
+    def get_socket_tuning(self) -> Dict[str, Optional[int]]:
+        return _get_socket_tuning(self._socket, _LISTENER_TUNING_FIELDS)
+
+    def get_reuse_address(self) -> bool:
+        reuse_address = self._socket.getsockopt(SOL_SOCKET, SO_REUSEADDR)
+        return bool(reuse_address)
+
+    def get_reuse_port(self) -> bool:
+        if not is_reuse_port_supported():
+            return False
+        from socket import SO_REUSEPORT
+        reuse_port = self._socket.getsockopt(SOL_SOCKET, SO_REUSEPORT)
+        return bool(reuse_port)
+
+    def close(self) -> None:
+        self._socket.close()
+
+
+class TCPListenerSelector:
+
+    # Waits for incoming connections on any number of listeners (epoll/kqueue based
+    # where available) instead of polling, and drains all connections pending on
+    # a ready listener per wakeup.
+
+    def __init__(self, listeners: List[TCPListener]) -> None:
+        self._selector = DefaultSelector()
+        for listener in listeners:
+            self._selector.register(listener, EVENT_READ, listener)
+
+    def accept(self, max_count_per_listener: Optional[int] = None) -> List[tuple[TCPSocket, RemoteAddress]]:
+        connections = []
+        while not connections:
+            for key, _ in self._selector.select(_ACCEPT_POLL_INTERVAL_SEC):
+                connections.extend(key.data.accept_pending(max_count_per_listener))
+        return connections
+
+    def close(self) -> None:
+        self._selector.close()
+
+
+class _IOVec(Structure):
+    _fields_ = [
+        ("iov_base", c_void_p),
+        ("iov_len", c_size_t),
+    ]
+
+
+class _MsgHdr(Structure):
+    _fields_ = [
+        ("msg_name", c_void_p),
+        ("msg_namelen", c_uint),
+        ("msg_iov", POINTER(_IOVec)),
+        ("msg_iovlen", c_size_t),
+        ("msg_control", c_void_p),
+        ("msg_controllen", c_size_t),
+        ("msg_flags", c_int),
+    ]
+
+
+class _MMsgHdr(Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", c_uint),
+    ]
+
+
+def _load_mmsg_functions() -> Optional[tuple[Any, Any]]:
+    # recvmmsg and sendmmsg of the C library, or None if they are not available
+    if system() != "Linux":
+        return None
+    try:
+        libc = CDLL(None, use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [c_int, POINTER(_MMsgHdr), c_uint, c_int, c_void_p]
+    recvmmsg.restype = c_int
+    sendmmsg.argtypes = [c_int, POINTER(_MMsgHdr), c_uint, c_int]
+    sendmmsg.restype = c_int
+    return recvmmsg, sendmmsg
+
+
+_MMSG_FUNCTIONS = _load_mmsg_functions()
+
+
+# the lengths in the message headers are read and written by structs rather than by the
+# ctypes fields, as the latter create a Python object for each access
+_MMSG_LEN_STRUCT = Struct(f"={_MMsgHdr.msg_len.offset}xI{sizeof(_MMsgHdr) - _MMsgHdr.msg_len.offset - 4}x")
+_IOV_LEN_OFFSET = _IOVec.iov_len.offset
+_IOV_LEN_STRUCT = Struct("N")
+
+# max. number of entries of the caches mapping socket addresses to endpoints and back
+_MAX_SOCKADDR_CACHE_SIZE = 4096
+
+
+class _DatagramBatch:
+
+    # Preallocated state of the batched I/O of a UDP socket in one direction: max_count
+    # slots of msg_size bytes (taken from the buffer pool), plus the socket addresses and
+    # the message headers passed to recvmmsg/sendmmsg. The headers permanently point to
+    # the slots, so only the lengths have to be set before each call.
+
+    def __init__(self, max_count: int, msg_size: int) -> None:
+        self.max_count = max_count
+        self.msg_size = msg_size
+        self.buffer = _BUFFER_POOL.acquire(max_count * msg_size)
+        self.slots = [self.buffer.view[i * msg_size:(i + 1) * msg_size] for i in range(max_count)]
+        # a reused buffer can contain anything, so the whole padding is zeroed first
+        self.dirty_ends = [msg_size] * max_count
+        self.names = bytearray(max_count * _SOCKADDR_IN_STRUCT.size)
+        self.header_bytes = bytearray(max_count * sizeof(_MMsgHdr))
+        self.headers = (_MMsgHdr * max_count).from_buffer(self.header_bytes)
+        self.iovec_bytes = bytearray(max_count * sizeof(_IOVec))
+        iovecs = (_IOVec * max_count).from_buffer(self.iovec_bytes)
+        buffer_address = addressof((c_char * len(self.buffer.buffer)).from_buffer(self.buffer.buffer))
+        names_address = addressof(c_char.from_buffer(self.names))
+        for i in range(max_count):
+            iovecs[i].iov_base = buffer_address + i * msg_size
+            iovecs[i].iov_len = msg_size
+            header = self.headers[i].msg_hdr
+            header.msg_name = names_address + i * _SOCKADDR_IN_STRUCT.size
+            header.msg_namelen = _SOCKADDR_IN_STRUCT.size
+            header.msg_iov = POINTER(_IOVec)(iovecs[i])
+            header.msg_iovlen = 1
+
+    def set_lengths(self, lengths: List[int]) -> None:
+        pack_into, iovec_bytes = _IOV_LEN_STRUCT.pack_into, self.iovec_bytes
+        for offset, length in zip(range(_IOV_LEN_OFFSET, len(iovec_bytes), sizeof(_IOVec)), lengths):
+            pack_into(iovec_bytes, offset, length)
+
+    def get_lengths(self, count: int) -> List[int]:
+        return [length for length, in _MMSG_LEN_STRUCT.iter_unpack(memoryview(self.header_bytes)[:count * sizeof(_MMsgHdr)])]
+
+    def close(self) -> None:
+        # the headers refer to the buffer, so they must not outlive it
+        self.headers = None
+        for slot in self.slots:
+            slot.release()
+        self.buffer.release()
+
+
+class UDPSocket:
+
+    # By default, the datagrams have a fixed size (msg_size), i.e. the messages are
+    # padded by zeros. If padded is False, the datagrams only carry the header and the
+    # payload, and msg_size is their max. size. The receiver takes the payload length
+    # from the header, so it accepts datagrams of either kind (up to msg_size bytes),
+    # regardless of its own mode. If the MTU is specified, datagrams which would be
+    # fragmented by the IP layer are rejected (for padded datagrams, this is checked
+    # right away, as all of them have msg_size bytes).
+    #
+    # The outgoing datagrams are assembled in a send buffer, and the incoming datagrams
+    # are received into a receive buffer; both of them are taken from the buffer pool
+    # when the socket is created, so the payload of a received frame is only valid until
+    # the next receive operation. The padding of the send buffer is only rewritten where
+    # a longer previous message has left non-zero bytes. As the buffers are not guarded
+    # by any lock, instances are not meant to be shared by several threads.
+    #
+    # recv_frames and send_encoded_msgs (plus the variants for particular message types)
+    # receive and send batches of datagrams; on Linux, a whole batch takes a single
+    # recvmmsg/sendmmsg call, elsewhere (or if the kernel does not support them), they
+    # fall back to one call per datagram (so recv_frames returns a single datagram then,
+    # like recv_frame). The batches use their own slots (allocated on
+    # the first batched call), so the frames received by recv_frames are valid until the
+    # next recv_frames call, independently of recv_frame. Malformed datagrams do not
+    # break a batch; recv_frames skips and counts them (see get_invalid_datagram_count).
+
+    def __init__(self, socket: socket, msg_size: int, padded: bool = True, mtu: Optional[int] = None) -> None:
+        if mtu is not None:
+            if mtu < _MIN_IPV4_MTU:
+                raise ValueError(f"MTU must be at least {_MIN_IPV4_MTU} bytes.")
+            if padded and msg_size > mtu - _IPV4_UDP_OVERHEAD:
+                raise ValueError(f"Datagram size {msg_size} bytes exceeds the max. size of {mtu - _IPV4_UDP_OVERHEAD} bytes for the MTU of {mtu} bytes.")
+        self._socket = socket
+        self._msg_size = msg_size
+        self._padded = padded
+        self._mtu = mtu
+        self._max_datagram_size = msg_size if mtu is None else min(msg_size, mtu - _IPV4_UDP_OVERHEAD)
+        self._padding = memoryview(bytes(msg_size))
+        self._send_buffer = _BUFFER_POOL.acquire(msg_size)
+        self._send_view = self._send_buffer.view[:msg_size]
+        # a reused buffer can contain anything, so the whole padding is zeroed first
+        self._send_dirty_end = msg_size
+        self._recv_buffer = _BUFFER_POOL.acquire(msg_size)
+        self._mmsg_functions = _MMSG_FUNCTIONS
+        self._recv_batch: Optional[_DatagramBatch] = None
+        self._send_batch: Optional[_DatagramBatch] = None
+        self._invalid_datagram_count = 0
+        self._endpoints: Dict[tuple[int, bytes], Endpoint] = {}
+        self._sockaddrs: Dict[tuple[str, int], bytes] = {}
+
+    def send_text_msg(self, dst: Endpoint, msg: str) -> None:
+        payload = bytes(dumps(msg), _ENCODING)
+        self._send_msg(dst, MessageType.TEXT, payload)
+
+    def send_json_msg(self, dst: Endpoint, msg: Dict[str, Any]) -> None:
+        payload = bytes(dumps(msg), _ENCODING)
+        self._send_msg(dst, MessageType.JSON, payload)
+
+    def send_binary_msg(self, dst: Endpoint, msg: Any, codec_name: Optional[str] = None) -> None:
+        payload = _encode_binary_payload(msg, codec_name)
+        self._send_msg(dst, MessageType.BINARY, payload)
+
+    def send_encoded_msg(self, dst: Endpoint, msg_type: MessageType, payload: bytes) -> None:
+        # sends a payload encoded in advance (e.g. by encode_msg)
+        self._send_msg(dst, msg_type, payload)
+
+    def send_text_msgs(self, msgs: List[tuple[Endpoint, str]], max_batch_size: int = _DEFAULT_UDP_BATCH_SIZE) -> None:
+        self.send_encoded_msgs([(dst, MessageType.TEXT, bytes(dumps(msg), _ENCODING)) for dst, msg in msgs], max_batch_size)
+
+    def send_json_msgs(self, msgs: List[tuple[Endpoint, Dict[str, Any]]], max_batch_size: int = _DEFAULT_UDP_BATCH_SIZE) -> None:
+        self.send_encoded_msgs([(dst, MessageType.JSON, bytes(dumps(msg), _ENCODING)) for dst, msg in msgs], max_batch_size)
+
+    def send_encoded_msgs(self, msgs: List[tuple[Endpoint, MessageType, bytes]], max_batch_size: int = _DEFAULT_UDP_BATCH_SIZE) -> None:
+        # up to max_batch_size datagrams are sent by a single sendmmsg call; the
+        # destination addresses must be IPv4 addresses (not host names)
+        batch = self._send_batch = self._ensure_batch(self._send_batch, max_batch_size)
+        for start in range(0, len(msgs), max_batch_size):
+            chunk = msgs[start:start + max_batch_size]
+            lengths = [self._fill_send_slot(batch, index, msg_type, payload) for index, (_, msg_type, payload) in enumerate(chunk)]
+            if self._mmsg_functions and self._send_mmsg(batch, chunk, lengths):
+                continue
+            for index, ((dst, _, _), length) in enumerate(zip(chunk, lengths)):
+                self._socket.sendto(batch.slots[index][:length], (dst.address, dst.port))
+
+    def set_timeout(self, timeout_sec: Optional[float]) -> None:
+        # applies to the subsequent receive operations (None = block until a datagram arrives)
+        self._socket.settimeout(timeout_sec)
+
+    def apply_socket_tuning(self, tuning: Optional[SocketTuning]) -> Dict[str, Optional[int]]:
+        # only the socket-level options apply to UDP; the effective values are returned
+        _apply_socket_tuning(self._socket, tuning, _UDP_TUNING_FIELDS)
+        return _get_socket_tuning(self._socket, _UDP_TUNING_FIELDS)
+
+    def is_padded(self) -> bool:
+        return self._padded
+
+    def get_invalid_datagram_count(self) -> int:
+        # number of malformed datagrams skipped by recv_frames so far
+        return self._invalid_datagram_count
+
+    def is_batched_io_supported(self) -> bool:
+        # True if each batch takes a single recvmmsg/sendmmsg call
+        return self._mmsg_functions is not None
+
+    def _check_datagram_size(self, payload_end: int) -> None:
+        if payload_end > self._max_datagram_size:
+            if payload_end > self._msg_size:
+                raise ValueError(f"Message size {payload_end} bytes exceeds the datagram size of {self._msg_size} bytes.")
+            raise ValueError(f"Datagram size {payload_end} bytes exceeds the max. size of {self._max_datagram_size} bytes for the MTU of {self._mtu} bytes.")
+
+    def _send_msg(self, dst: Endpoint, msg_type: MessageType, payload: bytes) -> None:
+        payload_end = _HEADER_SIZE + len(payload)
+        if payload_end > self._max_datagram_size:
+            self._check_datagram_size(payload_end)
+        view = self._send_view
+        _HEADER_STRUCT.pack_into(view, 0, len(payload), msg_type)
+        view[_HEADER_SIZE:payload_end] = payload
+        if not self._padded:
+            self._socket.sendto(view[:payload_end], (dst.address, dst.port))
+            return
+        if self._send_dirty_end > payload_end:
+            view[payload_end:self._send_dirty_end] = self._padding[payload_end:self._send_dirty_end]
+        self._send_dirty_end = payload_end
+        self._socket.sendto(view, (dst.address, dst.port))
+
+    def _fill_send_slot(self, batch: _DatagramBatch, index: int, msg_type: MessageType, payload: bytes) -> int:
+        # like _send_msg, but the datagram is assembled in a slot of the batch; the
+        # length of the datagram is returned
+        payload_end = _HEADER_SIZE + len(payload)
+        if payload_end > self._max_datagram_size:
+            self._check_datagram_size(payload_end)
+        view = batch.slots[index]
+        _HEADER_STRUCT.pack_into(view, 0, len(payload), msg_type)
+        view[_HEADER_SIZE:payload_end] = payload
+        if not self._padded:
+            return payload_end
+        dirty_end = batch.dirty_ends[index]
+        if dirty_end > payload_end:
+            view[payload_end:dirty_end] = self._padding[payload_end:dirty_end]
+        batch.dirty_ends[index] = payload_end
+        return self._msg_size
+
+    def _send_mmsg(self, batch: _DatagramBatch, chunk: List[tuple[Endpoint, MessageType, bytes]], lengths: List[int]) -> bool:
+        # False if the kernel does not support sendmmsg (nothing has been sent then); the
+        # lengths of padded datagrams never change, so they are only set for variable-size
+        # datagrams
+        batch.names[:len(chunk) * _SOCKADDR_IN_STRUCT.size] = b"".join([self._get_sockaddr(dst) for dst, _, _ in chunk])
+        if not self._padded:
+            batch.set_lengths(lengths)
+        sendmmsg = self._mmsg_functions[1]
+        sent_count = 0
+        while sent_count < len(chunk):
+            result = sendmmsg(self._socket.fileno(), byref(batch.headers[sent_count]), len(chunk) - sent_count, 0)
+            if result >= 0:
+                sent_count += result
+                continue
+            error = get_errno()
+            if error == ENOSYS and sent_count == 0:
+                self._mmsg_functions = None
+                return False
+            self._handle_mmsg_error(error, writable=True)
+        return True
+
+    def _recv_mmsg(self, batch: _DatagramBatch, max_count: int) -> Optional[int]:
+        # returns the number of received datagrams, or None if the kernel does not
+        # support recvmmsg; the address lengths written back by the kernel are always
+        # those of struct sockaddr_in, so they do not have to be reset
+        if self._socket.gettimeout() is not None:
+            self._wait_for_socket(writable=False)
+        recvmmsg = self._mmsg_functions[0]
+        while True:
+            result = recvmmsg(self._socket.fileno(), batch.headers, max_count, _MSG_WAITFORONE, None)
+            if result >= 0:
+                return result
+            error = get_errno()
+            if error == ENOSYS:
+                self._mmsg_functions = None
+                return None
+            self._handle_mmsg_error(error, writable=False)
+
+    def _handle_mmsg_error(self, error: int, writable: bool) -> None:
+        # an interrupted call is simply repeated (a pending KeyboardInterrupt is raised
+        # by the signal handler before that); a socket with timeout is non-blocking, so
+        # it has to be waited for
+        if error == EINTR:
+            return
+        if error in (EAGAIN, EWOULDBLOCK):
+            self._wait_for_socket(writable)
+            return
+        raise OSError(error, strerror(error))
+
+    def _wait_for_socket(self, writable: bool) -> None:
+        readable_sockets, writable_sockets, _ = select(
+            [] if writable else [self._socket],
+            [self._socket] if writable else [],
+            [],
+            self._socket.gettimeout(),
+        )
+        if not readable_sockets and not writable_sockets:
+            raise timeout("timed out")
+
+    def _get_sockaddr(self, dst: Endpoint) -> bytes:
+        key = (dst.address, dst.port)
+        sockaddr = self._sockaddrs.get(key)
+        if sockaddr is None:
+            if len(self._sockaddrs) >= _MAX_SOCKADDR_CACHE_SIZE:
+                self._sockaddrs.clear()
+            sockaddr = self._sockaddrs[key] = _SOCKADDR_IN_STRUCT.pack(AF_INET, htons(dst.port), inet_aton(dst.address))
+        return sockaddr
+
+    def _get_endpoint(self, port: int, address: bytes) -> Endpoint:
+        # the port and the address come straight from a struct sockaddr_in, i.e. they are
+        # in network byte order
+        key = (port, address)
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            if len(self._endpoints) >= _MAX_SOCKADDR_CACHE_SIZE:
+                self._endpoints.clear()
+            endpoint = self._endpoints[key] = Endpoint(address=inet_ntoa(address), port=ntohs(port))
+        return endpoint
+
+    def _ensure_batch(self, batch: Optional[_DatagramBatch], max_count: int) -> _DatagramBatch:
+        if batch and batch.max_count >= max_count:
+            return batch
+        if batch:
+            batch.close()
+        return _DatagramBatch(max_count, self._msg_size)
+
+    def _parse_datagram(self, view: memoryview, byte_count: int) -> Frame:
+        # the length of the datagram only has to cover the header and the payload, so
+        # padded as well as variable-size datagrams are accepted (a datagram longer than
+        # msg_size has been truncated, which is detected as long as its payload does not fit)
+        if byte_count < _HEADER_SIZE:
+            raise ValueError(f"Datagram of {byte_count} bytes is too short to carry a message.")
+        msg_length, msg_type = _HEADER_STRUCT.unpack_from(view)
+        if _HEADER_SIZE + msg_length > byte_count:
+            raise ValueError(f"Datagram of {byte_count} bytes is too short for message of {msg_length} bytes.")
+        return Frame(msg_type, view[_HEADER_SIZE:_HEADER_SIZE + msg_length])
+
+    def recv_text_msg(self) -> tuple[Endpoint, str]:
+        endpoint, frame = self.recv_frame()
+        if frame.msg_type != MessageType.TEXT:
+            raise ValueError(f"Unexpected message type: {frame.msg_type}.")
+        return endpoint, str(frame.payload, _ENCODING)
+
+    def recv_json_msg(self) -> tuple[Endpoint, Dict[str, Any]]:
+        endpoint, frame = self.recv_frame()
+        if frame.msg_type != MessageType.JSON:
+            raise ValueError(f"Unexpected message type: {frame.msg_type}.")
+        return endpoint, loads(str(frame.payload, _ENCODING))
+
+    def recv_frame(self) -> tuple[Endpoint, Frame]:
+        # any message type is accepted; it can be decoded by decode_frame
+        view = self._recv_buffer.view
+        byte_count, (address, port) = self._socket.recvfrom_into(view, self._msg_size)
+        return Endpoint(address=address, port=port), self._parse_datagram(view, byte_count)
+
+    def recv_frames(self, max_count: int = _DEFAULT_UDP_BATCH_SIZE) -> List[tuple[Endpoint, Frame]]:
+        # waits for the first datagram (subject to the timeout), and then returns up to
+        # max_count datagrams already queued at that moment, so it never waits for a full
+        # batch; without recvmmsg, just a single datagram is returned, as taking more of
+        # them would not save any system call; malformed datagrams are skipped, so the
+        # returned list can even be empty
+        batch = self._recv_batch = self._ensure_batch(self._recv_batch, max_count)
+        if self._mmsg_functions:
+            count = self._recv_mmsg(batch, max_count)
+            if count is not None:
+                addresses = _SOCKADDR_IN_STRUCT.iter_unpack(memoryview(batch.names)[:count * _SOCKADDR_IN_STRUCT.size])
+                frames = []
+                for (_, port, address), slot, byte_count in zip(addresses, batch.slots, batch.get_lengths(count)):
+                    frame = self._parse_valid_datagram(slot, byte_count)
+                    if frame:
+                        frames.append((self._get_endpoint(port, address), frame))
+                return frames
+        slot = batch.slots[0]
+        byte_count, (address, port) = self._socket.recvfrom_into(slot, self._msg_size)
+        frame = self._parse_valid_datagram(slot, byte_count)
+        return [(Endpoint(address=address, port=port), frame)] if frame else []
+
+    def _parse_valid_datagram(self, view: memoryview, byte_count: int) -> Optional[Frame]:
+        try:
+            return self._parse_datagram(view, byte_count)
+        except ValueError:
+            self._invalid_datagram_count += 1
+            return None
+
+    def recv_binary_msg(self) -> tuple[Endpoint, Any]:
+        endpoint, frame = self.recv_frame()
+        if frame.msg_type != MessageType.BINARY:
+            raise ValueError(f"Unexpected message type: {frame.msg_type}.")
+        return endpoint, _decode_binary_payload(frame.payload)
+
+    def close(self) -> None:
+        self._socket.close()
+        self._send_view.release()
+        self._send_buffer.release()
+        self._recv_buffer.release()
+        for batch in (self._recv_batch, self._send_batch):
+            if batch:
+                batch.close()
+
+
+def is_reuse_port_supported() -> bool:
+    if system() == "Windows":
+        return False
+    import socket
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def is_tcp_info_supported() -> bool:
+    # TCP_INFO as well as the SIOCINQ/SIOCOUTQ ioctls are Linux-specific
+    return system() == "Linux"
+
+
+def _get_queue_size(socket: socket, request: int) -> Optional[int]:
+    if not is_tcp_info_supported():
+        return None
+    from fcntl import ioctl
+    return unpack("i", ioctl(socket.fileno(), request, bytes(4)))[0]
+
+
+def _get_tcp_info(socket: socket) -> Optional[Dict[str, int]]:
+    if not is_tcp_info_supported():
+        return None
+    from socket import TCP_INFO
+    data = socket.getsockopt(IPPROTO_TCP, TCP_INFO, _TCP_INFO_STRUCT.size)
+    values = _TCP_INFO_STRUCT.unpack(data.ljust(_TCP_INFO_STRUCT.size, b"\0"))
+    return {
+        name: value for (name, _), value, field_end in zip(_TCP_INFO_FIELDS, values, _TCP_INFO_FIELD_ENDS) if field_end <= len(data)
+    }
+
+
+def _is_readable(socket: socket) -> bool:
+    # poll is not limited by FD_SETSIZE like select, but it is not available on Windows
+    if system() == "Windows":
+        readable, _, _ = select([socket], [], [], 0)
+        return bool(readable)
+    from select import poll, POLLIN
+    poller = poll()
+    poller.register(socket, POLLIN)
+    return bool(poller.poll(0))
+
+
+def is_sendmsg_supported() -> bool:
+    return hasattr(socket, "sendmsg")
+
+
+def open_tcp_listener(address: str,
+                      port: int,
+                      reuse_address: bool = False,
+                      reuse_port: bool = False,
+                      backlog: int = 5,
+                      max_protocol_version: ProtocolVersion = ProtocolVersion.V2,
+                      compression: Optional[str] = None,
+                      compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD,
+                      tuning: Optional[SocketTuning] = None,
+                      max_frame_size: int = _DEFAULT_MAX_FRAME_SIZE) -> TCPListener:
+    server_socket = socket(AF_INET, SOCK_STREAM)
+    if reuse_address:
+        server_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1 if reuse_address else 0)
+    if reuse_port and is_reuse_port_supported():
+        from socket import SO_REUSEPORT
+        server_socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1 if reuse_port else 0)
+    _apply_socket_tuning(server_socket, tuning, _LISTENER_TUNING_FIELDS)
+    server_socket.bind((address, port))
+    server_socket.listen(backlog)
+    return TCPListener(server_socket, max_protocol_version, compression, compression_threshold, tuning, max_frame_size)
+
+
+def open_tcp_connection(address: str,
+                        port: int,
+                        timeout_sec: Optional[float] = None,
+                        protocol_version: ProtocolVersion = ProtocolVersion.V1,
+                        compression: Optional[str] = None,
+                        compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD,
+                        correlation_ids: bool = False,
+                        tuning: Optional[SocketTuning] = None) -> TCPSocket:
+    # the handshake is only performed if the protocol version 2, compression or
+    # correlation IDs are desired, otherwise the connection is fully compatible with
+    # legacy servers
+    connection = TCPSocket(
+        _create_connection(address, port, timeout_sec, tuning),
+        compression=compression,
+        compression_threshold=compression_threshold,
+    )
+    if protocol_version == ProtocolVersion.V1 and not compression and not correlation_ids:
+        return connection
+    try:
+        connection.negotiate(protocol_version, timeout_sec)
+        return connection
+    except (EOFError, ConnectionResetError):
+        # a server unaware of the handshake closes the connection when it receives
+        # the handshake, so a new connection using the protocol version 1 is opened
+        connection.close()
+        return TCPSocket(_create_connection(address, port, timeout_sec, tuning))
+
+
+def _create_connection(address: str, port: int, timeout_sec: Optional[float], tuning: Optional[SocketTuning]) -> socket:
+    if tuning is None:
+        return create_connection((address, port), timeout=timeout_sec)
+    # the buffer sizes (window scaling) and TCP Fast Open must be set before connect;
+    # like create_connection, all addresses of the host are tried until one of them
+    # accepts the connection
+    last_error = None
+    for family, socket_type, protocol, _, socket_address in getaddrinfo(address, port, type=SOCK_STREAM):
+        connection = socket(family, socket_type, protocol)
+        try:
+            _apply_socket_tuning(connection, tuning, _CLIENT_TUNING_FIELDS, client=True)
+            connection.settimeout(timeout_sec)
+            connection.connect(socket_address)
+            return connection
+        except OSError as e:
+            connection.close()
+            last_error = e
+        except BaseException:
+            connection.close()
+            raise
+    raise last_error
+
+
+async def open_async_tcp_connection(address: str,
+                                    port: int,
+                                    timeout_sec: Optional[float] = None,
+                                    protocol_version: ProtocolVersion = ProtocolVersion.V1,
+                                    compression: Optional[str] = None,
+                                    compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD,
+                                    correlation_ids: bool = False,
+                                    tuning: Optional[SocketTuning] = None) -> AsyncTCPSocket:
+    # asyncio counterpart of open_tcp_connection, incl. the fallback for legacy servers
+    connection = await wait_for(_create_async_connection(address, port, tuning, compression, compression_threshold), timeout_sec)
+    if protocol_version == ProtocolVersion.V1 and not compression and not correlation_ids:
+        return connection
+    try:
+        await wait_for(connection.negotiate(protocol_version), timeout_sec)
+        return connection
+    except (EOFError, ConnectionResetError):
+        await connection.close()
+        return await wait_for(_create_async_connection(address, port, tuning), timeout_sec)
+
+
+async def _create_async_connection(address: str,
+                                   port: int,
+                                   tuning: Optional[SocketTuning],
+                                   compression: Optional[str] = None,
+                                   compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD) -> AsyncTCPSocket:
+    # all addresses of the host are tried until one of them accepts the connection
+    loop = get_running_loop()
+    last_error = None
+    for family, socket_type, protocol, _, socket_address in await loop.getaddrinfo(address, port, type=SOCK_STREAM):
+        connection = socket(family, socket_type, protocol)
+        try:
+            _apply_socket_tuning(connection, tuning, _CLIENT_TUNING_FIELDS, client=True)
+            connection.setblocking(False)
+            await loop.sock_connect(connection, socket_address)
+            reader, writer = await open_connection(sock=connection)
+            break
+        except OSError as e:
+            connection.close()
+            last_error = e
+        except BaseException:
+            connection.close()
+            raise
+    else:
+        raise last_error
+    return AsyncTCPSocket(reader, writer, compression=compression, compression_threshold=compression_threshold)
+
+
+def open_udp_listener(address: str, port: int, msg_size: int = 4096, padded: bool = True, mtu: Optional[int] = None) -> UDPSocket:
+    listener = socket(AF_INET, SOCK_DGRAM)
+    try:
+        listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        listener.bind((address, port))
+        return UDPSocket(listener, msg_size, padded, mtu)
+    except BaseException:
+        listener.close()
+        raise
+
+
+def open_udp_client(msg_size: int = 4096, padded: bool = True, mtu: Optional[int] = None) -> UDPSocket:
+    client = socket(AF_INET, SOCK_DGRAM)
+    try:
+        return UDPSocket(client, msg_size, padded, mtu)
+    except BaseException:
+        client.close()
+        raise
+
+
+def open_multicast_publisher(msg_size: int, padded: bool = True, mtu: Optional[int] = None) -> UDPSocket:
+    publisher = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP)
+    try:
+        publisher.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, 2)
+        return UDPSocket(publisher, msg_size, padded, mtu)
+    except BaseException:
+        publisher.close()
+        raise
+
+
+def open_multicast_subscriber(address: str,
+                              port: int,
+                              msg_size: int = 4096,
+                              padded: bool = True,
+                              mtu: Optional[int] = None) -> UDPSocket:
+    subscriber = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP)
+    subscriber.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    subscriber.bind(("", port))
+
+    membership_request = pack('4sL', inet_aton(address), INADDR_ANY)
+    subscriber.setsockopt(IPPROTO_IP, IP_ADD_MEMBERSHIP, membership_request)
+
+    return UDPSocket(subscriber, msg_size, padded, mtu)
+
+
+# keepalive probes detect the connections silently dropped (e.g. by a NAT gateway or a
+# firewall) while they are idle in a pool; the tuning profile of the pool can override
+# any of these values
+_POOL_KEEPALIVE_TUNING = {
+    "keepalive": 1,
+    "keepidle": 60,
+    "keepintvl": 10,
+    "keepcnt": 5,
+}
+
+
+def _with_pool_keepalive(tuning: Optional[SocketTuning]) -> SocketTuning:
+    tuning = tuning or SocketTuning()
+    defaults = {name: value for name, value in _POOL_KEEPALIVE_TUNING.items() if getattr(tuning, name) is None}
+    return replace(tuning, **defaults)
+
+
+class _ConnectionPoolState:
+
+    # Bookkeeping shared by the blocking and the asyncio-based connection pools; the
+    # synchronization is up to the subclasses. The size of the pool includes the idle
+    # connections, the connections in use and the connections being opened. The idle
+    # connections are reused in LIFO order, so when the load drops, the surplus ones
+    # stay idle long enough to be evicted by the idle timeout. The eviction never
+    # shrinks the pool below its min. size.
+
+    def __init__(self,
+                 address: str,
+                 port: int,
+                 min_size: int,
+                 max_size: int,
+                 idle_timeout_sec: float,
+                 acquire_timeout_sec: Optional[float]) -> None:
+        if max_size < 1 or not 0 <= min_size <= max_size:
+            raise ValueError(f"Invalid pool size (min = {min_size}, max = {max_size}).")
+        self._address = address
+        self._port = port
+        self._resolved_address = None
+        self._min_size = min_size
+        self._max_size = max_size
+        self._idle_timeout_sec = idle_timeout_sec
+        self._acquire_timeout_sec = acquire_timeout_sec
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._counters = {
+            "created": 0,
+            "reused": 0,
+            "evicted": 0,
+            "discarded": 0,
+            "acquire_timeouts": 0,
+            "high_water_mark": 0,
+        }
+
+    def _take_expired(self) -> List[Any]:
+        expired_connections = []
+        now = monotonic()
+        while self._idle and self._size > self._min_size and now - self._idle[0][0] >= self._idle_timeout_sec:
+            expired_connections.append(self._idle.popleft()[1])
+            self._size -= 1
+            self._counters["evicted"] += 1
+        return expired_connections
+
+    def _take_all_idle(self) -> List[Any]:
+        idle_connections = [connection for _, connection in self._idle]
+        self._idle.clear()
+        self._size -= len(idle_connections)
+        return idle_connections
+
+    def _can_take(self) -> bool:
+        return self._closed or bool(self._idle) or self._size < self._max_size
+
+    def _take(self) -> Optional[Any]:
+        # None = there is no idle connection, but a slot has been reserved for a new one
+        if self._closed:
+            raise ConnectionError("The connection pool has been closed.")
+        if self._idle:
+            return self._idle.pop()[1]
+        self._size += 1
+        self._counters["high_water_mark"] = max(self._counters["high_water_mark"], self._size)
+        return None
+
+    def _get_counters(self) -> Dict[str, int]:
+        return dict(self._counters, size=self._size, idle=len(self._idle))
+
+    def _create_timeout_error(self) -> TimeoutError:
+        self._counters["acquire_timeouts"] += 1
+        return TimeoutError(f"Timeout ({self._acquire_timeout_sec} sec) expired when attempting to acquire a connection from the pool.")
+
+
+class TCPConnectionPool(_ConnectionPoolState):
+
+    # Client connections to a single server, shared by any number of threads. Reusing
+    # a connection saves the DNS lookup, the TCP handshake (and the slow start) and the
+    # protocol handshake per request; the address is resolved again only if an attempt
+    # to connect fails. Before an idle connection is handed out, a cheap liveness check
+    # (a poll without any timeout) weeds out the connections closed by the server in
+    # the meantime. The connections are only returned to the pool if the request has
+    # been completed, otherwise a late response could be read by the next user.
+
+    def __init__(self,
+                 address: str,
+                 port: int,
+                 min_size: int = 0,
+                 max_size: int = 8,
+                 idle_timeout_sec: float = 60,
+                 acquire_timeout_sec: Optional[float] = None,
+                 connect_timeout_sec: Optional[float] = None,
+                 protocol_version: ProtocolVersion = ProtocolVersion.V1,
+                 compression: Optional[str] = None,
+                 compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD,
+                 correlation_ids: bool = False,
+                 tuning: Optional[SocketTuning] = None) -> None:
+        super().__init__(address, port, min_size, max_size, idle_timeout_sec, acquire_timeout_sec)
+        self._connection_args = {
+            "timeout_sec": connect_timeout_sec,
+            "protocol_version": protocol_version,
+            "compression": compression,
+            "compression_threshold": compression_threshold,
+            "correlation_ids": correlation_ids,
+            "tuning": _with_pool_keepalive(tuning),
+        }
+        self._lock = Lock()
+        self._available = Condition(self._lock)
+
+    def warm_up(self) -> None:
+        # opens the connections missing to the min. size
+        connections = []
+        try:
+            for _ in range(self._min_size):
+                connections.append(self.acquire())
+        finally:
+            for connection in connections:
+                self.release(connection)
+
+    def acquire(self) -> TCPSocket:
+        deadline = None if self._acquire_timeout_sec is None else monotonic() + self._acquire_timeout_sec
+        while True:
+            with self._lock:
+                expired_connections = self._take_expired()
+                self._available.notify(len(expired_connections))
+            for expired_connection in expired_connections:
+                expired_connection.close()
+            with self._lock:
+                remaining_sec = None if deadline is None else max(0, deadline - monotonic())
+                if not self._available.wait_for(self._can_take, remaining_sec):
+                    raise self._create_timeout_error()
+                connection = self._take()
+            if connection is None:
+                return self._open_connection()
+            if connection.is_alive():
+                with self._lock:
+                    self._counters["reused"] += 1
+                return connection
+            self._discard(connection)
+
+    def release(self, connection: TCPSocket, reusable: bool = True) -> None:
+        with self._lock:
+            if reusable and not self._closed:
+                self._idle.append((monotonic(), connection))
+                self._available.notify()
+                return
+        self._discard(connection)
+
+    @contextmanager
+    def connection(self) -> Iterator[TCPSocket]:
+        # the connection is closed instead of being returned to the pool if the body
+        # raises an exception, as its state is unknown then
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, reusable=False)
+            raise
+        self.release(connection)
+
+    def get_counters(self) -> Dict[str, int]:
+        with self._lock:
+            return self._get_counters()
+
+    def close(self) -> None:
+        # the connections in use are closed when they are released
+        with self._lock:
+            self._closed = True
+            idle_connections = self._take_all_idle()
+            self._available.notify_all()
+        for connection in idle_connections:
+            connection.close()
+
+    def _open_connection(self) -> TCPSocket:
+        try:
+            if self._resolved_address is None:
+                self._resolved_address = gethostbyname(self._address)
+            connection = open_tcp_connection(self._resolved_address, self._port, **self._connection_args)
+        except BaseException:
+            self._resolved_address = None
+            with self._lock:
+                self._size -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self._counters["created"] += 1
+        return connection
+
+    def _discard(self, connection: TCPSocket) -> None:
+        connection.close()
+        with self._lock:
+            self._size -= 1
+            self._counters["discarded"] += 1
+            self._available.notify()
+
+
+class AsyncTCPConnectionPool(_ConnectionPoolState):
+
+    # asyncio counterpart of TCPConnectionPool, shared by any number of tasks running
+    # in the same event loop
+
+    def __init__(self,
+                 address: str,
+                 port: int,
+                 min_size: int = 0,
+                 max_size: int = 8,
+                 idle_timeout_sec: float = 60,
+                 acquire_timeout_sec: Optional[float] = None,
+                 connect_timeout_sec: Optional[float] = None,
+                 protocol_version: ProtocolVersion = ProtocolVersion.V1,
+                 compression: Optional[str] = None,
+                 compression_threshold: int = _DEFAULT_COMPRESSION_THRESHOLD,
+                 correlation_ids: bool = False,
+                 tuning: Optional[SocketTuning] = None) -> None:
+        super().__init__(address, port, min_size, max_size, idle_timeout_sec, acquire_timeout_sec)
+        self._connection_args = {
+            "timeout_sec": connect_timeout_sec,
+            "protocol_version": protocol_version,
+            "compression": compression,
+            "compression_threshold": compression_threshold,
+            "correlation_ids": correlation_ids,
+            "tuning": _with_pool_keepalive(tuning),
+        }
+        self._available = AsyncCondition()
+
+    async def warm_up(self) -> None:
+        connections = []
+        try:
+            for _ in range(self._min_size):
+                connections.append(await self.acquire())
+        finally:
+            for connection in connections:
+                await self.release(connection)
+
+    async def acquire(self) -> AsyncTCPSocket:
+        deadline = None if self._acquire_timeout_sec is None else monotonic() + self._acquire_timeout_sec
+        while True:
+            async with self._available:
+                expired_connections = self._take_expired()
+                self._available.notify(len(expired_connections))
+            for expired_connection in expired_connections:
+                await expired_connection.close()
+            async with self._available:
+                remaining_sec = None if deadline is None else max(0, deadline - monotonic())
+                try:
+                    await wait_for(self._available.wait_for(self._can_take), remaining_sec)
+                except (TimeoutError, AsyncTimeoutError) as e:
+                    raise self._create_timeout_error() from e
+                connection = self._take()
+            if connection is None:
+                return await self._open_connection()
+            if connection.is_alive():
+                self._counters["reused"] += 1
+                return connection
+            await self._discard(connection)
+
+    async def release(self, connection: AsyncTCPSocket, reusable: bool = True) -> None:
+        async with self._available:
+            if reusable and not self._closed:
+                self._idle.append((monotonic(), connection))
+                self._available.notify()
+                return
+        await self._discard(connection)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncTCPSocket]:
+        connection = await self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            await self.release(connection, reusable=False)
+            raise
+        await self.release(connection)
+
+    def get_counters(self) -> Dict[str, int]:
+        return self._get_counters()
+
+    async def close(self) -> None:
+        async with self._available:
+            self._closed = True
+            idle_connections = self._take_all_idle()
+            self._available.notify_all()
+        for connection in idle_connections:
+            await connection.close()
+
+    async def _open_connection(self) -> AsyncTCPSocket:
+        try:
+            if self._resolved_address is None:
+                address_info = await get_running_loop().getaddrinfo(self._address, self._port, family=AF_INET, type=SOCK_STREAM)
+                self._resolved_address = address_info[0][4][0]
+            connection = await open_async_tcp_connection(self._resolved_address, self._port, **self._connection_args)
+        except BaseException:
+            self._resolved_address = None
+            async with self._available:
+                self._size -= 1
+                self._available.notify()
+            raise
+        self._counters["created"] += 1
+        return connection
+
+    async def _discard(self, connection: AsyncTCPSocket) -> None:
+        await connection.close()
+        async with self._available:
+            self._size -= 1
+            self._counters["discarded"] += 1
+            self._available.notify()
+
+
+class BackgroundLog:
+
+    # Log lines are formatted and written to the standard output by a background
+    # thread, so the threads handling the messages never block on the terminal.
+    # Per-message events are sampled (only every n-th event is logged, 0 = none),
+    # and their number can be reported by periodic summary lines. Colors are only
+    # applied if the standard output is a terminal. If the terminal cannot keep up,
+    # at most max_queued_lines lines wait for the background thread, and further
+    # lines are dropped and counted (so the memory use stays bounded).
+
+    _STOP = object()
+
+    def __init__(self,
+                 sampling_rate: int = 1,
+                 summary_interval_sec: Optional[float] = None,
+                 max_queued_lines: int = _DEFAULT_LOG_MAX_QUEUED_LINES) -> None:
+        if sampling_rate < 0:
+            raise ValueError("Log sampling must not be a negative number.")
+        self._sampling_rate = sampling_rate
+        self._summary_interval_sec = summary_interval_sec
+        self._max_queued_lines = max_queued_lines
+        self._use_colors = stdout.isatty()
+        self._queue = SimpleQueue()
+        self._event_seq = count(1)
+        self._event_count = 0
+        self._dropped_count = 0
+        self._thread = Thread(target=self._run, name="Log", daemon=True)
+        self._thread.start()
+
+    def info(self, text: str, color: Optional[str] = None) -> None:
+        self._put((color, text, ()))
+
+    def event(self, color: Optional[str], fmt: str, *args: Any) -> None:
+        # the line is only formatted (by the background thread) if it is sampled
+        seq = next(self._event_seq)
+        self._event_count = seq
+        if self._sampling_rate and seq % self._sampling_rate == 0:
+            self._put((color, fmt, args))
+
+    def _put(self, item: tuple) -> None:
+        # qsize is approximate, so the bound can be exceeded slightly by concurrent puts
+        if self._queue.qsize() >= self._max_queued_lines:
+            self._dropped_count += 1
+            return
+        self._queue.put(item)
+
+    def close(self) -> None:
+        self._queue.put(self._STOP)
+        self._thread.join(timeout=5)
+
+    def _format(self, color: Optional[str], fmt: str, args: tuple) -> str:
+        text = fmt.format(*args) if args else fmt
+        if color and self._use_colors:
+            return f"{color}{text}{Style.RESET_ALL}"
+        return text
+
+    def _format_summary(self, event_count: int, interval_sec: float) -> str:
+        return f"Log summary (PID = {getpid()}): {event_count} message event(s) in the last {interval_sec:.1f} sec, {self._event_count} in total, {self._dropped_count} log line(s) dropped"
+
+    def _run(self) -> None:
+        last_summary_time = monotonic()
+        last_summary_event_count = 0
+        stopped = False
+        while not stopped:
+            timeout_sec = None
+            if self._summary_interval_sec:
+                timeout_sec = max(0, last_summary_time + self._summary_interval_sec - monotonic())
+            lines = []
+            try:
+                item = self._queue.get(timeout=timeout_sec)
+                # everything already queued is written by a single write
+                while True:
+                    if item is self._STOP:
+                        stopped = True
+                        break
+                    lines.append(self._format(*item))
+                    item = self._queue.get_nowait()
+            except Empty:
+                ...
+            now = monotonic()
+            if self._summary_interval_sec and (stopped or now - last_summary_time >= self._summary_interval_sec):
+                event_count = self._event_count
+                lines.append(self._format_summary(event_count - last_summary_event_count, now - last_summary_time))
+                last_summary_time, last_summary_event_count = now, event_count
+            elif stopped and self._dropped_count:
+                lines.append(f"Log (PID = {getpid()}): {self._dropped_count} log line(s) dropped")
+            if lines:
+                stdout.write("\n".join(lines) + "\n")
+                stdout.flush()
+
+
+class LatencyHistogram:
+
+    # HDR-style histogram of latencies in microseconds. Values below 128 usec have
+    # their own buckets, larger values are counted in buckets whose width doubles
+    # with each power of two, so each power of two is split into 64 buckets and the
+    # relative error of the reported values stays below 1.6 % across the whole range.
+
+    _SUB_BUCKET_BITS = 7
+    _SUB_BUCKET_COUNT = 1 << _SUB_BUCKET_BITS
+    _HALF_SUB_BUCKET_COUNT = _SUB_BUCKET_COUNT >> 1
+
+    def __init__(self) -> None:
+        self._counts = [0] * self._SUB_BUCKET_COUNT
+        self._total_count = 0
+        self._sum = 0
+        self._min = None
+        self._max = 0
+
+    def record(self, value_usec: int) -> None:
+        value_usec = max(0, int(value_usec))
+        index = self._get_bucket_index(value_usec)
+        if index >= len(self._counts):
+            self._counts.extend([0] * (index + 1 - len(self._counts)))
+        self._counts[index] += 1
+        self._total_count += 1
+        self._sum += value_usec
+        self._min = value_usec if self._min is None else min(self._min, value_usec)
+        self._max = max(self._max, value_usec)
+
+    def record_sec(self, value_sec: float) -> None:
+        self.record(round(value_sec * 1_000_000))
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        if len(other._counts) > len(self._counts):
+            self._counts.extend([0] * (len(other._counts) - len(self._counts)))
+        for index, count in enumerate(other._counts):
+            self._counts[index] += count
+        self._total_count += other._total_count
+        self._sum += other._sum
+        if other._min is not None:
+            self._min = other._min if self._min is None else min(self._min, other._min)
+        self._max = max(self._max, other._max)
+
+    def get_count(self) -> int:
+        return self._total_count
+
+    def get_min(self) -> int:
+        return self._min or 0
+
+    def get_max(self) -> int:
+        return self._max
+
+    def get_mean(self) -> float:
+        return self._sum / self._total_count if self._total_count else 0.0
+
+    def get_percentile(self, percentile: float) -> int:
+        if not self._total_count:
+            return 0
+        target_count = max(1, ceil(percentile / 100 * self._total_count))
+        cumulative_count = 0
+        for index, count in enumerate(self._counts):
+            cumulative_count += count
+            if cumulative_count >= target_count:
+                return min(self._get_highest_equivalent_value(index), self._max)
+        return self._max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "unit": "usec",
+            "count": self._total_count,
+            "min": self.get_min(),
+            "max": self._max,
+            "mean": round(self.get_mean(), 1),
+            "p50": self.get_percentile(50),
+            "p90": self.get_percentile(90),
+            "p99": self.get_percentile(99),
+            "p99.9": self.get_percentile(99.9),
+            "buckets": [
+                [self._get_highest_equivalent_value(index), count] for index, count in enumerate(self._counts) if count
+            ],
+        }
+
+    def _get_bucket_index(self, value: int) -> int:
+        if value < self._SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - self._SUB_BUCKET_BITS
+        return self._SUB_BUCKET_COUNT + (shift - 1) * self._HALF_SUB_BUCKET_COUNT + (value >> shift) - self._HALF_SUB_BUCKET_COUNT
+
+    def _get_highest_equivalent_value(self, index: int) -> int:
+        if index < self._SUB_BUCKET_COUNT:
+            return index
+        shift, sub_bucket_index = divmod(index - self._SUB_BUCKET_COUNT, self._HALF_SUB_BUCKET_COUNT)
+        shift += 1
+        return ((sub_bucket_index + self._HALF_SUB_BUCKET_COUNT + 1) << shift) - 1
+
+
+def add_log_cmd_line_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--log-sampling",
+        dest="log_sampling",
+        default=1,
+        help="optional sampling of per-message log lines; only every n-th line is logged, 0 means\n"
+             "no per-message lines at all (default = 1, i.e. every line is logged)",
+        type=_parse_log_sampling_arg,
+    )
+    parser.add_argument(
+        "--log-summary-sec",
+        dest="log_summary_sec",
+        help="optional interval in seconds between two summary lines reporting the number of\n"
+             "per-message events (default = no summary lines)",
+        type=float,
+    )
+
+
+def add_socket_tuning_cmd_line_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--socket-tuning",
+        dest="socket_tuning",
+        help="optional socket tuning profile, either as comma-separated name=value pairs or as @path of\n"
+             "a JSON file; supported names: nodelay, sndbuf, rcvbuf, quickack, cork, notsent_lowat,\n"
+             "fastopen, busy_poll, keepalive, keepidle, keepintvl and keepcnt; keepidle and keepintvl\n"
+             "are in seconds, and like keepcnt, they only take effect with keepalive=1, e.g.\n"
+             "nodelay=1,sndbuf=262144 or keepalive=1,keepidle=30 (default = system defaults)",
+        type=_parse_socket_tuning_arg,
+    )
+
+
+def _parse_socket_tuning_arg(spec: str) -> SocketTuning:
+    try:
+        return parse_socket_tuning(spec)
+    except (OSError, ValueError) as e:
+        raise ArgumentTypeError(str(e)) from e
+
+
+def add_udp_datagram_cmd_line_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--variable-size",
+        dest="variable_size",
+        default=False,
+        action="store_true",
+        help="if specified, the datagrams sent carry just the header and the payload instead of being\n"
+             "padded to the fixed datagram size; datagrams of either kind are received (by default, they are\n"
+             "padded)",
+    )
+    parser.add_argument(
+        "--mtu",
+        dest="mtu",
+        help="optional MTU in bytes; datagrams which would be fragmented by the IP layer (i.e. bigger than\n"
+             "the MTU minus 28 bytes of the IPv4 and UDP headers) are rejected; only applicable with\n"
+             "--variable-size, as all padded datagrams have the fixed size (default = no check)",
+        type=_parse_mtu_arg,
+    )
+
+
+def _parse_log_sampling_arg(value: str) -> int:
+    sampling_rate = int(value)
+    if sampling_rate < 0:
+        raise ArgumentTypeError("Log sampling must not be a negative number.")
+    return sampling_rate
+
+
+def _parse_mtu_arg(value: str) -> int:
+    mtu = int(value)
+    if mtu < _MIN_IPV4_MTU:
+        raise ArgumentTypeError(f"MTU must be at least {_MIN_IPV4_MTU} bytes.")
+    return mtu
+
+
+def create_log(cmd_line_args: Namespace) -> BackgroundLog:
+    return BackgroundLog(cmd_line_args.log_sampling, cmd_line_args.log_summary_sec)
+
+
+class QueueTimeline:
+
+    # Samples the occupancy of the receive and send queues of a connection, plus the
+    # TCP_INFO fields related to them, at a fixed interval on a background thread. The
+    # sampling must be stopped before the connection is closed.
+
+    _TCP_INFO_FIELDS = ["rcv_wnd", "rcv_space", "snd_wnd", "notsent_bytes", "unacked", "snd_cwnd", "probes", "backoff", "rtt"]
+
+    def __init__(self, socket: TCPSocket, interval_sec: float) -> None:
+        self._socket = socket
+        self._interval_sec = interval_sec
+        self._samples: List[Dict[str, Any]] = []
+        self._stop_event = Event()
+        self._thread = Thread(target=self._run, name="QueueTimeline", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+
+    def get_samples(self) -> List[Dict[str, Any]]:
+        return self._samples
+
+    def write(self, path: str) -> None:
+        # JSON if the file name ends with .json, CSV otherwise
+        with open(path, "w", newline="") as output_file:
+            if path.endswith(".json"):
+                output_file.write(dumps(self._samples, indent=2))
+            elif self._samples:
+                writer = DictWriter(output_file, fieldnames=list(self._samples[0]))
+                writer.writeheader()
+                writer.writerows(self._samples)
+
+    def _run(self) -> None:
+        start_time = monotonic()
+        while True:
+            try:
+                self._samples.append(self._take_sample(monotonic() - start_time))
+            except OSError:
+                # the connection has been closed
+                return
+            if self._stop_event.wait(self._interval_sec):
+                return
+
+    def _take_sample(self, time_sec: float) -> Dict[str, Any]:
+        sample = {
+            "time_sec": round(time_sec, 3),
+            "recv_queue": self._socket.get_recv_queue_size(),
+            "send_queue": self._socket.get_send_queue_size(),
+        }
+        tcp_info = self._socket.get_tcp_info() or {}
+        for name in self._TCP_INFO_FIELDS:
+            sample[name] = tcp_info.get(name)
+        return sample
+
+
+def start_queue_timeline(socket: TCPSocket, cmd_line_args: Namespace) -> Optional[QueueTimeline]:
+    if not cmd_line_args.timeline_file:
+        return None
+    timeline = QueueTimeline(socket, cmd_line_args.timeline_interval_sec)
+    timeline.start()
+    return timeline
+
+
+def add_timeline_cmd_line_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--timeline-file",
+        dest="timeline_file",
+        help="optional file the timeline of the receive/send queue occupancy is written to (Linux only);\n"
+             "JSON if the file name ends with .json, CSV otherwise (default = no timeline)",
+        type=str,
+    )
+    parser.add_argument(
+        "--timeline-interval-sec",
+        dest="timeline_interval_sec",
+        default=0.1,
+        help="optional interval in seconds between two samples of the timeline (default = 0.1 sec)",
+        type=float,
+    )
+
+
+@dataclass(frozen=True)
+class TrafficRecord:
+    timestamp: float
+    peer: RemoteAddress
+    msg_type: int
+    payload: memoryview
+
+
+class TrafficRecorder:
+
+    # Appends the received frames (timestamp, peer, message type and payload) to an
+    # append-only log. Every index_interval-th record is also registered in the index
+    # file (path of the log + .idx), so readers can seek by time without scanning the
+    # whole log. All connections of a server can share a single recorder. Only IPv4
+    # peers can be recorded (the log stores their 4-byte address).
+
+    def __init__(self, path: str, transport: Transport, index_interval: int = _DEFAULT_TRAFFIC_INDEX_INTERVAL) -> None:
+        self._log_file = open(path, "wb")
+        self._index_file = open(path + _TRAFFIC_INDEX_SUFFIX, "wb")
+        self._log_file.write(_TRAFFIC_LOG_HEADER_STRUCT.pack(_TRAFFIC_LOG_MAGIC, transport))
+        self._offset = _TRAFFIC_LOG_HEADER_STRUCT.size
+        self._index_interval = index_interval
+        self._record_count = 0
+        self._last_flush_time = monotonic()
+        self._lock = Lock()
+
+    def record(self, peer_host: str, peer_port: int, msg_type: int, payload: Union[bytes, memoryview]) -> None:
+        try:
+            packed_host = inet_aton(peer_host)
+        except OSError as e:
+            raise ValueError(f"Peer {peer_host} cannot be recorded, only IPv4 peers are supported.") from e
+        with self._lock:
+            # the timestamp is taken under the lock, so the records are ordered by time
+            timestamp = time()
+            if self._record_count % self._index_interval == 0:
+                self._index_file.write(_TRAFFIC_INDEX_STRUCT.pack(timestamp, self._offset))
+            self._log_file.write(_TRAFFIC_RECORD_STRUCT.pack(timestamp, packed_host, peer_port, msg_type, len(payload)))
+            self._log_file.write(payload)
+            self._offset += _TRAFFIC_RECORD_STRUCT.size + len(payload)
+            self._record_count += 1
+            if monotonic() - self._last_flush_time >= _TRAFFIC_FLUSH_INTERVAL_SEC:
+                self._log_file.flush()
+                self._index_file.flush()
+                self._last_flush_time = monotonic()
+
+    def get_record_count(self) -> int:
+        return self._record_count
+
+    def close(self) -> None:
+        with self._lock:
+            self._log_file.close()
+            self._index_file.close()
+
+
+class TrafficLog:
+
+    # Read-only access to a log written by TrafficRecorder. The log is memory-mapped, and
+    # the payloads are handed out as memoryview slices of the mapping without any copy,
+    # so they are only valid until the log is closed (and all of them must be released
+    # by then). A truncated last record (e.g. if the recording process has crashed) is
+    # ignored; if the index is missing, seeking scans the log from its beginning.
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as log_file:
+            self._mmap = mmap(log_file.fileno(), 0, access=ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, transport = _TRAFFIC_LOG_HEADER_STRUCT.unpack_from(self._view)
+        if magic != _TRAFFIC_LOG_MAGIC:
+            self.close()
+            raise ValueError(f"File {path} is not a traffic log.")
+        self._transport = Transport(transport)
+        try:
+            with open(path + _TRAFFIC_INDEX_SUFFIX, "rb") as index_file:
+                index_data = index_file.read()
+        except FileNotFoundError:
+            index_data = b""
+        index_data = index_data[:len(index_data) - len(index_data) % _TRAFFIC_INDEX_STRUCT.size]
+        self._index = [(timestamp, offset) for timestamp, offset in _TRAFFIC_INDEX_STRUCT.iter_unpack(index_data) if offset < len(self._view)]
+        self._index_timestamps = [timestamp for timestamp, _ in self._index]
+
+    def get_transport(self) -> Transport:
+        return self._transport
+
+    def get_start_time(self) -> Optional[float]:
+        # None if the log does not contain any record
+        return next((record.timestamp for record in self.read()), None)
+
+    def get_end_time(self) -> Optional[float]:
+        end_time = None
+        for record in self.read(self._index_timestamps[-1] if self._index else None):
+            end_time = record.timestamp
+        return end_time
+
+    def read(self, start_time: Optional[float] = None, end_time: Optional[float] = None) -> Iterator[TrafficRecord]:
+        # records with start_time <= timestamp <= end_time (None = no limit)
+        view, log_size = self._view, len(self._view)
+        offset = self._seek(start_time)
+        while offset + _TRAFFIC_RECORD_STRUCT.size <= log_size:
+            timestamp, packed_host, port, msg_type, length = _TRAFFIC_RECORD_STRUCT.unpack_from(view, offset)
+            payload_start = offset + _TRAFFIC_RECORD_STRUCT.size
+            offset = payload_start + length
+            if offset > log_size or (end_time is not None and timestamp > end_time):
+                return
+            if start_time is not None and timestamp < start_time:
+                continue
+            peer = RemoteAddress(host=inet_ntoa(packed_host), port=port)
+            yield TrafficRecord(timestamp, peer, msg_type, view[payload_start:offset])
+
+    def close(self) -> None:
+        self._view.release()
+        self._mmap.close()
+
+    def _seek(self, start_time: Optional[float]) -> int:
+        # offset of the last indexed record not newer than start_time
+        if start_time is None or not self._index:
+            return _TRAFFIC_LOG_HEADER_STRUCT.size
+        index = bisect_right(self._index_timestamps, start_time) - 1
+        return self._index[max(index, 0)][1]
+
+
+def add_record_cmd_line_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--record-file",
+        dest="record_file",
+        help="optional file every received message is appended to (timestamp, peer, message type and\n"
+             "payload), so the traffic can later be replayed by traffic_replayer.py; an index is written\n"
+             "to the same path with the .idx suffix; only supported for IPv4 (default = no recording)",
+        type=str,
+    )
+
+
+def validate_record_cmd_line_args(parser: ArgumentParser, params: Namespace) -> None:
+    # a literal IPv6 address always contains a colon, an IPv4 address or a host name never
+    if params.record_file and ":" in params.address:
+        parser.error("Recording is only supported for IPv4 listeners.")
 
-    membership_request = pack('4sL', inet_aton(address), INADDR_ANY)
-    subscriber.setsockopt(IPPROTO_IP, IP_ADD_MEMBERSHIP, membership_request)
 
-    return UDPSocket(subscriber, msg_size)
+def create_traffic_recorder(cmd_line_args: Namespace, transport: Transport) -> Optional[TrafficRecorder]:
+    if not cmd_line_args.record_file:
+        return None
+    return TrafficRecorder(cmd_line_args.record_file, transport)
 
 
 def random_sleep(min_sec: int, max_sec:int) -> None:
@@ -23,20 +23,92 @@ from argparse import (
     RawTextHelpFormatter,
 )
 from os import getpid
+from os.path import exists
 from random import randint
 from socket import timeout
+from struct import Struct
+from time import (
+    monotonic,
+    sleep,
+)
 from uuid import uuid4
 from typing import (
     Any,
     Dict,
+    List,
+    Optional,
 )
 
 from commons import (
+    BackgroundLog,
+    LatencyHistogram,
+    MessageType,
+    ProtocolVersion,
+    TCPSocket,
+    add_log_cmd_line_args,
+    add_socket_tuning_cmd_line_args,
+    add_timeline_cmd_line_args,
+    create_log,
+    encode_msg,
+    format_socket_tuning,
+    get_codec_names,
+    get_compression_names,
+    is_tcp_info_supported,
     open_tcp_connection,
     random_sleep,
+    start_queue_timeline,
 )
 
 
+# a corpus file starts with a header (magic, name of the codec the messages have been
+# encoded with, empty for JSON); each entry consists of the payload length, the message
+# type and the encoded payload
+_CORPUS_MAGIC = b"CORPUS01"
+_CORPUS_HEADER_STRUCT = Struct(">8s16s")
+_CORPUS_ENTRY_HEADER_STRUCT = Struct(">IH")
+
+# sends blocked for longer than this are considered as stalled by a full send buffer
+_STALL_THRESHOLD_SEC = 0.001
+
+
+class ThroughputStats:
+
+    def __init__(self, write_timeout_sec: float) -> None:
+        self._write_timeout_sec = write_timeout_sec
+        self._send_time_histogram = LatencyHistogram()
+        self._start_time = monotonic()
+        self._msg_count = 0
+        self._byte_count = 0
+        self._stalled_send_count = 0
+        self._stall_time_sec = 0.0
+        self._write_timeout_count = 0
+
+    def record_send(self, byte_count: int, send_time_sec: float) -> None:
+        self._msg_count += 1
+        self._byte_count += byte_count
+        self._send_time_histogram.record_sec(send_time_sec)
+        if send_time_sec > _STALL_THRESHOLD_SEC:
+            self._stalled_send_count += 1
+            self._stall_time_sec += send_time_sec
+        if self._write_timeout_sec and send_time_sec > self._write_timeout_sec:
+            self._write_timeout_count += 1
+
+    def format_progress(self) -> str:
+        elapsed_sec = monotonic() - self._start_time
+        return f"{self._msg_count} messages ({self._byte_count} bytes) sent in {elapsed_sec:.1f} sec, {self._byte_count / elapsed_sec:.0f} bytes/sec, stalled sends = {self._stalled_send_count}"
+
+    def format_summary(self) -> List[str]:
+        elapsed_sec = monotonic() - self._start_time
+        histogram = self._send_time_histogram
+        return [
+            f"Messages sent = {self._msg_count}, bytes sent = {self._byte_count}, duration = {elapsed_sec:.3f} sec",
+            f"Throughput = {self._byte_count / elapsed_sec:.0f} bytes/sec, {self._msg_count / elapsed_sec:.1f} msg/sec",
+            f"Send time [ms]: p50 = {histogram.get_percentile(50) / 1000:.3f}, p99 = {histogram.get_percentile(99) / 1000:.3f}, max = {histogram.get_max() / 1000:.3f}",
+            f"Stalled sends (> {1000 * _STALL_THRESHOLD_SEC:.0f} ms) = {self._stalled_send_count}, total stall time = {self._stall_time_sec:.3f} sec",
+            f"Sends exceeding the write timeout ({self._write_timeout_sec} sec) = {self._write_timeout_count}",
+        ]
+
+
 def create_cmd_line_args_parser() -> ArgumentParser:
     parser = ArgumentParser(description="Eager Producer TCP Client", formatter_class=RawTextHelpFormatter)
 
@@ -71,12 +143,83 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="optional number of messages to be sent (default = 10)",
         type=int
     )
+    parser.add_argument(
+        "-b", "--batch-size",
+        dest="batch_size",
+        default=1,
+        help="optional number of messages sent by a single vectored write (default = 1)",
+        type=int
+    )
+    parser.add_argument(
+        "-P", "--protocol-version",
+        dest="protocol_version",
+        default=1,
+        choices=[1, 2],
+        help="optional max. protocol version negotiated with the server; version 2 supports payloads\n"
+             "longer than 64 KB, version 1 does not need any handshake (default = 1)",
+        type=int
+    )
+    parser.add_argument(
+        "-f", "--codec",
+        dest="codec",
+        choices=get_codec_names(),
+        help="optional codec used to send the messages as binary messages (default = JSON messages)",
+        type=str
+    )
+    parser.add_argument(
+        "-z", "--compression",
+        dest="compression",
+        choices=get_compression_names(),
+        help="optional compression of the payloads of outgoing messages; it is only applied if\n"
+             "the handshake confirms the server supports it (default = no compression)",
+        type=str
+    )
+    parser.add_argument(
+        "--compression-threshold",
+        dest="compression_threshold",
+        default=1024,
+        help="optional min. payload size in bytes for the compression to be applied (default = 1024)",
+        type=int
+    )
     parser.add_argument(
         "-n", "--client-name",
         dest="client_name",
         help="optional client name (if not specified, generated UUID will be used)",
         type=str
     )
+    parser.add_argument(
+        "-T", "--throughput",
+        dest="throughput",
+        default=False,
+        action="store_true",
+        help="if specified, messages taken from a corpus generated in advance are sent back to back\n"
+             "(or at the rate given by --rate), and the throughput and the send stalls are reported;\n"
+             "--msg-count = 0 means the messages are sent until Ctrl+C is pressed",
+    )
+    parser.add_argument(
+        "--corpus-size",
+        dest="corpus_size",
+        default=100,
+        help="optional number of distinct messages in the corpus for the throughput mode (default = 100)",
+        type=int
+    )
+    parser.add_argument(
+        "--corpus-file",
+        dest="corpus_file",
+        help="optional corpus file for the throughput mode; if the file exists, the corpus is loaded\n"
+             "from it (it must have been generated with the same codec), otherwise the generated corpus\n"
+             "is saved to it (default = no file)",
+        type=str
+    )
+    parser.add_argument(
+        "-R", "--rate",
+        dest="rate",
+        help="optional target number of messages per second for the throughput mode (default = max. speed)",
+        type=float
+    )
+    add_socket_tuning_cmd_line_args(parser)
+    add_log_cmd_line_args(parser)
+    add_timeline_cmd_line_args(parser)
 
     return parser
 
@@ -84,6 +227,18 @@ def create_cmd_line_args_parser() -> ArgumentParser:
 def parse_cmd_line_args() -> Namespace:
     parser = create_cmd_line_args_parser()
     params = parser.parse_args()
+    if params.batch_size < 1:
+        parser.error("Batch size must be a positive number.")
+    if params.corpus_size < 1:
+        parser.error("Corpus size must be a positive number.")
+    if params.compression_threshold < 0:
+        parser.error("Compression threshold must not be a negative number.")
+    if params.rate is not None and params.rate <= 0:
+        parser.error("Rate must be a positive number.")
+    if params.timeline_file and not is_tcp_info_supported():
+        parser.error("Queue occupancy timeline is only supported on Linux.")
+    if params.timeline_interval_sec <= 0:
+        parser.error("Timeline interval must be a positive number.")
     return params
 
 
@@ -98,37 +253,152 @@ def generate_random_msg(client_name: str, seq_no: int) -> Dict[str, Any]:
     }
 
 
+def generate_corpus(client_name: str, size: int, codec_name: str) -> List[tuple[MessageType, bytes]]:
+    return [encode_msg(generate_random_msg(client_name, seq_no), codec_name) for seq_no in range(1, size + 1)]
+
+
+def save_corpus(path: str, corpus: List[tuple[MessageType, bytes]], codec_name: Optional[str]) -> None:
+    with open(path, "wb") as corpus_file:
+        corpus_file.write(_CORPUS_HEADER_STRUCT.pack(_CORPUS_MAGIC, bytes(codec_name or "", "ascii")))
+        for msg_type, payload in corpus:
+            corpus_file.write(_CORPUS_ENTRY_HEADER_STRUCT.pack(len(payload), msg_type))
+            corpus_file.write(payload)
+
+
+def load_corpus(path: str, codec_name: Optional[str]) -> List[tuple[MessageType, bytes]]:
+    with open(path, "rb") as corpus_file:
+        data = corpus_file.read()
+    if len(data) < _CORPUS_HEADER_STRUCT.size or data[:len(_CORPUS_MAGIC)] != _CORPUS_MAGIC:
+        raise ValueError(f"File {path} is not a corpus file.")
+    _, corpus_codec_name = _CORPUS_HEADER_STRUCT.unpack_from(data)
+    corpus_codec_name = str(corpus_codec_name.rstrip(b"\0"), "ascii") or None
+    if corpus_codec_name != codec_name:
+        raise ValueError(f"Corpus file {path} contains messages encoded as {corpus_codec_name or 'JSON'}, but {codec_name or 'JSON'} has been requested.")
+    corpus, offset = [], _CORPUS_HEADER_STRUCT.size
+    while offset < len(data):
+        length, msg_type = _CORPUS_ENTRY_HEADER_STRUCT.unpack_from(data, offset)
+        offset += _CORPUS_ENTRY_HEADER_STRUCT.size
+        corpus.append((MessageType(msg_type), data[offset:offset + length]))
+        offset += length
+    return corpus
+
+
+def prepare_corpus(cmd_line_args: Namespace, client_name: str, log: BackgroundLog) -> List[tuple[MessageType, bytes]]:
+    if cmd_line_args.corpus_file and exists(cmd_line_args.corpus_file):
+        corpus = load_corpus(cmd_line_args.corpus_file, cmd_line_args.codec)
+        log.info(f"Corpus of {len(corpus)} messages loaded from {cmd_line_args.corpus_file}")
+        return corpus
+    corpus = generate_corpus(client_name, cmd_line_args.corpus_size, cmd_line_args.codec)
+    log.info(f"Corpus of {len(corpus)} messages generated")
+    if cmd_line_args.corpus_file:
+        save_corpus(cmd_line_args.corpus_file, corpus, cmd_line_args.codec)
+        log.info(f"Corpus saved to {cmd_line_args.corpus_file}")
+    return corpus
+
+
+def send_corpus(socket: TCPSocket, cmd_line_args: Namespace, corpus: List[tuple[MessageType, bytes]], log: BackgroundLog) -> None:
+    # The sends are blocking, so that no message is ever written partially; instead of
+    # aborting the connection, the sends blocked for longer than the write timeout are
+    # counted. The time is measured around each send, so the stalls caused by a full
+    # send buffer (e.g. a receiver advertising zero window) become visible.
+    stats = ThroughputStats(cmd_line_args.write_timeout_sec)
+    interval_sec = 1 / cmd_line_args.rate if cmd_line_args.rate else None
+    next_send_time = last_progress_time = monotonic()
+    seq_no = 0
+    try:
+        while not cmd_line_args.msg_count or seq_no < cmd_line_args.msg_count:
+            if interval_sec:
+                sleep(max(0, next_send_time - monotonic()))
+                next_send_time += interval_sec
+            msg_type, payload = corpus[seq_no % len(corpus)]
+            send_start_time = monotonic()
+            byte_count = socket.send_encoded_msg(msg_type, payload)
+            send_end_time = monotonic()
+            stats.record_send(byte_count, send_end_time - send_start_time)
+            seq_no += 1
+            if send_end_time - last_progress_time >= 1:
+                log.info(stats.format_progress())
+                last_progress_time = send_end_time
+    finally:
+        for line in stats.format_summary():
+            log.info(line)
+
+
 def main() -> None:
     cmd_line_args = parse_cmd_line_args()
     client_name = cmd_line_args.client_name or str(uuid4())
     print(f"TCP client (PID = {getpid()}) going to connect to {cmd_line_args.address}:{cmd_line_args.port}")
-    print(f"Message count = {cmd_line_args.msg_count}")
+    print(f"Message count = {cmd_line_args.msg_count}, batch size = {cmd_line_args.batch_size}")
+    print(f"Message format = {cmd_line_args.codec or 'JSON'}")
+    if cmd_line_args.compression:
+        print(f"Compression = {cmd_line_args.compression}, threshold = {cmd_line_args.compression_threshold} bytes")
     print(f"Connect timeout = {cmd_line_args.connect_timeout_sec} sec")
     if cmd_line_args.write_timeout_sec:
         print(f"Write timeout = {cmd_line_args.write_timeout_sec} sec")
     else:
         print("No write timeout configured")
+    if cmd_line_args.throughput:
+        print(f"Throughput mode, rate = {cmd_line_args.rate or 'max. speed'}")
     socket = None
+    corpus = None
+    timeline = None
+    log = create_log(cmd_line_args)
     try:
-        socket = open_tcp_connection(cmd_line_args.address, cmd_line_args.port, cmd_line_args.connect_timeout_sec)
+        if cmd_line_args.throughput:
+            # the corpus is prepared in advance, so the message generation does not
+            # distort the measurement
+            corpus = prepare_corpus(cmd_line_args, client_name, log)
+        socket = open_tcp_connection(
+            cmd_line_args.address,
+            cmd_line_args.port,
+            cmd_line_args.connect_timeout_sec,
+            ProtocolVersion(cmd_line_args.protocol_version),
+            cmd_line_args.compression,
+            cmd_line_args.compression_threshold,
+            tuning=cmd_line_args.socket_tuning,
+        )
         snd_buff_size = socket.get_snd_buff_size()
-        print(f"Connection established, output buffer = {snd_buff_size} bytes")
+        log.info(f"Connection established, protocol version = {int(socket.get_protocol_version())}, output buffer = {snd_buff_size} bytes")
+        log.info(f"Compression = {socket.get_compression() or 'none'}")
+        if cmd_line_args.socket_tuning:
+            log.info(f"Socket tuning: {format_socket_tuning(socket.get_socket_tuning())}")
+        timeline = start_queue_timeline(socket, cmd_line_args)
+        if corpus:
+            # the compression negotiated with the server is also applied in advance
+            corpus = [socket.compress_encoded_msg(msg_type, payload) for msg_type, payload in corpus]
+            send_corpus(socket, cmd_line_args, corpus, log)
+            return
         cumulative_byte_count = 0
-        for i in range(1, cmd_line_args.msg_count + 1):
-            msg = generate_random_msg(client_name, i)
-            msg_length = socket.send_json_msg(msg, timeout_sec=cmd_line_args.write_timeout_sec)
-            cumulative_byte_count += msg_length
-            print(f"Message with sequence number = {i} ({msg_length} bytes, totally {cumulative_byte_count} bytes) sent to server...")
+        for first_seq_no in range(1, cmd_line_args.msg_count + 1, cmd_line_args.batch_size):
+            last_seq_no = min(first_seq_no + cmd_line_args.batch_size - 1, cmd_line_args.msg_count)
+            if first_seq_no == last_seq_no:
+                msg = generate_random_msg(client_name, first_seq_no)
+                if cmd_line_args.codec:
+                    msg_length = socket.send_binary_msg(msg, cmd_line_args.codec, timeout_sec=cmd_line_args.write_timeout_sec)
+                else:
+                    msg_length = socket.send_json_msg(msg, timeout_sec=cmd_line_args.write_timeout_sec)
+                cumulative_byte_count += msg_length
+                log.event(None, "Message with sequence number = {} ({} bytes, totally {} bytes) sent to server...", first_seq_no, msg_length, cumulative_byte_count)
+            else:
+                batch = [generate_random_msg(client_name, seq_no) for seq_no in range(first_seq_no, last_seq_no + 1)]
+                batch_length = socket.send_many(batch, timeout_sec=cmd_line_args.write_timeout_sec, codec_name=cmd_line_args.codec)
+                cumulative_byte_count += batch_length
+                log.event(None, "Messages with sequence numbers = {}...{} ({} bytes, totally {} bytes) sent to server...", first_seq_no, last_seq_no, batch_length, cumulative_byte_count)
             random_sleep(min_sec=2, max_sec=5)
     except KeyboardInterrupt:
-        print("Keyboard interrupt - exit")
+        log.info("Keyboard interrupt - exit")
     except (timeout, TimeoutError, ConnectionRefusedError, ConnectionResetError) as e:
-        print(f"{type(e).__name__}: {str(e)}")
+        log.info(f"{type(e).__name__}: {str(e)}")
     except Exception as e:
-        print(f"Exception caught: {str(e)}")
+        log.info(f"Exception caught: {str(e)}")
     finally:
+        if timeline:
+            timeline.stop()
+            timeline.write(cmd_line_args.timeline_file)
+            log.info(f"Queue occupancy timeline ({len(timeline.get_samples())} samples) written to {cmd_line_args.timeline_file}")
         if socket:
             socket.close()
+        log.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+#
+# Copyright 2024 Jaroslav Chmurny
+#
+# This file is part of TCP/IP & DNS Sandbox.
+#
+# TCP/IP & DNS Sandbox is free software developed for educational purposes.
+# It is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from argparse import (
+    ArgumentParser,
+    Namespace,
+    RawTextHelpFormatter,
+)
+from os import getpid
+from os.path import isdir
+from time import monotonic
+
+from commons import (
+    MessageType,
+    TCPSocket,
+    add_socket_tuning_cmd_line_args,
+    format_socket_tuning,
+    open_tcp_listener,
+)
+
+
+def create_cmd_line_args_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="File Receiver TCP Server", formatter_class=RawTextHelpFormatter)
+
+    parser.add_argument(
+        "address",
+        help="the IP address the server has to bind to (use 0.0.0.0 to bind to all network interfaces)"
+    )
+    parser.add_argument(
+        "port",
+        help="the TCP port the server has to bind to",
+        type=int
+    )
+    parser.add_argument(
+        "-o", "--output-dir",
+        dest="output_dir",
+        default=".",
+        help="optional directory the received files are stored to; existing files are overwritten\n"
+             "(default = current directory)",
+        type=str,
+    )
+    add_socket_tuning_cmd_line_args(parser)
+
+    return parser
+
+
+def parse_cmd_line_args() -> Namespace:
+    parser = create_cmd_line_args_parser()
+    params = parser.parse_args()
+    if not isdir(params.output_dir):
+        parser.error(f"Output directory {params.output_dir} does not exist.")
+    return params
+
+
+def format_throughput(byte_count: int, duration_sec: float) -> str:
+    return f"{byte_count / max(duration_sec, 1e-9) / 2**20:.1f} MiB/sec"
+
+
+def receive_files(connection: TCPSocket, output_dir: str) -> None:
+    # files and control messages can be interleaved on the same connection; each
+    # received file is acknowledged, so the sender can measure the complete transfer
+    file_count, byte_count, duration_sec = 0, 0, 0.0
+    try:
+        while True:
+            if connection.peek_msg_type() != MessageType.FILE:
+                print(f"Control message received: {connection.recv_msg()}")
+                continue
+            start_time = monotonic()
+            received_file = connection.recv_file(output_dir)
+            file_duration_sec = monotonic() - start_time
+            connection.send_json_msg({"name": received_file.name, "size": received_file.size})
+            print(f"File {received_file.path} ({received_file.size} bytes) received in {file_duration_sec:.3f} sec, throughput = {format_throughput(received_file.size, file_duration_sec)}")
+            file_count += 1
+            byte_count += received_file.size
+            duration_sec += file_duration_sec
+    except EOFError:
+        print(f"EOF - client has disconnected; files received = {file_count}, bytes received = {byte_count}, throughput = {format_throughput(byte_count, duration_sec)}")
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+    finally:
+        connection.close()
+
+
+def main() -> None:
+    cmd_line_args = parse_cmd_line_args()
+    print(f"TCP server (PID = {getpid()}) going to bind to {cmd_line_args.address}:{cmd_line_args.port}")
+    listener = None
+    try:
+        listener = open_tcp_listener(
+            address=cmd_line_args.address,
+            port=cmd_line_args.port,
+            reuse_address=True,
+            reuse_port=False,
+            tuning=cmd_line_args.socket_tuning,
+        )
+        # the connections are served one after another
+        while True:
+            connection, remote_address = listener.accept()
+            print(f"Client connection accepted from ({remote_address.host}:{remote_address.port}), input buffer size = {connection.get_rcv_buff_size()} bytes...")
+            if cmd_line_args.socket_tuning:
+                print(f"Socket tuning: {format_socket_tuning(connection.get_socket_tuning())}")
+            receive_files(connection, cmd_line_args.output_dir)
+    except KeyboardInterrupt:
+        print("Keyboard interrupt - exit")
+    except Exception as e:
+        print(f"Exception caught: {str(e)}")
+    finally:
+        if listener:
+            listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#
+# Copyright 2024 Jaroslav Chmurny
+#
+# This file is part of TCP/IP & DNS Sandbox.
+#
+# TCP/IP & DNS Sandbox is free software developed for educational purposes.
+# It is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from argparse import (
+    ArgumentParser,
+    Namespace,
+    RawTextHelpFormatter,
+)
+from dataclasses import replace
+from os import getpid
+from os.path import (
+    getsize,
+    isfile,
+)
+from socket import timeout
+from time import monotonic
+from typing import Optional
+
+from commons import (
+    ProtocolVersion,
+    SocketTuning,
+    add_socket_tuning_cmd_line_args,
+    format_socket_tuning,
+    open_tcp_connection,
+)
+
+
+def create_cmd_line_args_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="File Sender TCP Client", formatter_class=RawTextHelpFormatter)
+
+    parser.add_argument(
+        "address",
+        help="the IP address the client has to connect to"
+    )
+    parser.add_argument(
+        "port",
+        help="the TCP port the client has to connect to",
+        type=int
+    )
+    parser.add_argument(
+        "files",
+        help="the file(s) to be sent; each of them is sent as a single FILE message",
+        metavar="file",
+        nargs="+",
+    )
+    parser.add_argument(
+        "-t", "--connect-timeout-sec",
+        dest="connect_timeout_sec",
+        default=10,
+        help="optional connect timeout in seconds (default = 10 sec)",
+        type=int
+    )
+    parser.add_argument(
+        "-w", "--timeout-sec",
+        dest="timeout_sec",
+        help="optional timeout in seconds for sending a file and for receiving its acknowledgement\n"
+             "(default = no timeout)",
+        type=float,
+    )
+    add_socket_tuning_cmd_line_args(parser)
+
+    return parser
+
+
+def parse_cmd_line_args() -> Namespace:
+    parser = create_cmd_line_args_parser()
+    params = parser.parse_args()
+    for file in params.files:
+        if not isfile(file):
+            parser.error(f"File {file} does not exist.")
+    if params.timeout_sec is not None and params.timeout_sec <= 0:
+        parser.error("Timeout must be a positive number.")
+    return params
+
+
+def create_socket_tuning(tuning: Optional[SocketTuning]) -> SocketTuning:
+    # the client waits for the acknowledgement of each file, so the Nagle's algorithm
+    # would hold the tail of the file until the delayed ACK of the receiver; therefore,
+    # it is disabled unless the tuning profile explicitly says otherwise
+    tuning = tuning or SocketTuning()
+    return tuning if tuning.nodelay is not None else replace(tuning, nodelay=1)
+
+
+def format_throughput(byte_count: int, duration_sec: float) -> str:
+    return f"{byte_count / max(duration_sec, 1e-9) / 2**20:.1f} MiB/sec"
+
+
+def main() -> None:
+    cmd_line_args = parse_cmd_line_args()
+    print(f"TCP client (PID = {getpid()}) going to connect to {cmd_line_args.address}:{cmd_line_args.port}")
+    socket = None
+    try:
+        # the protocol version 2 is needed for files larger than 64 KB
+        socket = open_tcp_connection(
+            cmd_line_args.address,
+            cmd_line_args.port,
+            cmd_line_args.connect_timeout_sec,
+            ProtocolVersion.V2,
+            tuning=create_socket_tuning(cmd_line_args.socket_tuning),
+        )
+        print(f"Connection established, protocol version = {int(socket.get_protocol_version())}, output buffer = {socket.get_snd_buff_size()} bytes")
+        if cmd_line_args.socket_tuning:
+            print(f"Socket tuning: {format_socket_tuning(socket.get_socket_tuning())}")
+        total_size = sum(getsize(file) for file in cmd_line_args.files)
+        socket.send_json_msg({"file_count": len(cmd_line_args.files), "total_size": total_size}, cmd_line_args.timeout_sec)
+        start_time = monotonic()
+        for file in cmd_line_args.files:
+            # the duration includes the acknowledgement, i.e. the time needed by the
+            # receiver to store the complete file
+            file_start_time = monotonic()
+            byte_count = socket.send_file(file, timeout_sec=cmd_line_args.timeout_sec)
+            ack = socket.recv_json_msg(cmd_line_args.timeout_sec)
+            duration_sec = monotonic() - file_start_time
+            print(f"File {file} ({ack['size']} bytes) sent and acknowledged in {duration_sec:.3f} sec, throughput = {format_throughput(byte_count, duration_sec)}")
+        duration_sec = monotonic() - start_time
+        print(f"Files sent = {len(cmd_line_args.files)}, bytes sent = {total_size}, duration = {duration_sec:.3f} sec")
+        print(f"Throughput = {format_throughput(total_size, duration_sec)}")
+    except KeyboardInterrupt:
+        print("Keyboard interrupt - exit")
+    except (timeout, TimeoutError, ConnectionRefusedError, ConnectionResetError) as e:
+        print(f"{type(e).__name__}: {str(e)}")
+    except Exception as e:
+        print(f"Exception caught: {str(e)}")
+    finally:
+        if socket:
+            socket.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -25,8 +25,16 @@ from argparse import (
 from os import getpid
 
 from commons import (
+    BackgroundLog,
     TCPSocket,
+    add_log_cmd_line_args,
+    add_socket_tuning_cmd_line_args,
+    add_timeline_cmd_line_args,
+    create_log,
+    format_socket_tuning,
+    is_tcp_info_supported,
     open_tcp_listener,
+    start_queue_timeline,
 )
 
 
@@ -42,6 +50,17 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="the TCP port the server has to bind to",
         type=int
     )
+    parser.add_argument(
+        "--stream-chunk-size",
+        dest="stream_chunk_size",
+        help="optional max. number of bytes decoded at once; if specified, the messages are decoded\n"
+             "incrementally while they are arriving instead of being received as a whole (default =\n"
+             "no incremental decoding)",
+        type=int,
+    )
+    add_socket_tuning_cmd_line_args(parser)
+    add_log_cmd_line_args(parser)
+    add_timeline_cmd_line_args(parser)
 
     return parser
 
@@ -51,34 +70,67 @@ def parse_cmd_line_args() -> Namespace:
     params = parser.parse_args()
     if not (1024 <= params.port <= 65535):
         parser.error("Port must be between 1024 and 65535.")
+    if params.timeline_file and not is_tcp_info_supported():
+        parser.error("Queue occupancy timeline is only supported on Linux.")
+    if params.timeline_interval_sec <= 0:
+        parser.error("Timeline interval must be a positive number.")
+    if params.stream_chunk_size is not None and params.stream_chunk_size < 1:
+        parser.error("Stream chunk size must be a positive number.")
     return params
 
 
+def consume_msg_stream(connection: TCPSocket, chunk_size: int, log: BackgroundLog) -> None:
+    # the random numbers are processed one by one as they arrive, so the message is
+    # never held in the memory as a whole
+    sequence_number, number_count, number_sum = None, 0, 0
+    for event in connection.recv_json_stream(chunk_size=chunk_size):
+        if event.key == "sequence_number":
+            sequence_number = event.value
+        elif event.key == "random_numbers":
+            number_count += 1
+            number_sum += event.value
+    log.event(None, "Message with sequence number {} received, {} random numbers (sum = {})...", sequence_number, number_count, number_sum)
+
+
 def main() -> None:
     cmd_line_args = parse_cmd_line_args()
     print(f"TCP server (PID = {getpid()}) going to bind to {cmd_line_args.address}:{cmd_line_args.port}")
     listener = None
+    timeline = None
+    log = create_log(cmd_line_args)
     try:
         listener = open_tcp_listener(
             address=cmd_line_args.address,
             port=cmd_line_args.port,
             reuse_address=True,
             reuse_port=False,
+            tuning=cmd_line_args.socket_tuning,
         )
         connection, remote_address = listener.accept()
         rcv_buf_size = connection.get_rcv_buff_size()
         print(f"Client connection accepted from ({remote_address.host}:{remote_address.port}), input buffer size = {rcv_buf_size} bytes...")
+        if cmd_line_args.socket_tuning:
+            print(f"Socket tuning: {format_socket_tuning(connection.get_socket_tuning())}")
+        timeline = start_queue_timeline(connection, cmd_line_args)
         input("Press enter to start reading the data")
         while True:
-            json_msg = connection.recv_json_msg()
-            print(f"Message with sequence number {json_msg['sequence_number']} received...")
+            if cmd_line_args.stream_chunk_size:
+                consume_msg_stream(connection, cmd_line_args.stream_chunk_size, log)
+                continue
+            msg = connection.recv_msg()
+            log.event(None, "Message with sequence number {} received...", msg["sequence_number"])
     except KeyboardInterrupt:
-        print("Keyboard interrupt - exit")
+        log.info("Keyboard interrupt - exit")
     except Exception as e:
-        print(f"Exception caught: {str(e)}")
+        log.info(f"Exception caught: {str(e)}")
     finally:
+        if timeline:
+            timeline.stop()
+            timeline.write(cmd_line_args.timeline_file)
+            log.info(f"Queue occupancy timeline ({len(timeline.get_samples())} samples) written to {cmd_line_args.timeline_file}")
         if listener:
             listener.close()
+        log.close()
 
 
 if __name__ == "__main__":
@@ -30,6 +30,9 @@ from os import getpid
 
 from commons import (
     Endpoint,
+    add_socket_tuning_cmd_line_args,
+    add_udp_datagram_cmd_line_args,
+    format_socket_tuning,
     open_multicast_publisher,
     random_sleep,
 )
@@ -56,6 +59,8 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="the UDP port the publisher will send messages to",
         type=int
     )
+    add_socket_tuning_cmd_line_args(parser)
+    add_udp_datagram_cmd_line_args(parser)
 
     return parser
 
@@ -74,6 +79,8 @@ def parse_cmd_line_args() -> Namespace:
     if not is_multicast_address(params.address):
         message = f"The specified IP address '{params.address}' is not a valid IPv4 multicast address."
         parser.error(message)
+    if params.mtu is not None and not params.variable_size:
+        parser.error("MTU is only applicable with --variable-size.")
     return params
 
 
@@ -83,7 +90,9 @@ def main() -> None:
     publisher = None
     try:
         destination = Endpoint(cmd_line_args.address, cmd_line_args.port)
-        publisher = open_multicast_publisher(4096)
+        publisher = open_multicast_publisher(4096, padded=not cmd_line_args.variable_size, mtu=cmd_line_args.mtu)
+        if cmd_line_args.socket_tuning:
+            print(f"Socket tuning: {format_socket_tuning(publisher.apply_socket_tuning(cmd_line_args.socket_tuning))}")
         i = 1
         while True:
             output_msg = f"Multicast message #{i}"
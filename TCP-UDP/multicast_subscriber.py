@@ -24,7 +24,12 @@ from argparse import (
 )
 from os import getpid
 
-from commons import open_multicast_subscriber
+from commons import (
+    add_socket_tuning_cmd_line_args,
+    add_udp_datagram_cmd_line_args,
+    format_socket_tuning,
+    open_multicast_subscriber,
+)
 
 
 def epilog() -> str:
@@ -43,6 +48,8 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="the UDP port the consumer will read messages from",
         type=int
     )
+    add_socket_tuning_cmd_line_args(parser)
+    add_udp_datagram_cmd_line_args(parser)
 
     return parser
 
@@ -50,6 +57,8 @@ def create_cmd_line_args_parser() -> ArgumentParser:
 def parse_cmd_line_args() -> Namespace:
     parser = create_cmd_line_args_parser()
     params = parser.parse_args()
+    if params.mtu is not None and not params.variable_size:
+        parser.error("MTU is only applicable with --variable-size.")
     return params
 
 
@@ -58,7 +67,15 @@ def main() -> None:
     print(f"Multicast subscriber (PID = {getpid()}) is going to consume from {cmd_line_args.address}:{cmd_line_args.port}")
     subscriber = None
     try:
-        subscriber = open_multicast_subscriber(cmd_line_args.address, cmd_line_args.port, 4096)
+        subscriber = open_multicast_subscriber(
+            cmd_line_args.address,
+            cmd_line_args.port,
+            4096,
+            padded=not cmd_line_args.variable_size,
+            mtu=cmd_line_args.mtu,
+        )
+        if cmd_line_args.socket_tuning:
+            print(f"Socket tuning: {format_socket_tuning(subscriber.apply_socket_tuning(cmd_line_args.socket_tuning))}")
         while True:
             _, input_msg = subscriber.recv_text_msg()
             print(f"Message from publisher: '{input_msg}'")
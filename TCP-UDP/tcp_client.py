@@ -22,16 +22,161 @@ from argparse import (
     Namespace,
     RawTextHelpFormatter,
 )
+from collections import deque
+from json import dump
 from os import getpid
 from socket import timeout
+from threading import Thread
+from time import (
+    monotonic,
+    sleep,
+)
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+)
 from uuid import uuid4
 
 from commons import (
+    LatencyHistogram,
+    PipelinedConnection,
+    PipelinedResponse,
+    ProtocolVersion,
+    TCPConnectionPool,
+    TCPSocket,
+    add_socket_tuning_cmd_line_args,
+    format_socket_tuning,
     open_tcp_connection,
     random_sleep,
 )
 
 
+class LoadConnection:
+
+    # Drives a single connection of the load test. In closed-loop mode, the next message
+    # is sent as soon as there is space in the window of outstanding requests (i.e. as
+    # soon as the response to the previous one is received for window = 1). In open-loop mode,
+    # messages are sent at a constant rate regardless of the responses (a separate thread
+    # reads the responses), and the latency is measured from the time the message should
+    # have been sent, so a stalled server is not hidden by the client waiting for it.
+
+    def __init__(self,
+                 socket: TCPSocket,
+                 name: str,
+                 rate: Optional[float],
+                 window_size: int,
+                 read_timeout_sec: Optional[float]) -> None:
+        self._socket = socket
+        self._name = name
+        self._rate = rate
+        self._window_size = window_size
+        self._read_timeout_sec = read_timeout_sec
+        self.histogram = LatencyHistogram()
+        self.sent_count = 0
+        self.received_count = 0
+        self.error = None
+
+    def run(self, start_time: float, end_time: float) -> None:
+        try:
+            if self._rate:
+                self._run_open_loop(start_time, end_time)
+            else:
+                self._run_closed_loop(start_time, end_time)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {str(e)}"
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._socket.close()
+
+    def get_socket_tuning(self) -> Dict[str, Optional[int]]:
+        return self._socket.get_socket_tuning()
+
+    def _run_closed_loop(self, start_time: float, end_time: float) -> None:
+        pipeline = PipelinedConnection(self._socket, self._window_size, self._read_timeout_sec)
+        sleep(max(0, start_time - monotonic()))
+        while monotonic() < end_time:
+            pipeline.submit(f"Message #{self.sent_count + 1} from client {self._name}")
+            self.sent_count += 1
+            self._record_responses(pipeline.pop_completed())
+        self._record_responses(pipeline.drain())
+
+    def _record_responses(self, responses: List[PipelinedResponse]) -> None:
+        for response in responses:
+            self.histogram.record_sec(response.latency_sec)
+        self.received_count += len(responses)
+
+    def _run_open_loop(self, start_time: float, end_time: float) -> None:
+        # the server answers the messages of a connection in order, so the responses
+        # can be matched with the intended send times kept in a FIFO; when all messages
+        # have been sent, the output is shut down, so the server closes the connection
+        # after answering them all; the socket timeout is shared by both threads, so it
+        # is set before the receiver starts, and both threads pass the same value (they
+        # would race on switching it otherwise)
+        send_times = deque()
+        self._socket.set_timeout(self._read_timeout_sec)
+        receiver = Thread(target=self._receive_responses, args=(send_times,), daemon=True)
+        receiver.start()
+        interval_sec = 1 / self._rate
+        intended_send_time = start_time
+        try:
+            while intended_send_time < end_time:
+                sleep(max(0, intended_send_time - monotonic()))
+                send_times.append(intended_send_time)
+                self._socket.send_text_msg(f"Message #{self.sent_count + 1} from client {self._name}", self._read_timeout_sec)
+                self.sent_count += 1
+                intended_send_time += interval_sec
+        finally:
+            self._socket.shutdown_output()
+        receiver.join()
+
+    def _receive_responses(self, send_times: deque) -> None:
+        try:
+            while True:
+                self._socket.recv_text_msg(self._read_timeout_sec)
+                self.histogram.record_sec(monotonic() - send_times.popleft())
+                self.received_count += 1
+        except EOFError:
+            if self.received_count < self.sent_count:
+                self.error = f"EOF - {self.sent_count - self.received_count} response(s) missing"
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {str(e)}"
+
+
+class PooledLoadWorker:
+
+    # Drives a workload of short-lived requests: each request takes a connection from
+    # the pool shared by all workers, sends a single message, waits for the response
+    # and returns the connection to the pool. The latency includes the time spent
+    # waiting for a connection and opening it (if a new one is needed).
+
+    def __init__(self, pool: TCPConnectionPool, name: str, read_timeout_sec: Optional[float]) -> None:
+        self._pool = pool
+        self._name = name
+        self._read_timeout_sec = read_timeout_sec
+        self.histogram = LatencyHistogram()
+        self.sent_count = 0
+        self.received_count = 0
+        self.error = None
+
+    def run(self, start_time: float, end_time: float) -> None:
+        sleep(max(0, start_time - monotonic()))
+        try:
+            while monotonic() < end_time:
+                request_start_time = monotonic()
+                with self._pool.connection() as socket:
+                    socket.send_text_msg(f"Message #{self.sent_count + 1} from client {self._name}")
+                    self.sent_count += 1
+                    socket.recv_text_msg(self._read_timeout_sec)
+                self.histogram.record_sec(monotonic() - request_start_time)
+                self.received_count += 1
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {str(e)}"
+
+
 def create_cmd_line_args_parser() -> ArgumentParser:
     parser = ArgumentParser(description="TCP Client", formatter_class=RawTextHelpFormatter)
 
@@ -65,12 +210,74 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="optional number of messages to be sent (default = 10)",
         type=int,
     )
+    parser.add_argument(
+        "-P", "--protocol-version",
+        dest="protocol_version",
+        default=1,
+        choices=[1, 2],
+        help="optional max. protocol version negotiated with the server; version 2 supports payloads\n"
+             "longer than 64 KB, version 1 does not need any handshake (default = 1)",
+        type=int
+    )
     parser.add_argument(
         "-n", "--client-name",
         dest="client_name",
         help="optional client name (if not specified, generated UUID will be used)",
         type=str,
     )
+    parser.add_argument(
+        "-W", "--window",
+        dest="window",
+        default=1,
+        help="optional max. number of outstanding requests per connection; if greater than 1, the\n"
+             "requests are pipelined and matched with the responses by correlation IDs (default = 1)",
+        type=int,
+    )
+    parser.add_argument(
+        "-l", "--load-connections",
+        dest="load_connections",
+        help="optional number of concurrent connections; if specified, the client runs as a load\n"
+             "generator and reports the latency percentiles and the throughput (default = no load test)",
+        type=int,
+    )
+    parser.add_argument(
+        "-d", "--duration-sec",
+        dest="duration_sec",
+        default=10,
+        help="optional duration of the load test in seconds (default = 10 sec)",
+        type=float,
+    )
+    parser.add_argument(
+        "-R", "--rate",
+        dest="rate",
+        help="optional total number of messages per second sent by all connections of the load test\n"
+             "(open loop); if not specified, each connection sends the next message as soon as the\n"
+             "response to the previous one is received (closed loop)",
+        type=float,
+    )
+    parser.add_argument(
+        "-j", "--json-output",
+        dest="json_output",
+        help="optional path to a file the results of the load test are written to as JSON",
+        type=str,
+    )
+    parser.add_argument(
+        "--pool-size",
+        dest="pool_size",
+        help="optional max. size of a connection pool; if specified, the load test sends short-lived\n"
+             "requests, each of them using a connection taken from the pool shared by all load\n"
+             "connections (default = each load connection uses its own connection)",
+        type=int,
+    )
+    parser.add_argument(
+        "--pool-idle-timeout-sec",
+        dest="pool_idle_timeout_sec",
+        default=60,
+        help="optional time in seconds after which idle pooled connections are closed; 0 means no\n"
+             "connection is ever reused, i.e. each request opens a new one (default = 60 sec)",
+        type=float,
+    )
+    add_socket_tuning_cmd_line_args(parser)
 
     return parser
 
@@ -78,9 +285,135 @@ def create_cmd_line_args_parser() -> ArgumentParser:
 def parse_cmd_line_args() -> Namespace:
     parser = create_cmd_line_args_parser()
     params = parser.parse_args()
+    if params.window < 1:
+        parser.error("Window size must be a positive number.")
+    if params.load_connections is not None and params.load_connections < 1:
+        parser.error("Number of connections must be a positive number.")
+    if params.duration_sec <= 0:
+        parser.error("Duration must be a positive number.")
+    if params.rate is not None and params.rate <= 0:
+        parser.error("Rate must be a positive number.")
+    if params.pool_size is not None:
+        if params.pool_size < 1:
+            parser.error("Pool size must be a positive number.")
+        if params.rate or params.window > 1:
+            parser.error("Pooled connections only support closed-loop load tests with window = 1.")
+    if params.pool_idle_timeout_sec < 0:
+        parser.error("Pool idle timeout must not be negative.")
     return params
 
 
+def open_load_connections(cmd_line_args: Namespace, client_name: str) -> List[LoadConnection]:
+    rate_per_connection = cmd_line_args.rate / cmd_line_args.load_connections if cmd_line_args.rate else None
+    connections: List[LoadConnection] = []
+    try:
+        for i in range(1, cmd_line_args.load_connections + 1):
+            socket = open_tcp_connection(
+                cmd_line_args.address,
+                cmd_line_args.port,
+                cmd_line_args.connect_timeout_sec,
+                ProtocolVersion(cmd_line_args.protocol_version),
+                correlation_ids=cmd_line_args.window > 1,
+                tuning=cmd_line_args.socket_tuning,
+            )
+            connection = LoadConnection(
+                socket,
+                f"{client_name}-{i}",
+                rate_per_connection,
+                cmd_line_args.window,
+                cmd_line_args.read_timeout_sec,
+            )
+            connections.append(connection)
+    except BaseException:
+        for connection in connections:
+            connection.close()
+        raise
+    print(f"{len(connections)} connection(s) established, going to run the load test for {cmd_line_args.duration_sec} sec")
+    if cmd_line_args.socket_tuning:
+        print(f"Socket tuning: {format_socket_tuning(connections[0].get_socket_tuning())}")
+    return connections
+
+
+def run_load_test(cmd_line_args: Namespace, client_name: str) -> Dict[str, Any]:
+    pool = None
+    if cmd_line_args.pool_size:
+        pool = TCPConnectionPool(
+            cmd_line_args.address,
+            cmd_line_args.port,
+            max_size=cmd_line_args.pool_size,
+            idle_timeout_sec=cmd_line_args.pool_idle_timeout_sec,
+            connect_timeout_sec=cmd_line_args.connect_timeout_sec,
+            protocol_version=ProtocolVersion(cmd_line_args.protocol_version),
+            tuning=cmd_line_args.socket_tuning,
+        )
+        connections = [
+            PooledLoadWorker(pool, f"{client_name}-{i}", cmd_line_args.read_timeout_sec) for i in range(1, cmd_line_args.load_connections + 1)
+        ]
+        print(f"{len(connections)} worker(s) sharing a pool of max. {cmd_line_args.pool_size} connection(s), going to run the load test for {cmd_line_args.duration_sec} sec")
+    else:
+        connections = open_load_connections(cmd_line_args, client_name)
+
+    # all connections start at the same moment, after all threads have been started
+    start_time = monotonic() + 0.1
+    end_time = start_time + cmd_line_args.duration_sec
+    threads = [Thread(target=connection.run, args=(start_time, end_time), daemon=True) for connection in connections]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_sec = monotonic() - start_time
+    if pool:
+        pool.close()
+
+    histogram = LatencyHistogram()
+    for connection in connections:
+        histogram.merge(connection.histogram)
+    errors = [connection.error for connection in connections if connection.error]
+    received_count = sum(connection.received_count for connection in connections)
+    return {
+        "connections": len(connections),
+        "mode": "open-loop" if cmd_line_args.rate else "closed-loop",
+        "window": cmd_line_args.window,
+        "target_rate": cmd_line_args.rate,
+        "duration_sec": round(elapsed_sec, 3),
+        "sent_count": sum(connection.sent_count for connection in connections),
+        "received_count": received_count,
+        "msgs_per_sec": round(received_count / elapsed_sec, 1),
+        "error_count": len(errors),
+        "errors": errors,
+        "latency": histogram.to_dict(),
+        "pool": pool.get_counters() if pool else None,
+    }
+
+
+def print_load_test_results(results: Dict[str, Any]) -> None:
+    latency = results["latency"]
+    print(f"Connections = {results['connections']}, mode = {results['mode']}, window = {results['window']}, duration = {results['duration_sec']} sec")
+    print(f"Messages sent = {results['sent_count']}, responses received = {results['received_count']}, throughput = {results['msgs_per_sec']} msg/sec")
+    print(f"Latency [ms]: p50 = {latency['p50'] / 1000:.3f}, p99 = {latency['p99'] / 1000:.3f}, p99.9 = {latency['p99.9'] / 1000:.3f}, max = {latency['max'] / 1000:.3f}")
+    if results["pool"]:
+        print("Connection pool: " + ", ".join(f"{name} = {value}" for name, value in results["pool"].items()))
+    for error in results["errors"]:
+        print(f"Connection failed: {error}")
+
+
+def send_pipelined_msgs(socket: TCPSocket, cmd_line_args: Namespace, client_name: str) -> None:
+    # the messages are sent without any pause, with up to window messages outstanding
+    pipeline = PipelinedConnection(socket, cmd_line_args.window, cmd_line_args.read_timeout_sec)
+    print(f"Window = {cmd_line_args.window}, correlation IDs = {pipeline.uses_correlation_ids()}")
+    for i in range(1, cmd_line_args.msg_count + 1):
+        output_msg = f"Message #{i} from client {client_name}"
+        correlation_id = pipeline.submit(output_msg)
+        print(f"Message sent to server (correlation ID = {correlation_id}): '{output_msg}'")
+        print_pipelined_responses(pipeline.pop_completed())
+    print_pipelined_responses(pipeline.drain())
+
+
+def print_pipelined_responses(responses: List[PipelinedResponse]) -> None:
+    for response in responses:
+        print(f"Message from server received (correlation ID = {response.correlation_id}, {1000 * response.latency_sec:.3f} ms): '{response.msg}'")
+
+
 def main() -> None:
     cmd_line_args = parse_cmd_line_args()
     client_name = cmd_line_args.client_name or str(uuid4())
@@ -90,9 +423,35 @@ def main() -> None:
         print(f"Read timeout = {cmd_line_args.read_timeout_sec} sec")
     else:
         print("No read timeout configured")
+    if cmd_line_args.load_connections:
+        try:
+            results = run_load_test(cmd_line_args, client_name)
+            print_load_test_results(results)
+            if cmd_line_args.json_output:
+                with open(cmd_line_args.json_output, "w") as output_file:
+                    dump(results, output_file, indent=2)
+                print(f"Results written to {cmd_line_args.json_output}")
+        except KeyboardInterrupt:
+            print("Keyboard interrupt - exit")
+        except (timeout, TimeoutError, ConnectionRefusedError, ConnectionResetError) as e:
+            print(f"{type(e).__name__}: {str(e)}")
+        return
     socket = None
     try:
-        socket = open_tcp_connection(cmd_line_args.address, cmd_line_args.port, cmd_line_args.connect_timeout_sec)
+        socket = open_tcp_connection(
+            cmd_line_args.address,
+            cmd_line_args.port,
+            cmd_line_args.connect_timeout_sec,
+            ProtocolVersion(cmd_line_args.protocol_version),
+            correlation_ids=cmd_line_args.window > 1,
+            tuning=cmd_line_args.socket_tuning,
+        )
+        print(f"Connection established, protocol version = {int(socket.get_protocol_version())}")
+        if cmd_line_args.socket_tuning:
+            print(f"Socket tuning: {format_socket_tuning(socket.get_socket_tuning())}")
+        if cmd_line_args.window > 1:
+            send_pipelined_msgs(socket, cmd_line_args, client_name)
+            return
         for i in range(1, cmd_line_args.msg_count + 1):
             output_msg = f"Message #{i} from client {client_name}"
             socket.send_text_msg(output_msg)
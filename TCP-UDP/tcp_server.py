@@ -22,53 +22,341 @@ from argparse import (
     Namespace,
     RawTextHelpFormatter,
 )
+from asyncio import (
+    gather,
+    run,
+)
+from asyncio import sleep as async_sleep
+from ctypes import Array
+from collections import deque
+from dataclasses import dataclass
 from itertools import count
-from os import getpid
+from multiprocessing import Process
+from multiprocessing.sharedctypes import RawArray
+from os import (
+    getpid,
+    kill,
+)
 from platform import system
-from time import sleep
+from sys import exit
+from time import (
+    monotonic,
+    sleep,
+)
 from threading import (
+    Condition,
+    Event,
+    Lock,
     Thread,
     current_thread,
 )
-from typing import Optional
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Union,
+)
 
 from colorama import init as colorama_init
-from colorama import Style
 
 from commons import (
+    AsyncTCPSocket,
+    BackgroundLog,
+    RemoteAddress,
+    SocketTuning,
+    TCPListener,
+    TCPListenerSelector,
     TCPSocket,
+    TCPStats,
+    TrafficRecorder,
+    Transport,
+    WriteCoalescer,
+    add_log_cmd_line_args,
+    add_record_cmd_line_args,
+    add_socket_tuning_cmd_line_args,
+    create_log,
+    create_traffic_recorder,
+    decode_frame,
+    format_buffer_pool_stats,
+    format_socket_tuning,
+    get_buffer_pool,
+    get_compression_names,
     is_reuse_port_supported,
+    is_tcp_info_supported,
     open_tcp_listener,
     next_color,
+    validate_record_cmd_line_args,
 )
 
 
+class WorkerStats:
+
+    # per-worker counters kept in shared memory, so they can be collected by the
+    # supervisor process; each worker process only updates its own slot
+
+    def __init__(self, counters: Array, worker_index: int) -> None:
+        self._counters = counters
+        self._connection_count_index = 2 * worker_index
+        self._msg_count_index = 2 * worker_index + 1
+        self._lock = Lock()
+
+    def connection_accepted(self) -> None:
+        with self._lock:
+            self._counters[self._connection_count_index] += 1
+
+    def msg_received(self) -> None:
+        with self._lock:
+            self._counters[self._msg_count_index] += 1
+
+
+class TCPStatsCollector:
+
+    # Collects the TCP_INFO-based stats of all live connections periodically on a
+    # background thread, and keeps the latest stats of each connection. The aggregated
+    # stats are logged on demand; the demand is only signaled by an event, so it can
+    # be requested by a signal handler without any risk of a deadlock.
+
+    def __init__(self, interval_sec: float, log: BackgroundLog) -> None:
+        self._interval_sec = interval_sec
+        self._log = log
+        self._connections: Dict[str, Union[TCPSocket, AsyncTCPSocket]] = {}
+        self._latest_stats: Dict[str, TCPStats] = {}
+        self._lock = Lock()
+        self._dump_requested = Event()
+        Thread(target=self._run, name="TCP-Stats", daemon=True).start()
+
+    def register(self, name: str, socket: Union[TCPSocket, AsyncTCPSocket]) -> None:
+        with self._lock:
+            self._connections[name] = socket
+
+    def unregister(self, name: str) -> None:
+        with self._lock:
+            self._connections.pop(name, None)
+            self._latest_stats.pop(name, None)
+
+    def request_dump(self) -> None:
+        self._dump_requested.set()
+
+    def _run(self) -> None:
+        while True:
+            dump_requested = self._dump_requested.wait(self._interval_sec)
+            self._collect()
+            if dump_requested:
+                self._dump_requested.clear()
+                self._dump()
+
+    def _collect(self) -> None:
+        with self._lock:
+            connections = list(self._connections.items())
+        for name, socket in connections:
+            try:
+                stats = socket.stats()
+            except OSError:
+                # the connection has been closed in the meantime
+                continue
+            with self._lock:
+                if name in self._connections:
+                    self._latest_stats[name] = stats
+
+    def _dump(self) -> None:
+        with self._lock:
+            latest_stats = dict(self._latest_stats)
+        lines = [f"TCP stats (PID = {getpid()}): connections = {len(latest_stats)}"]
+        if latest_stats:
+            rtts = [stats.rtt_ms for stats in latest_stats.values()]
+            cwnds = [stats.snd_cwnd for stats in latest_stats.values()]
+            lines.append(f"RTT [ms]: min = {min(rtts):.3f}, avg = {sum(rtts) / len(rtts):.3f}, max = {max(rtts):.3f}")
+            lines.append(f"cwnd [segments]: min = {min(cwnds)}, avg = {sum(cwnds) / len(cwnds):.1f}, max = {max(cwnds)}")
+            lines.append(f"Retransmits = {sum(stats.retransmits for stats in latest_stats.values())}, bytes acked = {sum(stats.bytes_acked for stats in latest_stats.values())}, bytes received = {sum(stats.bytes_received for stats in latest_stats.values())}")
+        lines.append(f"Buffer pool: {format_buffer_pool_stats(get_buffer_pool().get_stats())}")
+        for name, stats in sorted(latest_stats.items()):
+            lines.append(f"{name}: RTT = {stats.rtt_ms:.3f} ms (var = {stats.rttvar_ms:.3f} ms), cwnd = {stats.snd_cwnd}, retransmits = {stats.retransmits}, bytes acked = {stats.bytes_acked}, pacing rate = {stats.pacing_rate} bytes/sec")
+        for line in lines:
+            self._log.info(line)
+
+
+@dataclass(frozen=True)
+class ServerContext:
+    log: BackgroundLog
+    response_delay_sec: Optional[float] = None
+    stats: Optional[WorkerStats] = None
+    tcp_stats: Optional[TCPStatsCollector] = None
+    socket_tuning: Optional[SocketTuning] = None
+    coalesce_max_bytes: int = 0
+    coalesce_max_delay_sec: float = 0
+    recorder: Optional[TrafficRecorder] = None
+
+
+def serve_client(socket: TCPSocket, color: str, context: ServerContext) -> None:
+    # the correlation ID (if any) of each request is echoed back with the response,
+    # so pipelining clients can match the responses; all requests obtained by a single
+    # read are answered before the responses are flushed, so pipelined requests are
+    # answered by a single write (unless the coalescer flushes earlier)
+    name = current_thread().name
+    log = context.log
+    coalescer = WriteCoalescer(socket, context.coalesce_max_bytes, context.coalesce_max_delay_sec)
+    peer = socket.get_remote_address() if context.recorder else None
+    if context.socket_tuning:
+        log.info(f"{name}: Socket tuning: {format_socket_tuning(socket.get_socket_tuning())}", color)
+    if context.tcp_stats:
+        context.tcp_stats.register(name, socket)
+    try:
+        while True:
+            for frame in socket.recv_frames():
+                if context.recorder:
+                    context.recorder.record(peer.host, peer.port, frame.msg_type, frame.payload)
+                input_msg = decode_frame(frame)
+                if context.stats:
+                    context.stats.msg_received()
+                if context.response_delay_sec:
+                    coalescer.flush()
+                    log.event(color, "{}: Message from client received, going to sleep for {} sec", name, context.response_delay_sec)
+                    sleep(context.response_delay_sec)
+                output_msg = f"Response to message: {input_msg}"
+                coalescer.send_text_msg(output_msg, correlation_id=frame.correlation_id)
+                log.event(color, "{}: {}", name, output_msg)
+            coalescer.flush()
+    except EOFError:
+        counters = coalescer.get_counters()
+        log.info(f"{name}: EOF - client has disconnected, {counters['msgs']} responses written by {counters['writes']} writes", color)
+    except Exception as e:
+        log.info(f"{name}: Unexpected error: {str(e)}", color)
+    finally:
+        if context.tcp_stats:
+            context.tcp_stats.unregister(name)
+        socket.close()
+
+
 class ClientThread(Thread):
 
     seq = count(1)
 
-    def __init__(self, socket: TCPSocket, response_delay_sec: Optional[float] = None) -> None:
+    def __init__(self, socket: TCPSocket, context: ServerContext) -> None:
         super().__init__(name=f"Worker-{next(self.seq)}", daemon=True)
-        self._response_delay_sec = response_delay_sec
+        self._context = context
         self._color = next_color()
         self._socket = socket
 
     def run(self) -> None:
+        serve_client(self._socket, self._color, self._context)
+
+
+class BoundedWorkerPool:
+
+    # Fixed number of worker threads serving connections taken from a bounded queue of
+    # pending connections. If the queue is full, the overload policy decides:
+    # - reject = the new connection is closed immediately
+    # - queue = the accept loop blocks until there is space in the queue; if there is
+    #   none within the queue timeout, the new connection is closed
+    # - shed-oldest = the oldest pending connection is closed to make space for the new one
+    # Regardless of the policy, pending connections which have been waiting longer than
+    # the queue timeout are closed instead of being served.
+
+    def __init__(self,
+                 thread_count: int,
+                 queue_size: int,
+                 overload_policy: str,
+                 queue_timeout_sec: Optional[float],
+                 context: ServerContext) -> None:
+        self._queue_size = queue_size
+        self._overload_policy = overload_policy
+        self._queue_timeout_sec = queue_timeout_sec
+        self._context = context
+        self._pending = deque()
+        self._lock = Lock()
+        self._not_empty = Condition(self._lock)
+        self._not_full = Condition(self._lock)
+        self._counters = {
+            "submitted": 0,
+            "served": 0,
+            "rejected": 0,
+            "shed": 0,
+            "expired": 0,
+            "queue_high_water_mark": 0,
+        }
+        for i in range(1, thread_count + 1):
+            Thread(target=self._run_worker, name=f"Worker-{i}", daemon=True).start()
+
+    def submit(self, connection: TCPSocket, remote_address: RemoteAddress) -> None:
+        dropped_connection = None
+        with self._lock:
+            self._counters["submitted"] += 1
+            if len(self._pending) >= self._queue_size:
+                if self._overload_policy == "reject":
+                    self._counters["rejected"] += 1
+                    dropped_connection, dropped_address = connection, remote_address
+                elif self._overload_policy == "shed-oldest":
+                    self._counters["shed"] += 1
+                    _, dropped_connection, dropped_address = self._pending.popleft()
+                elif not self._not_full.wait_for(lambda: len(self._pending) < self._queue_size, self._queue_timeout_sec):
+                    self._counters["rejected"] += 1
+                    dropped_connection, dropped_address = connection, remote_address
+            if dropped_connection is not connection:
+                self._pending.append((monotonic(), connection, remote_address))
+                self._counters["queue_high_water_mark"] = max(self._counters["queue_high_water_mark"], len(self._pending))
+                self._not_empty.notify()
+        if dropped_connection:
+            self._context.log.info(f"Overload ({self._overload_policy}) - connection from ({dropped_address.host}:{dropped_address.port}) closed")
+            dropped_connection.close()
+
+    def get_counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def _run_worker(self) -> None:
+        while True:
+            with self._lock:
+                self._not_empty.wait_for(lambda: self._pending)
+                enqueue_time, connection, remote_address = self._pending.popleft()
+                self._not_full.notify()
+                expired = self._queue_timeout_sec is not None and monotonic() - enqueue_time > self._queue_timeout_sec
+                self._counters["expired" if expired else "served"] += 1
+            if expired:
+                self._context.log.info(f"Connection from ({remote_address.host}:{remote_address.port}) expired in the queue - closed")
+                connection.close()
+                continue
+            serve_client(connection, next_color(), self._context)
+
+
+class ClientTask:
+
+    seq = count(1)
+
+    def __init__(self, socket: AsyncTCPSocket, context: ServerContext) -> None:
+        self._name = f"Task-{next(self.seq)}"
+        self._context = context
+        self._color = next_color()
+        self._socket = socket
+
+    async def run(self) -> None:
+        context, log = self._context, self._context.log
+        if context.socket_tuning:
+            log.info(f"{self._name}: Socket tuning: {format_socket_tuning(self._socket.get_socket_tuning())}", self._color)
+        if context.tcp_stats:
+            context.tcp_stats.register(self._name, self._socket)
+        peer = self._socket.get_remote_address() if context.recorder else None
         try:
             while True:
-                input_msg = self._socket.recv_text_msg()
-                if self._response_delay_sec:
-                    print(f"{self._color}{current_thread().name}: Message from client received, going to sleep for {self._response_delay_sec} sec{Style.RESET_ALL}")
-                    sleep(self._response_delay_sec)
+                frame = await self._socket.recv_frame()
+                if context.recorder:
+                    context.recorder.record(peer.host, peer.port, frame.msg_type, frame.payload)
+                input_msg = decode_frame(frame)
+                if context.stats:
+                    context.stats.msg_received()
+                if context.response_delay_sec:
+                    log.event(self._color, "{}: Message from client received, going to sleep for {} sec", self._name, context.response_delay_sec)
+                    await async_sleep(context.response_delay_sec)
                 output_msg = f"Response to message: {input_msg}"
-                self._socket.send_text_msg(output_msg)
-                print(f"{self._color}{current_thread().name}: {output_msg}{Style.RESET_ALL}")
+                await self._socket.send_text_msg(output_msg, correlation_id=frame.correlation_id)
+                log.event(self._color, "{}: {}", self._name, output_msg)
         except EOFError:
-            print(f"{self._color}{current_thread().name}: EOF - client has disconnected{Style.RESET_ALL}")
+            log.info(f"{self._name}: EOF - client has disconnected", self._color)
         except Exception as e:
-            print(f"{self._color}{current_thread().name}: Unexpected error: {str(e)}{Style.RESET_ALL}")
+            log.info(f"{self._name}: Unexpected error: {str(e)}", self._color)
         finally:
-            self._socket.close()
+            if context.tcp_stats:
+                context.tcp_stats.unregister(self._name)
+            await self._socket.close()
 
 
 def create_cmd_line_args_parser() -> ArgumentParser:
@@ -79,8 +367,11 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="the IP address the server has to bind to (use 0.0.0.0 to bind to all network interfaces)"
     )
     parser.add_argument(
-        "port",
-        help="the TCP port the server has to bind to (between 1024 and 65535)",
+        "ports",
+        help="the TCP port(s) the server has to bind to (between 1024 and 65535); if several ports\n"
+             "are specified, all of them are served by the same accept loop",
+        metavar="port",
+        nargs="+",
         type=int
     )
     parser.add_argument(
@@ -103,6 +394,121 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="optional response delay in seconds (default = no delay)",
         type=float,
     )
+    parser.add_argument(
+        "-e", "--engine",
+        dest="engine",
+        default="threads",
+        choices=["threads", "asyncio"],
+        help="optional server engine; threads = one thread per connection, asyncio = all connections\n"
+             "served by a single asyncio event loop (default = threads)",
+        type=str
+    )
+    parser.add_argument(
+        "-b", "--backlog",
+        dest="backlog",
+        default=5,
+        help="optional backlog of the listening socket, i.e. the max. number of connections\n"
+             "waiting to be accepted (default = 5)",
+        type=int,
+    )
+    parser.add_argument(
+        "-t", "--max-threads",
+        dest="max_threads",
+        help="optional size of the pool of worker threads (threads engine only); if not specified,\n"
+             "a new thread is started for each connection (default = no pool)",
+        type=int,
+    )
+    parser.add_argument(
+        "-q", "--queue-size",
+        dest="queue_size",
+        default=100,
+        help="optional max. number of accepted connections waiting for a worker thread (default = 100)",
+        type=int,
+    )
+    parser.add_argument(
+        "-o", "--overload-policy",
+        dest="overload_policy",
+        default="reject",
+        choices=["reject", "queue", "shed-oldest"],
+        help="optional policy applied when the queue of pending connections is full (default = reject):\n"
+             "reject = the new connection is closed\n"
+             "queue = the server stops accepting connections until there is space in the queue\n"
+             "shed-oldest = the oldest pending connection is closed",
+        type=str,
+    )
+    parser.add_argument(
+        "--queue-timeout-sec",
+        dest="queue_timeout_sec",
+        help="optional max. time in seconds a connection can wait in the queue; connections waiting\n"
+             "longer are closed instead of being served; with the queue overload policy, it also limits\n"
+             "the time a new connection waits for space in the queue (default = no timeout)",
+        type=float,
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        dest="workers",
+        help="optional number of worker processes, each of them binding its own listener with\n"
+             "SO_REUSEPORT; a supervisor restarts crashed workers (default = single process)",
+        type=int,
+    )
+    parser.add_argument(
+        "--stats-interval-sec",
+        dest="stats_interval_sec",
+        default=10,
+        help="optional interval in seconds between two per-worker statistics reports (default = 10 sec)",
+        type=float,
+    )
+    parser.add_argument(
+        "-z", "--compression",
+        dest="compression",
+        choices=get_compression_names(),
+        help="optional compression of the payloads of outgoing messages; it is only applied if\n"
+             "the handshake confirms the client supports it (default = no compression)",
+        type=str
+    )
+    parser.add_argument(
+        "--compression-threshold",
+        dest="compression_threshold",
+        default=1024,
+        help="optional min. payload size in bytes for the compression to be applied (default = 1024)",
+        type=int
+    )
+    parser.add_argument(
+        "--max-frame-size",
+        dest="max_frame_size",
+        default=16 * 1024 * 1024,
+        help="optional max. payload size in bytes of a received frame; a client sending a bigger frame\n"
+             "is disconnected (default = 16 MiB)",
+        type=int,
+    )
+    parser.add_argument(
+        "--tcp-stats-interval-sec",
+        dest="tcp_stats_interval_sec",
+        help="optional interval in seconds between two collections of the TCP_INFO-based stats of all\n"
+             "connections (Linux only); the aggregated stats are printed when the server receives\n"
+             "SIGUSR1 (default = no stats collected)",
+        type=float,
+    )
+    parser.add_argument(
+        "--coalesce-max-bytes",
+        dest="coalesce_max_bytes",
+        default=16384,
+        help="optional number of buffered response bytes which triggers a write when answering\n"
+             "pipelined requests (threads engine only); 0 means each response is written at once\n"
+             "(default = 16384)",
+        type=int,
+    )
+    parser.add_argument(
+        "--coalesce-max-delay-sec",
+        dest="coalesce_max_delay_sec",
+        default=0.001,
+        help="optional max. time in seconds a buffered response can wait for further responses\n"
+             "before it is written (default = 0.001 sec)",
+        type=float,
+    )
+    add_record_cmd_line_args(parser)
+    add_socket_tuning_cmd_line_args(parser)
+    add_log_cmd_line_args(parser)
 
     return parser
 
@@ -110,45 +516,294 @@ def create_cmd_line_args_parser() -> ArgumentParser:
 def parse_cmd_line_args() -> Namespace:
     parser = create_cmd_line_args_parser()
     params = parser.parse_args()
-    if not (1024 <= params.port <= 65535):
+    if not all(1024 <= port <= 65535 for port in params.ports):
         parser.error("Port must be between 1024 and 65535.")
+    if params.max_threads is not None and params.max_threads < 1:
+        parser.error("Max. number of threads must be a positive number.")
+    if params.queue_size < 1:
+        parser.error("Queue size must be a positive number.")
+    if params.queue_timeout_sec is not None and params.queue_timeout_sec <= 0:
+        parser.error("Queue timeout must be a positive number.")
+    if params.tcp_stats_interval_sec is not None:
+        if params.tcp_stats_interval_sec <= 0:
+            parser.error("TCP stats interval must be a positive number.")
+        if not is_tcp_info_supported():
+            parser.error("TCP stats are only supported on Linux.")
+    if params.compression_threshold < 0:
+        parser.error("Compression threshold must not be a negative number.")
+    if params.max_frame_size < 1:
+        parser.error("Max. frame size must be a positive number.")
+    if params.coalesce_max_bytes < 0:
+        parser.error("Coalesce max. bytes must not be a negative number.")
+    if params.coalesce_max_delay_sec < 0:
+        parser.error("Coalesce max. delay must not be a negative number.")
+    validate_record_cmd_line_args(parser, params)
+    if params.workers is not None:
+        if params.workers < 1:
+            parser.error("Number of workers must be a positive number.")
+        if not is_reuse_port_supported():
+            parser.error("Worker processes require SO_REUSEPORT which is not supported on this platform.")
+        if params.record_file:
+            parser.error("Recording is not supported with worker processes.")
+        params.reuse_port = True
     return params
 
 
+def serve_with_threads(selector: TCPListenerSelector, context: ServerContext) -> None:
+    while True:
+        for connection, remote_address in selector.accept():
+            context.log.info(f"Client connection accepted from ({remote_address.host}:{remote_address.port})...")
+            if context.stats:
+                context.stats.connection_accepted()
+            client_thread = ClientThread(connection, context)
+            client_thread.start()
+
+
+def serve_with_worker_pool(selector: TCPListenerSelector, cmd_line_args: Namespace, context: ServerContext) -> None:
+    pool = BoundedWorkerPool(
+        thread_count=cmd_line_args.max_threads,
+        queue_size=cmd_line_args.queue_size,
+        overload_policy=cmd_line_args.overload_policy,
+        queue_timeout_sec=cmd_line_args.queue_timeout_sec,
+        context=context,
+    )
+    try:
+        while True:
+            for connection, remote_address in selector.accept():
+                context.log.info(f"Client connection accepted from ({remote_address.host}:{remote_address.port})...")
+                if context.stats:
+                    context.stats.connection_accepted()
+                pool.submit(connection, remote_address)
+    finally:
+        counters = pool.get_counters()
+        context.log.info("Worker pool: " + ", ".join(f"{name} = {value}" for name, value in counters.items()))
+
+
+async def serve_with_asyncio(listeners: List[TCPListener], context: ServerContext) -> None:
+    async def handle_client(connection: AsyncTCPSocket, remote_address: RemoteAddress) -> None:
+        context.log.info(f"Client connection accepted from ({remote_address.host}:{remote_address.port})...")
+        if context.stats:
+            context.stats.connection_accepted()
+        await ClientTask(connection, context).run()
+
+    servers = [await listener.start_async_server(handle_client) for listener in listeners]
+    await gather(*(server.serve_forever() for server in servers))
+
+
+def run_server(cmd_line_args: Namespace, stats: Optional[WorkerStats] = None) -> None:
+    # the log (incl. its background thread) is created by the process using it, as
+    # threads are not inherited by the worker processes
+    log = create_log(cmd_line_args)
+    tcp_stats = None
+    if cmd_line_args.tcp_stats_interval_sec:
+        from signal import SIGUSR1, signal
+        tcp_stats = TCPStatsCollector(cmd_line_args.tcp_stats_interval_sec, log)
+        signal(SIGUSR1, lambda signal_number, frame: tcp_stats.request_dump())
+    recorder = create_traffic_recorder(cmd_line_args, Transport.TCP)
+    context = ServerContext(
+        log=log,
+        response_delay_sec=cmd_line_args.response_delay_sec,
+        stats=stats,
+        tcp_stats=tcp_stats,
+        socket_tuning=cmd_line_args.socket_tuning,
+        coalesce_max_bytes=cmd_line_args.coalesce_max_bytes,
+        coalesce_max_delay_sec=cmd_line_args.coalesce_max_delay_sec,
+        recorder=recorder,
+    )
+    listeners = []
+    try:
+        for port in cmd_line_args.ports:
+            listener = open_tcp_listener(
+                address=cmd_line_args.address,
+                port=port,
+                reuse_address=cmd_line_args.reuse_address,
+                reuse_port=cmd_line_args.reuse_port,
+                backlog=cmd_line_args.backlog,
+                compression=cmd_line_args.compression,
+                compression_threshold=cmd_line_args.compression_threshold,
+                tuning=cmd_line_args.socket_tuning,
+                max_frame_size=cmd_line_args.max_frame_size,
+            )
+            listeners.append(listener)
+            context.log.info(f"TCP server (PID = {getpid()}) is listening on {cmd_line_args.address}:{port}...")
+            context.log.info(f"SO_REUSEADDR = {listener.get_reuse_address()}, SO_REUSEPORT = {listener.get_reuse_port()}")
+            if cmd_line_args.socket_tuning:
+                context.log.info(f"Listener socket tuning: {format_socket_tuning(listener.get_socket_tuning())}")
+        if cmd_line_args.engine == "asyncio":
+            run(serve_with_asyncio(listeners, context))
+            return
+        selector = TCPListenerSelector(listeners)
+        try:
+            if cmd_line_args.max_threads:
+                serve_with_worker_pool(selector, cmd_line_args, context)
+            else:
+                serve_with_threads(selector, context)
+        finally:
+            selector.close()
+    finally:
+        for listener in listeners:
+            listener.close()
+        if recorder:
+            recorder.close()
+            context.log.info(f"{recorder.get_record_count()} messages recorded to {cmd_line_args.record_file}")
+        context.log.info(f"Buffer pool (PID = {getpid()}): {format_buffer_pool_stats(get_buffer_pool().get_stats())}")
+        context.log.close()
+
+
+def run_worker(cmd_line_args: Namespace, counters: Array, worker_index: int) -> None:
+    try:
+        run_server(cmd_line_args, WorkerStats(counters, worker_index))
+    except KeyboardInterrupt:
+        ...
+    except Exception as e:
+        # non-zero exit code makes the supervisor restart the worker
+        print(f"Worker #{worker_index} (PID = {getpid()}): exception caught: {str(e)}")
+        exit(1)
+
+
+def start_worker(cmd_line_args: Namespace, counters: Array, worker_index: int) -> Process:
+    worker = Process(target=run_worker, args=(cmd_line_args, counters, worker_index), name=f"Worker-Process-{worker_index}")
+    worker.start()
+    print(f"Worker #{worker_index} started (PID = {worker.pid})")
+    return worker
+
+
+def print_worker_stats(workers: List[Process], counters: Array, restart_counts: List[int]) -> None:
+    total_connection_count, total_msg_count = 0, 0
+    for worker_index, worker in enumerate(workers):
+        connection_count = counters[2 * worker_index]
+        msg_count = counters[2 * worker_index + 1]
+        total_connection_count += connection_count
+        total_msg_count += msg_count
+        print(f"Worker #{worker_index} (PID = {worker.pid}): connections = {connection_count}, messages = {msg_count}, restarts = {restart_counts[worker_index]}")
+    print(f"Total: connections = {total_connection_count}, messages = {total_msg_count}")
+
+
+def forward_tcp_stats_requests(workers: List[Process]) -> None:
+    # each worker collects the stats of its own connections, so SIGUSR1 received by
+    # the supervisor is forwarded to all workers; the handler is inherited by the worker
+    # processes until they install their own one, hence the PID check
+    from signal import SIGUSR1, signal
+    supervisor_pid = getpid()
+
+    def forward(signal_number: int, frame: object) -> None:
+        if getpid() != supervisor_pid:
+            return
+        for worker in workers:
+            if worker.is_alive():
+                kill(worker.pid, SIGUSR1)
+
+    signal(SIGUSR1, forward)
+
+
+# a worker terminated with an error sooner than this after its start has failed quickly;
+# such failures delay the restart (1, 3, 7, ... sec) up to the max. delay, and after the
+# given number of consecutive quick failures, the worker is not restarted any more
+_WORKER_QUICK_FAILURE_SEC = 10
+_WORKER_MAX_RESTART_DELAY_SEC = 60
+_WORKER_MAX_QUICK_FAILURES = 5
+
+
+def supervise_workers(cmd_line_args: Namespace) -> None:
+    # each worker binds its own listener with SO_REUSEPORT, so the kernel balances
+    # the incoming connections across the workers
+    # the crash of a worker which has run just shortly (e.g. because of an occupied
+    # port) is likely to repeat, so it is not restarted at once; the supervisor exits
+    # when all workers have been given up
+    counters = RawArray("q", 2 * cmd_line_args.workers)
+    restart_counts = [0] * cmd_line_args.workers
+    quick_failure_counts = [0] * cmd_line_args.workers
+    restart_times: List[Optional[float]] = [None] * cmd_line_args.workers
+    workers = [start_worker(cmd_line_args, counters, worker_index) for worker_index in range(cmd_line_args.workers)]
+    start_times = [monotonic()] * cmd_line_args.workers
+    given_up = set()
+    if cmd_line_args.tcp_stats_interval_sec:
+        forward_tcp_stats_requests(workers)
+    last_stats_time = monotonic()
+    try:
+        while len(given_up) < len(workers):
+            sleep(1)
+            for worker_index, worker in enumerate(workers):
+                if worker_index in given_up or worker.is_alive() or worker.exitcode == 0:
+                    continue
+                now = monotonic()
+                if restart_times[worker_index] is None:
+                    if now - start_times[worker_index] < _WORKER_QUICK_FAILURE_SEC:
+                        quick_failure_counts[worker_index] += 1
+                    else:
+                        quick_failure_counts[worker_index] = 0
+                    if quick_failure_counts[worker_index] >= _WORKER_MAX_QUICK_FAILURES:
+                        print(f"Worker #{worker_index} (PID = {worker.pid}) terminated with exit code {worker.exitcode}, giving up after {quick_failure_counts[worker_index]} quick failures")
+                        given_up.add(worker_index)
+                        continue
+                    delay_sec = min(_WORKER_MAX_RESTART_DELAY_SEC, 2 ** quick_failure_counts[worker_index] - 1)
+                    restart_times[worker_index] = now + delay_sec
+                    print(f"Worker #{worker_index} (PID = {worker.pid}) terminated with exit code {worker.exitcode}, going to restart it in {delay_sec} sec")
+                if now >= restart_times[worker_index]:
+                    restart_counts[worker_index] += 1
+                    restart_times[worker_index] = None
+                    workers[worker_index] = start_worker(cmd_line_args, counters, worker_index)
+                    start_times[worker_index] = monotonic()
+            if monotonic() - last_stats_time >= cmd_line_args.stats_interval_sec:
+                print_worker_stats(workers, counters, restart_counts)
+                last_stats_time = monotonic()
+    except KeyboardInterrupt:
+        print("Keyboard interrupt - going to stop the workers")
+        return
+    finally:
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        print_worker_stats(workers, counters, restart_counts)
+    print("All workers have been given up - exit")
+    exit(1)
+
+
+def raise_keyboard_interrupt(signal_number: int, frame: object) -> None:
+    # SIGTERM is turned into KeyboardInterrupt, so a terminated server closes the
+    # recorder (and writes the records not flushed yet) like one stopped by Ctrl+C
+    raise KeyboardInterrupt()
+
+
 def main() -> None:
     colorama_init()
     cmd_line_args = parse_cmd_line_args()
-    print(f"TCP server (PID = {getpid()}) going to bind to {cmd_line_args.address}:{cmd_line_args.port}")
+    ports = ", ".join(str(port) for port in cmd_line_args.ports)
+    print(f"TCP server (PID = {getpid()}) going to bind to {cmd_line_args.address}, port(s) {ports}")
     print(f"Reuse address = {cmd_line_args.reuse_address}, reuse port = {cmd_line_args.reuse_port}")
     print(f"OS = {system()}, SO_REUSEPORT supported = {is_reuse_port_supported()}")
+    print(f"Engine = {cmd_line_args.engine}, backlog = {cmd_line_args.backlog}")
+    if cmd_line_args.max_threads and cmd_line_args.engine == "threads":
+        print(f"Worker pool: threads = {cmd_line_args.max_threads}, queue size = {cmd_line_args.queue_size}, overload policy = {cmd_line_args.overload_policy}, queue timeout = {cmd_line_args.queue_timeout_sec} sec")
     if cmd_line_args.response_delay_sec:
         print(f"Response delay = {cmd_line_args.response_delay_sec} sec")
     else:
         print("No response delay configured")
-    listener = None
+    if cmd_line_args.compression:
+        print(f"Compression = {cmd_line_args.compression}, threshold = {cmd_line_args.compression_threshold} bytes")
+    if cmd_line_args.tcp_stats_interval_sec:
+        print(f"TCP stats collected every {cmd_line_args.tcp_stats_interval_sec} sec, send SIGUSR1 to PID {getpid()} to print them")
+    if cmd_line_args.log_summary_sec:
+        print(f"Log sampling = {cmd_line_args.log_sampling}, summary interval = {cmd_line_args.log_summary_sec} sec")
+    else:
+        print(f"Log sampling = {cmd_line_args.log_sampling}, no summary lines configured")
+    print("Press Ctrl+C to terminate the server.")
 
+    if cmd_line_args.workers:
+        print(f"Workers = {cmd_line_args.workers}, stats interval = {cmd_line_args.stats_interval_sec} sec")
+        supervise_workers(cmd_line_args)
+        return
+
+    if cmd_line_args.record_file:
+        from signal import SIGTERM, signal
+        signal(SIGTERM, raise_keyboard_interrupt)
     try:
-        listener = open_tcp_listener(
-            address=cmd_line_args.address,
-            port=cmd_line_args.port,
-            reuse_address=cmd_line_args.reuse_address,
-            reuse_port=cmd_line_args.reuse_port,
-        )
-        print(f"TCP server is listening on {cmd_line_args.address}:{cmd_line_args.port}...")
-        print(f"SO_REUSEADDR = {listener.get_reuse_address()}, SO_REUSEPORT = {listener.get_reuse_port()}")
-        print("Press Ctrl+C to terminate the server.")
-        while True:
-            connection, remote_address = listener.accept()
-            print(f"Client connection accepted from ({remote_address.host}:{remote_address.port})...")
-            client_thread = ClientThread(connection, cmd_line_args.response_delay_sec)
-            client_thread.start()
+        run_server(cmd_line_args)
     except KeyboardInterrupt:
         print("Keyboard interrupt - exit")
     except Exception as e:
         print(f"Exception caught: {str(e)}")
-    finally:
-        if listener:
-            listener.close()
 
 
 if __name__ == "__main__":
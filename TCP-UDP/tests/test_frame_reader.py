@@ -0,0 +1,64 @@
+#
+# Copyright 2024 Jaroslav Chmurny
+#
+# This file is part of TCP/IP & DNS Sandbox.
+#
+# TCP/IP & DNS Sandbox is free software developed for educational purposes.
+# It is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from random import Random
+from socket import socketpair
+from threading import Thread
+from typing import List
+
+import pytest
+
+from commons import TCPSocket
+
+
+def test_incomplete_frame_does_not_move_batch() -> None:
+    # the second frame fits into the receive buffer, but not behind the first one
+    client, server = (TCPSocket(s) for s in socketpair())
+    try:
+        client.send_text_msg("A" * 30000)
+        client.send_text_msg("B" * 40000)
+        payloads = []
+        while len(payloads) < 2:
+            payloads.extend(bytes(frame.payload) for frame in server.recv_frames(timeout_sec=10))
+        assert payloads == [b"A" * 30000, b"B" * 40000]
+    finally:
+        client.close()
+        server.close()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pipelined_frames_across_buffer_boundary(seed: int) -> None:
+    # all payloads of a batch are checked before the next recv_frames call, which is
+    # the only moment the reader may move or replace its buffer
+    rng = Random(seed)
+    msgs = [chr(ord("a") + i % 26) * rng.choice([1, 50, 100, 3000, 20000, 60000]) for i in range(3000)]
+    client, server = (TCPSocket(s) for s in socketpair())
+    sender = Thread(target=lambda: [client.send_many(msgs[i:i + 100]) for i in range(0, len(msgs), 100)])
+    sender.start()
+    try:
+        received: List[str] = []
+        while len(received) < len(msgs):
+            frames = server.recv_frames(timeout_sec=10)
+            payloads = [str(frame.payload, "utf-8") for frame in frames]
+            assert payloads == msgs[len(received):len(received) + len(payloads)]
+            received.extend(payloads)
+    finally:
+        server.close()
+        sender.join()
+        client.close()
@@ -0,0 +1,119 @@
+#
+# Copyright 2024 Jaroslav Chmurny
+#
+# This file is part of TCP/IP & DNS Sandbox.
+#
+# TCP/IP & DNS Sandbox is free software developed for educational purposes.
+# It is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from json import dumps, loads
+from random import Random
+from typing import Any, List
+
+import pytest
+
+from commons import JSONStreamDecoder
+
+
+def generate_value(rng: Random, depth: int = 0) -> Any:
+    kind = rng.randrange(8 if depth < 3 else 5)
+    if kind == 0:
+        return rng.randint(-10**12, 10**12)
+    if kind == 1:
+        return rng.choice([0.5, -1.25e-7, 3.0e21, rng.random()])
+    if kind == 2:
+        return rng.choice([True, False, None])
+    if kind in (3, 4):
+        # escapes and multi-byte characters, so the chunks also split UTF-8 sequences
+        return "".join(rng.choice("ab \"\\/\n\té€\U0001f600") for _ in range(rng.randrange(12)))
+    if kind in (5, 6):
+        return [generate_value(rng, depth + 1) for _ in range(rng.randrange(6))]
+    return {f"k{i}": generate_value(rng, depth + 1) for i in range(rng.randrange(4))}
+
+
+def generate_document(rng: Random) -> Any:
+    if rng.random() < 0.2:
+        return [generate_value(rng) for _ in range(rng.randrange(20))]
+    return {f"field_{i}": generate_value(rng) for i in range(rng.randrange(8))}
+
+
+def expected_events(document: Any) -> List[tuple]:
+    # the elements of top-level arrays are emitted one by one, empty arrays emit nothing
+    if isinstance(document, list):
+        return [(None, element, index) for index, element in enumerate(document)]
+    events = []
+    for key, value in document.items():
+        if isinstance(value, list):
+            events.extend((key, element, index) for index, element in enumerate(value))
+        else:
+            events.append((key, value, None))
+    return events
+
+
+def decode_in_chunks(data: bytes, rng: Random, max_chunk_size: int) -> List[tuple]:
+    decoder = JSONStreamDecoder()
+    events, offset = [], 0
+    while offset < len(data):
+        chunk_size = rng.randint(1, max_chunk_size)
+        events.extend(decoder.feed(memoryview(data)[offset:offset + chunk_size]))
+        offset += chunk_size
+    events.extend(decoder.close())
+    return [(event.key, event.value, event.index) for event in events]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_chunk_splits_match_json_loads(seed: int) -> None:
+    rng = Random(seed)
+    document = generate_document(rng)
+    text = dumps(document, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 1, 4]))
+    data = bytes(text, "utf-8")
+    expected = expected_events(loads(text))
+    for max_chunk_size in (1, 7, 64, len(data) or 1):
+        assert decode_in_chunks(data, rng, max_chunk_size) == expected
+
+
+@pytest.mark.parametrize("text", [
+    '{"a": 1',
+    '{"a": [1, 2',
+    '{"a" 1}',
+    '{"a": 1,}',
+    '{"a": tru}',
+    '{"a": 1} x',
+    '{1: 2}',
+    '"not an object"',
+])
+def test_invalid_documents_are_rejected(text: str) -> None:
+    decoder = JSONStreamDecoder()
+    with pytest.raises(ValueError):
+        for char in text:
+            decoder.feed(bytes(char, "utf-8"))
+        decoder.close()
+
+
+def test_incomplete_value_exceeding_limit_is_rejected() -> None:
+    decoder = JSONStreamDecoder(max_value_size=100)
+    data = bytes(dumps({"big": "x" * 1000}), "utf-8")
+    with pytest.raises(ValueError, match="exceeds the limit"):
+        for offset in range(0, len(data), 10):
+            decoder.feed(data[offset:offset + 10])
+
+
+def test_long_array_is_not_subject_to_value_limit() -> None:
+    decoder = JSONStreamDecoder(max_value_size=100)
+    data = bytes(dumps({"numbers": list(range(10000))}), "utf-8")
+    events = []
+    for offset in range(0, len(data), 50):
+        events.extend(decoder.feed(data[offset:offset + 50]))
+    events.extend(decoder.close())
+    assert [event.value for event in events] == list(range(10000))
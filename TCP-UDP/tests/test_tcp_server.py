@@ -0,0 +1,57 @@
+#
+# Copyright 2024 Jaroslav Chmurny
+#
+# This file is part of TCP/IP & DNS Sandbox.
+#
+# TCP/IP & DNS Sandbox is free software developed for educational purposes.
+# It is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from random import Random
+from socket import socketpair
+from threading import Thread
+
+from commons import (
+    BackgroundLog,
+    TCPSocket,
+)
+from tcp_server import (
+    ServerContext,
+    serve_client,
+)
+
+
+def test_pipelined_requests_are_echoed_intact() -> None:
+    # the requests of a batch obtained by a single read are answered by coalesced
+    # writes; their sizes vary, so the batches cross the receive buffer boundary
+    rng = Random(1)
+    msgs = [chr(ord("a") + i % 26) * rng.choice([1, 100, 3000, 20000, 60000]) for i in range(1000)]
+    client_socket, server_socket = socketpair()
+    log = BackgroundLog(sampling_rate=0)
+    context = ServerContext(log=log, coalesce_max_bytes=16 * 1024, coalesce_max_delay_sec=0.001)
+    server = Thread(target=serve_client, args=(TCPSocket(server_socket), "", context))
+    server.start()
+    client = TCPSocket(client_socket)
+    # the requests are sent by another thread, so the responses can be read meanwhile;
+    # both threads use the same timeout, so they do not switch it for each other
+    client.set_timeout(10)
+    sender = Thread(target=lambda: [client.send_many(msgs[i:i + 50], timeout_sec=10) for i in range(0, len(msgs), 50)])
+    sender.start()
+    try:
+        for msg in msgs:
+            assert client.recv_text_msg(timeout_sec=10) == f"Response to message: {msg}"
+    finally:
+        sender.join()
+        client.close()
+        server.join(timeout=10)
+        log.close()
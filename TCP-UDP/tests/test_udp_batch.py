@@ -0,0 +1,133 @@
+#
+# Copyright 2024 Jaroslav Chmurny
+#
+# This file is part of TCP/IP & DNS Sandbox.
+#
+# TCP/IP & DNS Sandbox is free software developed for educational purposes.
+# It is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from json import dumps
+from socket import socket, AF_INET, SOCK_DGRAM
+from struct import pack
+from typing import Any, Dict, Iterator, List
+
+import pytest
+
+from commons import (
+    Endpoint,
+    MessageType,
+    UDPSocket,
+    decode_frame,
+    open_udp_client,
+    open_udp_listener,
+)
+
+
+# the batched path needs recvmmsg/sendmmsg, the other one is the fallback taking one
+# datagram per call (used if they are not available)
+@pytest.fixture(params=["mmsg", "fallback"])
+def listener(request: pytest.FixtureRequest) -> Iterator[UDPSocket]:
+    listener = open_udp_listener("127.0.0.1", 0, msg_size=1024)
+    if request.param == "mmsg":
+        if not listener.is_batched_io_supported():
+            listener.close()
+            pytest.skip("recvmmsg/sendmmsg not supported")
+    else:
+        listener._mmsg_functions = None
+    listener.set_timeout(2)
+    yield listener
+    listener.close()
+
+
+def open_client(padded: bool) -> UDPSocket:
+    # bound right away, so its port is known before it sends anything
+    client = open_udp_client(msg_size=1024, padded=padded)
+    client._socket.bind(("127.0.0.1", 0))
+    client.set_timeout(2)
+    return client
+
+
+def get_endpoint(udp_socket: UDPSocket) -> Endpoint:
+    address, port = udp_socket._socket.getsockname()
+    return Endpoint(address=address, port=port)
+
+
+def encode_datagram(msg: Dict[str, Any]) -> bytes:
+    payload = bytes(dumps(msg), "utf-8")
+    return pack(">HH", len(payload), MessageType.JSON) + payload
+
+
+def recv_msgs(listener: UDPSocket, count: int) -> List[tuple[int, Dict[str, Any]]]:
+    # the payloads are only valid until the next recv_frames call, so they are decoded
+    # right away
+    received = []
+    while len(received) < count:
+        for endpoint, frame in listener.recv_frames(8):
+            received.append((endpoint.port, decode_frame(frame)))
+    return received
+
+
+def test_padded_and_variable_size_datagrams_are_received(listener: UDPSocket) -> None:
+    padded_client = open_client(padded=True)
+    variable_size_client = open_client(padded=False)
+    try:
+        expected = []
+        for i in range(20):
+            client = padded_client if i % 2 else variable_size_client
+            msg = {"seq_no": i, "text": "x" * (i * 37)}
+            client.send_json_msg(get_endpoint(listener), msg)
+            expected.append((get_endpoint(client).port, msg))
+        assert recv_msgs(listener, len(expected)) == expected
+        assert listener.get_invalid_datagram_count() == 0
+    finally:
+        padded_client.close()
+        variable_size_client.close()
+
+
+def test_malformed_datagrams_are_skipped(listener: UDPSocket) -> None:
+    raw_client = socket(AF_INET, SOCK_DGRAM)
+    try:
+        raw_client.bind(("127.0.0.1", 0))
+        destination = listener._socket.getsockname()
+        malformed = [
+            b"\x00",
+            pack(">HH", 100, MessageType.JSON) + b"too short",
+            b"",
+        ]
+        expected = []
+        for i in range(9):
+            if i % 3 == 1:
+                raw_client.sendto(malformed[i // 3], destination)
+                continue
+            msg = {"seq_no": i}
+            raw_client.sendto(encode_datagram(msg), destination)
+            expected.append((raw_client.getsockname()[1], msg))
+        assert recv_msgs(listener, len(expected)) == expected
+        assert listener.get_invalid_datagram_count() == len(malformed)
+    finally:
+        raw_client.close()
+
+
+def test_batch_of_responses_is_sent(listener: UDPSocket) -> None:
+    clients = [open_client(padded) for padded in (True, False)]
+    try:
+        msgs = [(get_endpoint(client), {"response": i, "client": j}) for i in range(12) for j, client in enumerate(clients)]
+        # a max. batch size smaller than the number of messages splits them into several calls
+        listener.send_json_msgs(msgs, max_batch_size=5)
+        for j, client in enumerate(clients):
+            received = [client.recv_json_msg()[1] for _ in range(12)]
+            assert received == [{"response": i, "client": j} for i in range(12)]
+    finally:
+        for client in clients:
+            client.close()
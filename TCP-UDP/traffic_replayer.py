@@ -0,0 +1,277 @@
+#
+# Copyright 2024 Jaroslav Chmurny
+#
+# This file is part of TCP/IP & DNS Sandbox.
+#
+# TCP/IP & DNS Sandbox is free software developed for educational purposes.
+# It is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from argparse import (
+    ArgumentParser,
+    Namespace,
+    RawTextHelpFormatter,
+)
+from os import getpid
+from os.path import isfile
+from socket import timeout
+from threading import Thread
+from time import (
+    monotonic,
+    sleep,
+)
+from typing import (
+    Dict,
+    Optional,
+    Union,
+)
+
+from commons import (
+    Endpoint,
+    ProtocolVersion,
+    RemoteAddress,
+    TCPSocket,
+    TrafficLog,
+    TrafficRecord,
+    Transport,
+    open_tcp_connection,
+    add_udp_datagram_cmd_line_args,
+    open_udp_client,
+)
+
+
+class ResponseDrain(Thread):
+
+    # Reads (and discards) the responses sent by the server over a replayed connection,
+    # so the server never blocks writing them.
+
+    def __init__(self, socket: TCPSocket) -> None:
+        super().__init__(daemon=True)
+        self._socket = socket
+        self.response_count = 0
+
+    def run(self) -> None:
+        try:
+            while True:
+                self._socket.recv_frame()
+                self.response_count += 1
+        except (EOFError, OSError):
+            pass
+
+
+class TCPReplayTarget:
+
+    # Each peer of the recorded traffic is replayed over its own connection, so the
+    # messages of a connection keep their order.
+
+    def __init__(self, cmd_line_args: Namespace) -> None:
+        self._cmd_line_args = cmd_line_args
+        self._connections: Dict[RemoteAddress, tuple[TCPSocket, ResponseDrain]] = {}
+
+    def send(self, record: TrafficRecord) -> None:
+        if record.peer not in self._connections:
+            self._connections[record.peer] = self._open_connection()
+        socket, _ = self._connections[record.peer]
+        socket.send_encoded_msg(record.msg_type, record.payload)
+
+    def close(self) -> str:
+        # the connections are half-closed, so the responses still on the way are read
+        for socket, _ in self._connections.values():
+            socket.shutdown_output()
+        response_count = 0
+        for socket, drain in self._connections.values():
+            drain.join(self._cmd_line_args.drain_timeout_sec)
+            response_count += drain.response_count
+            socket.close()
+        return f"Connections = {len(self._connections)}, responses received = {response_count}"
+
+    def _open_connection(self) -> tuple[TCPSocket, ResponseDrain]:
+        socket = open_tcp_connection(
+            self._cmd_line_args.address,
+            self._cmd_line_args.port,
+            self._cmd_line_args.connect_timeout_sec,
+            ProtocolVersion(self._cmd_line_args.protocol_version),
+        )
+        drain = ResponseDrain(socket)
+        drain.start()
+        return socket, drain
+
+
+class UDPReplayTarget:
+
+    # All messages are sent from a single socket; the responses (if any) are ignored.
+
+    def __init__(self, cmd_line_args: Namespace) -> None:
+        self._socket = open_udp_client(
+            cmd_line_args.msg_size,
+            padded=not cmd_line_args.variable_size,
+            mtu=cmd_line_args.mtu,
+        )
+        self._dst = Endpoint(address=cmd_line_args.address, port=cmd_line_args.port)
+
+    def send(self, record: TrafficRecord) -> None:
+        self._socket.send_encoded_msg(self._dst, record.msg_type, record.payload)
+
+    def close(self) -> str:
+        self._socket.close()
+        return "No responses read (UDP)"
+
+
+def create_cmd_line_args_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="Traffic Replayer", formatter_class=RawTextHelpFormatter)
+
+    parser.add_argument(
+        "record_file",
+        help="the traffic log recorded by tcp_server.py or udp_server.py (--record-file switch)"
+    )
+    parser.add_argument(
+        "address",
+        help="the IP address of the server the traffic has to be replayed to"
+    )
+    parser.add_argument(
+        "port",
+        help="the port of the server the traffic has to be replayed to (TCP or UDP, depending on the log)",
+        type=int
+    )
+    parser.add_argument(
+        "-s", "--speed",
+        dest="speed",
+        default=1,
+        help="optional replay speed; 1 = original timing, N = N-times faster, 0 = as fast as possible\n"
+             "(default = 1)",
+        type=float,
+    )
+    parser.add_argument(
+        "--start-sec",
+        dest="start_sec",
+        help="optional offset in seconds (relative to the first recorded message) the replay starts at;\n"
+             "the index of the log is used to seek to it (default = beginning of the log)",
+        type=float,
+    )
+    parser.add_argument(
+        "--end-sec",
+        dest="end_sec",
+        help="optional offset in seconds (relative to the first recorded message) the replay ends at\n"
+             "(default = end of the log)",
+        type=float,
+    )
+    parser.add_argument(
+        "-t", "--connect-timeout-sec",
+        dest="connect_timeout_sec",
+        default=10,
+        help="optional connect timeout in seconds (TCP only, default = 10 sec)",
+        type=int
+    )
+    parser.add_argument(
+        "-P", "--protocol-version",
+        dest="protocol_version",
+        default=2,
+        choices=[1, 2],
+        help="optional max. protocol version negotiated with the server (TCP only, default = 2)",
+        type=int,
+    )
+    parser.add_argument(
+        "--drain-timeout-sec",
+        dest="drain_timeout_sec",
+        default=10,
+        help="optional max. time in seconds to wait for the outstanding responses at the end of the\n"
+             "replay (TCP only, default = 10 sec)",
+        type=float,
+    )
+    parser.add_argument(
+        "-m", "--msg-size",
+        dest="msg_size",
+        default=4096,
+        help="optional size (max. size with --variable-size) of the datagrams in bytes; it must not exceed\n"
+             "the datagram size of the server (UDP only, default = 4096)",
+        type=int,
+    )
+    add_udp_datagram_cmd_line_args(parser)
+
+    return parser
+
+
+def parse_cmd_line_args() -> Namespace:
+    parser = create_cmd_line_args_parser()
+    params = parser.parse_args()
+    if not isfile(params.record_file):
+        parser.error(f"File {params.record_file} does not exist.")
+    if params.speed < 0:
+        parser.error("Speed must not be a negative number.")
+    if params.start_sec is not None and params.start_sec < 0:
+        parser.error("Start offset must not be a negative number.")
+    if params.end_sec is not None and params.start_sec is not None and params.end_sec < params.start_sec:
+        parser.error("End offset must not be less than start offset.")
+    if params.mtu is not None and not params.variable_size:
+        parser.error("MTU is only applicable with --variable-size.")
+    return params
+
+
+def to_timestamp(start_time: float, offset_sec: Optional[float]) -> Optional[float]:
+    return None if offset_sec is None else start_time + offset_sec
+
+
+def replay(log: TrafficLog, target: Union[TCPReplayTarget, UDPReplayTarget], cmd_line_args: Namespace, start_time: float) -> None:
+    # the send time of each message is derived from its timestamp, so the replay does
+    # not drift; the lag is how late a message has been sent compared to its schedule
+    speed = cmd_line_args.speed
+    first_timestamp = None
+    msg_count, byte_count, max_lag_sec = 0, 0, 0.0
+    replay_start_time = monotonic()
+    for record in log.read(to_timestamp(start_time, cmd_line_args.start_sec), to_timestamp(start_time, cmd_line_args.end_sec)):
+        if first_timestamp is None:
+            first_timestamp = record.timestamp
+        if speed:
+            lag_sec = monotonic() - replay_start_time - (record.timestamp - first_timestamp) / speed
+            if lag_sec < 0:
+                sleep(-lag_sec)
+            else:
+                max_lag_sec = max(max_lag_sec, lag_sec)
+        target.send(record)
+        msg_count += 1
+        byte_count += len(record.payload)
+    duration_sec = monotonic() - replay_start_time
+    print(f"Messages replayed = {msg_count}, payload bytes = {byte_count}, duration = {duration_sec:.3f} sec")
+    print(f"Rate = {msg_count / max(duration_sec, 1e-9):.1f} msg/sec, max. lag = {1000 * max_lag_sec:.3f} ms")
+
+
+def main() -> None:
+    cmd_line_args = parse_cmd_line_args()
+    print(f"Traffic replayer (PID = {getpid()}) going to replay {cmd_line_args.record_file} to {cmd_line_args.address}:{cmd_line_args.port}")
+    log = None
+    target = None
+    try:
+        log = TrafficLog(cmd_line_args.record_file)
+        start_time, end_time = log.get_start_time(), log.get_end_time()
+        if start_time is None:
+            print("The log does not contain any message")
+            return
+        print(f"Transport = {log.get_transport().name}, recorded traffic duration = {end_time - start_time:.3f} sec")
+        print(f"Speed = {cmd_line_args.speed or 'as fast as possible'}")
+        target = TCPReplayTarget(cmd_line_args) if log.get_transport() == Transport.TCP else UDPReplayTarget(cmd_line_args)
+        replay(log, target, cmd_line_args, start_time)
+    except KeyboardInterrupt:
+        print("Keyboard interrupt - exit")
+    except (timeout, TimeoutError, ConnectionRefusedError, ConnectionResetError) as e:
+        print(f"{type(e).__name__}: {str(e)}")
+    except Exception as e:
+        print(f"Exception caught: {str(e)}")
+    finally:
+        if target:
+            print(target.close())
+        if log:
+            log.close()
+
+
+if __name__ == "__main__":
+    main()
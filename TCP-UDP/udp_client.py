@@ -21,7 +21,14 @@ from argparse import ArgumentParser, Namespace, RawTextHelpFormatter
 from os import getpid
 from uuid import uuid4
 
-from commons import Endpoint, open_udp_client, random_sleep
+from commons import (
+    Endpoint,
+    add_socket_tuning_cmd_line_args,
+    add_udp_datagram_cmd_line_args,
+    format_socket_tuning,
+    open_udp_client,
+    random_sleep,
+)
 
 
 def create_cmd_line_args_parser() -> ArgumentParser:
@@ -50,6 +57,8 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="optional client name (if not specified, generated UUID will be used)",
         type=str
     )
+    add_socket_tuning_cmd_line_args(parser)
+    add_udp_datagram_cmd_line_args(parser)
 
     return parser
 
@@ -57,6 +66,8 @@ def create_cmd_line_args_parser() -> ArgumentParser:
 def parse_cmd_line_args() -> Namespace:
     parser = create_cmd_line_args_parser()
     params = parser.parse_args()
+    if params.mtu is not None and not params.variable_size:
+        parser.error("MTU is only applicable with --variable-size.")
     return params
 
 
@@ -65,7 +76,9 @@ def main() -> None:
     client_name = cmd_line_args.client_name or str(uuid4())
     destination = Endpoint(cmd_line_args.address, cmd_line_args.port)
     print(f"UDP client (PID = {getpid()}) going to send messages to {cmd_line_args.address}:{cmd_line_args.port}")
-    client = open_udp_client()
+    client = open_udp_client(padded=not cmd_line_args.variable_size, mtu=cmd_line_args.mtu)
+    if cmd_line_args.socket_tuning:
+        print(f"Socket tuning: {format_socket_tuning(client.apply_socket_tuning(cmd_line_args.socket_tuning))}")
     for i in range(1, cmd_line_args.msg_count + 1):
         output_msg = f"Message #{i} from client {client_name}"
         client.send_text_msg(destination, output_msg)
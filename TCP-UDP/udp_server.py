@@ -19,11 +19,27 @@
 
 from argparse import ArgumentParser, Namespace, RawTextHelpFormatter
 from os import getpid
+from signal import SIGTERM, signal
 
 from colorama import init as colorama_init
-from colorama import Style
 
-from commons import Endpoint, next_color, open_udp_listener
+from commons import (
+    Endpoint,
+    Transport,
+    add_log_cmd_line_args,
+    add_record_cmd_line_args,
+    add_socket_tuning_cmd_line_args,
+    add_udp_datagram_cmd_line_args,
+    create_log,
+    create_traffic_recorder,
+    decode_frame,
+    format_buffer_pool_stats,
+    format_socket_tuning,
+    get_buffer_pool,
+    next_color,
+    open_udp_listener,
+    validate_record_cmd_line_args,
+)
 
 
 class ColorRegistry:
@@ -49,6 +65,19 @@ def create_cmd_line_args_parser() -> ArgumentParser:
         help="the UDP port the server has to bind to",
         type=int
     )
+    parser.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        default=32,
+        help="optional max. number of datagrams received (and answered) by a single system call; the\n"
+             "datagrams already queued are taken without waiting for a full batch; recvmmsg/sendmmsg\n"
+             "are used on Linux, one call per datagram elsewhere (default = 32)",
+        type=int,
+    )
+    add_record_cmd_line_args(parser)
+    add_socket_tuning_cmd_line_args(parser)
+    add_udp_datagram_cmd_line_args(parser)
+    add_log_cmd_line_args(parser)
 
     return parser
 
@@ -56,25 +85,71 @@ def create_cmd_line_args_parser() -> ArgumentParser:
 def parse_cmd_line_args() -> Namespace:
     parser = create_cmd_line_args_parser()
     params = parser.parse_args()
+    validate_record_cmd_line_args(parser, params)
+    if params.mtu is not None and not params.variable_size:
+        parser.error("MTU is only applicable with --variable-size.")
+    if params.batch_size < 1:
+        parser.error("Batch size must be a positive number.")
     return params
 
 
+def raise_keyboard_interrupt(signal_number: int, frame: object) -> None:
+    # SIGTERM is turned into KeyboardInterrupt, so a terminated server closes the
+    # recorder (and writes the records not flushed yet) like one stopped by Ctrl+C
+    raise KeyboardInterrupt()
+
+
 def main() -> None:
     colorama_init()
     cmd_line_args = parse_cmd_line_args()
     print(f"UDP server (PID = {getpid()}) going to bind to {cmd_line_args.address}:{cmd_line_args.port}")
     
+    log = create_log(cmd_line_args)
+    recorder = create_traffic_recorder(cmd_line_args, Transport.UDP)
+    if recorder:
+        signal(SIGTERM, raise_keyboard_interrupt)
+    udp_listener = None
     try:
-        udp_listener = open_udp_listener(cmd_line_args.address, cmd_line_args.port)
+        udp_listener = open_udp_listener(
+            cmd_line_args.address,
+            cmd_line_args.port,
+            padded=not cmd_line_args.variable_size,
+            mtu=cmd_line_args.mtu,
+        )
+        if cmd_line_args.socket_tuning:
+            log.info(f"Socket tuning: {format_socket_tuning(udp_listener.apply_socket_tuning(cmd_line_args.socket_tuning))}")
+        log.info(f"Batch size = {cmd_line_args.batch_size}, recvmmsg/sendmmsg {'used' if udp_listener.is_batched_io_supported() else 'not available'}")
         color_registry = ColorRegistry()
+        invalid_datagram_count = 0
         while True:
-            endpoint, input_msg = udp_listener.recv_text_msg()
-            color = color_registry.get(endpoint)
-            output_msg = f"Response to message: {input_msg}"
-            udp_listener.send_text_msg(endpoint, output_msg)
-            print(f"{color}{output_msg} send to {endpoint.address}:{endpoint.port}{Style.RESET_ALL}")
+            # the responses to the whole batch are sent by a single call; malformed
+            # datagrams (skipped by recv_frames) and undecodable messages are only logged
+            responses = []
+            for endpoint, frame in udp_listener.recv_frames(cmd_line_args.batch_size):
+                if recorder:
+                    recorder.record(endpoint.address, endpoint.port, frame.msg_type, frame.payload)
+                try:
+                    input_msg = decode_frame(frame)
+                except ValueError as e:
+                    log.info(f"Invalid message from {endpoint.address}:{endpoint.port} ignored: {str(e)}")
+                    continue
+                responses.append((endpoint, f"Response to message: {input_msg}"))
+            if udp_listener.get_invalid_datagram_count() != invalid_datagram_count:
+                log.info(f"Malformed datagram(s) ignored, {udp_listener.get_invalid_datagram_count()} so far")
+                invalid_datagram_count = udp_listener.get_invalid_datagram_count()
+            udp_listener.send_text_msgs(responses, cmd_line_args.batch_size)
+            for endpoint, output_msg in responses:
+                log.event(color_registry.get(endpoint), "{} send to {}:{}", output_msg, endpoint.address, endpoint.port)
     except KeyboardInterrupt:
-        print("Keyboard interrupt - exit")
+        log.info("Keyboard interrupt - exit")
+    finally:
+        if udp_listener:
+            udp_listener.close()
+        if recorder:
+            recorder.close()
+            log.info(f"{recorder.get_record_count()} messages recorded to {cmd_line_args.record_file}")
+        log.info(f"Buffer pool: {format_buffer_pool_stats(get_buffer_pool().get_stats())}")
+        log.close()
 
 
 if __name__ == "__main__":